@@ -0,0 +1,129 @@
+"""
+Cached, vectorized access to run results for plotting and analysis.
+
+Every run is loaded once per process (see load()) and all derived metrics are computed on whole numpy arrays.
+"""
+import functools
+import os
+
+import numpy as np
+
+from result_store import load_run
+from writer import TIME_CREATED_SIZE, PAYLOAD_SIZE
+
+
+# time_created + data, the logical size of a row as written by writer.Writer is the key and these
+ROW_DATA_SIZE = TIME_CREATED_SIZE + PAYLOAD_SIZE
+
+# parts of the names of the runs with BIGINT keys, for the legacy JSON results saved without their row size
+INT64_RUN_NAMES = ("int64", "random", "sequential", "snowflake", "shard_prefix")
+
+
+@functools.lru_cache(maxsize=None)
+def load(name, results_dir="results"):
+    return Run(load_run(name, results_dir), legacy=not os.path.isdir(os.path.join(results_dir, name)))
+
+
+def moving_average(x, w):
+    return np.convolve(x, np.ones(w), 'valid') / w
+
+
+def smooth(x, y, window):
+    """
+    Moving average of y, x is trimmed so that it stays aligned with the averaged values
+    """
+    trim = (window - 1) // 2
+    return x[trim:len(x) - (window - 1 - trim)], moving_average(y, window)
+
+
+def derivative(x, y, window=1):
+    """
+    Windowed derivative dy/dx, aligned with the start of each window
+    """
+    return x[:-window], (y[window:] - y[:-window]) / (x[window:] - x[:-window])
+
+
+def lttb(x, y, threshold):
+    """
+    Downsample a series to `threshold` points with Largest-Triangle-Three-Buckets, which keeps the visual shape
+    of the series (peaks and dips) unlike taking every n-th point
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return x, y
+
+    # the first and the last point are always kept, the rest is split into threshold - 2 buckets
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    prev = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = edges[i + 1], (edges[i + 2] if i + 2 < len(edges) else n)
+        avg_x, avg_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+
+        # area of the triangles formed by the previously selected point, each candidate and the next bucket's average
+        area = np.abs((x[prev] - avg_x) * (y[start:end] - y[prev]) - (x[prev] - x[start:end]) * (avg_y - y[prev]))
+        prev = start + int(np.argmax(area))
+        selected[i + 1] = prev
+
+    return x[selected], y[selected]
+
+
+class Run:
+
+    def __init__(self, data, legacy=False):
+        """
+        :param legacy: The data comes from a legacy results/<name>.json file, see result_store.load_run
+        """
+        self.name = data["name"]
+        self.legacy = legacy
+        self.data = data
+        self.rows = np.asarray(data["rows_written"], dtype=np.float64)
+        self.time = np.asarray(data["time_elapsed"], dtype=np.float64)
+        self.io_write = np.asarray(data["io_write"], dtype=np.float64)
+        self.io_read = np.asarray(data["io_read"], dtype=np.float64)
+        self.db_size = np.asarray(data["db_size"], dtype=np.float64)
+
+    def series(self, key):
+        return np.asarray(self.data[key], dtype=np.float64)
+
+    @property
+    def row_size(self):
+        """
+        Logical size of a row, see writer.logical_row_size. The legacy JSON results were saved without it,
+        for them the key type is guessed from the run name.
+        """
+        if "row_size" in self.data:
+            return self.data["row_size"]
+        if not self.legacy:
+            raise ValueError(f"Run {self.name} has no row size, its meta.json is missing")
+        key_size = 8 if any(part in self.name for part in INT64_RUN_NAMES) else 16
+        return key_size + ROW_DATA_SIZE
+
+    @functools.cached_property
+    def bytes_written_per_row(self):
+        """
+        Bytes written to disk per inserted row between consecutive samples, aligned with self.rows[:-1]
+        """
+        return derivative(self.rows, self.io_write)[1]
+
+    @functools.cached_property
+    def rows_per_sec(self):
+        """
+        Insert throughput between consecutive samples, aligned with self.rows[:-1]
+        """
+        return derivative(self.time, self.rows)[1]
+
+    @functools.cached_property
+    def write_amplification(self):
+        """
+        Cumulative bytes written to disk relative to the logical size of the inserted rows
+        """
+        return self.io_write / (self.rows * self.row_size)
+
+    @functools.cached_property
+    def size_amplification(self):
+        return self.db_size / (self.rows * self.row_size)
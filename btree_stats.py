@@ -0,0 +1,272 @@
+"""
+Shape of the b-trees of the table, to relate the write amplification of a key generator to page splits,
+half-full leaves and leaves out of physical order.
+
+Every reading returns one BTreeStats per b-tree (the table and each of its indexes):
+
+- SQLite: a full non-aggregate dbstat scan, exact fill of every leaf, depth and fragmentation
+- PostgreSQL: pgstatindex for every index (depth, average leaf density, leaf fragmentation)
+  and pgstattuple for the heap, needs the pgstattuple extension, which is created on first use
+- MariaDB: leaf and total pages from the persistent InnoDB statistics, fill of the index pages resident
+  in the buffer pool (all levels, InnoDB doesn't expose the level) and the global page split counter of innodb_metrics
+
+Values the engine doesn't expose are None. SQLite and PostgreSQL don't count page splits, BTreeAnalyzer estimates
+them from the growth of the leaf pages between readings.
+"""
+import numpy as np
+from sqlalchemy import text
+
+FILL_BUCKETS = 10  # leaf fill histogram buckets, 0-10%, 10-20%, ... 90-100%
+
+# leaf and internal pages, ordered by their path, which is the logical (key) order
+SQLITE_PAGES_QUERY = (
+    "SELECT name, path, pageno, pagetype, pgsize, unused FROM dbstat "
+    "WHERE pagetype IN ('leaf', 'internal') AND name IN (SELECT name FROM sqlite_master WHERE tbl_name = ?) "
+    "ORDER BY name, path"
+)
+
+PG_INDEX_STATS_QUERY = text(
+    "SELECT s.indexrelname, i.tree_level, i.internal_pages, i.leaf_pages, i.avg_leaf_density, i.leaf_fragmentation "
+    "FROM pg_stat_user_indexes s, pgstatindex(s.indexrelid::regclass) i WHERE s.relname = :table;"
+)
+
+PG_HEAP_STATS_QUERY = text(
+    "SELECT table_len / current_setting('block_size')::bigint, tuple_percent + dead_tuple_percent "
+    "FROM pgstattuple(:table);"
+)
+
+MARIADB_INDEX_PAGES_QUERY = text(
+    "SELECT index_name, stat_name, stat_value FROM mysql.innodb_index_stats "
+    "WHERE database_name = :schema AND table_name = :table AND stat_name IN ('size', 'n_leaf_pages');"
+)
+
+MARIADB_RESIDENT_PAGES_QUERY = text(
+    "SELECT INDEX_NAME, DATA_SIZE / @@innodb_page_size FROM information_schema.INNODB_BUFFER_PAGE "
+    "WHERE TABLE_NAME = :table_name AND PAGE_TYPE = 'INDEX';"
+)
+
+MARIADB_PAGE_SPLITS_QUERY = text(
+    "SELECT COUNT FROM information_schema.INNODB_METRICS WHERE NAME = 'index_page_splits';"
+)
+
+
+class BTreeStats:
+
+    def __init__(self, name, depth=None, leaf_pages=None, internal_pages=None, leaf_fill=None, avg_leaf_fill=None,
+                 fragmentation=None, page_splits=None):
+        """
+        :param leaf_fill: Used share of every leaf page, numpy array, None if only the average is known
+        :param fragmentation: Share of the leaf pages followed, in key order, by a page with a lower page number
+        :param page_splits: Cumulative page splits, for MariaDB those of the whole server,
+        for SQLite and PostgreSQL estimated by BTreeAnalyzer
+        """
+        self.name = name
+        self.depth = depth
+        self.leaf_pages = leaf_pages
+        self.internal_pages = internal_pages
+        self.leaf_fill = leaf_fill
+        self.avg_leaf_fill = avg_leaf_fill if leaf_fill is None or not len(leaf_fill) else float(leaf_fill.mean())
+        self.fragmentation = fragmentation
+        self.page_splits = page_splits
+
+    def fill_histogram(self):
+        """
+        :return: Number of leaf pages in each of the FILL_BUCKETS, None if the fill of the pages isn't known
+        """
+        if self.leaf_fill is None:
+            return None
+        buckets = np.minimum((self.leaf_fill * FILL_BUCKETS).astype(np.int64), FILL_BUCKETS - 1)
+        return np.bincount(buckets, minlength=FILL_BUCKETS)
+
+
+def fragmentation(page_numbers):
+    """
+    :param page_numbers: Page numbers of the leaves in key order
+    """
+    if len(page_numbers) < 2:
+        return 0.0
+    return float(np.count_nonzero(np.diff(page_numbers) < 0) / len(page_numbers))
+
+
+def sqlite_btree_stats(connection, table):
+    rows = connection.exec_driver_sql(SQLITE_PAGES_QUERY, (table,)).fetchall()
+
+    pages = {}
+    for name, path, pageno, pagetype, pgsize, unused in rows:
+        pages.setdefault(name, []).append((path, pageno, pagetype, pgsize, unused))
+
+    stats = []
+    for name, btree_pages in pages.items():
+        leaves = [(pageno, (pgsize - unused) / pgsize) for _, pageno, pagetype, pgsize, unused in btree_pages
+                  if pagetype == "leaf"]
+        leaf_pagenos = np.array([pageno for pageno, _ in leaves], dtype=np.int64)
+        stats.append(BTreeStats(
+            name,
+            depth=max(path.count("/") for path, *_ in btree_pages),  # "/" is the root, "/000/" its first child
+            leaf_pages=len(leaves),
+            internal_pages=len(btree_pages) - len(leaves),
+            leaf_fill=np.array([fill for _, fill in leaves]),
+            fragmentation=fragmentation(leaf_pagenos),
+        ))
+
+    return stats
+
+
+def pg_btree_stats(connection, table):
+    connection.execute("CREATE EXTENSION IF NOT EXISTS pgstattuple;")
+
+    stats = []
+    heap_pages, tuple_percent = connection.execute(PG_HEAP_STATS_QUERY, {"table": table}).one()
+    stats.append(BTreeStats(table, leaf_pages=heap_pages, avg_leaf_fill=tuple_percent / 100))
+
+    for name, level, internal_pages, leaf_pages, density, leaf_fragmentation in connection.execute(
+            PG_INDEX_STATS_QUERY, {"table": table}):
+        stats.append(BTreeStats(name, depth=level + 1, leaf_pages=leaf_pages, internal_pages=internal_pages,
+                                avg_leaf_fill=density / 100, fragmentation=leaf_fragmentation / 100))
+
+    return stats
+
+
+def mariadb_btree_stats(connection, schema, table):
+    connection.execute("SET GLOBAL innodb_monitor_enable = 'index_page_splits';")
+    page_splits = connection.execute(MARIADB_PAGE_SPLITS_QUERY).scalar()
+
+    pages = {}
+    for name, stat_name, value in connection.execute(MARIADB_INDEX_PAGES_QUERY, {"schema": schema, "table": table}):
+        pages.setdefault(name, {})[stat_name] = int(value)
+
+    resident = {}
+    for name, fill in connection.execute(MARIADB_RESIDENT_PAGES_QUERY, {"table_name": f"`{schema}`.`{table}`"}):
+        resident.setdefault(name, []).append(float(fill))
+
+    return [
+        BTreeStats(name, leaf_pages=index_pages["n_leaf_pages"],
+                   internal_pages=index_pages["size"] - index_pages["n_leaf_pages"],
+                   leaf_fill=np.array(resident[name]) if name in resident else None,
+                   page_splits=page_splits)
+        for name, index_pages in pages.items()
+    ]
+
+
+class BTreeAnalyzer:
+    """
+    Records the BTreeStats of the writer's table whenever sample() is called.
+    The engines not counting page splits get the growth of the leaf pages instead: every split adds a leaf,
+    so it's exact for inserts, but leaves freed by deletes hide as many splits.
+    """
+
+    def __init__(self, writer, store=None, reading_store=None, exclude_io=None):
+        """
+        :param store: result_store.ColumnarWriter with BTREE_COLUMNS, every reading is appended to it
+        :param reading_store: result_store.ColumnarWriter with BTREE_READING_COLUMNS, the I/O of every reading
+        is appended to it
+        :param exclude_io: Function calling its argument with the I/O probe paused and returning its result
+        and IOStats, see sampler.MetricsSampler.exclude_io, None to not measure the I/O of the readings
+        """
+        self._writer = writer
+        self._store = store
+        self._reading_store = reading_store
+        self._exclude_io = exclude_io
+        self.names = []  # names of the b-trees, positions in this list are the btree_id of the series
+        self.last = {}  # name -> last BTreeStats
+        self.series = {
+            "btree_rows_written": [],
+            "btree_id": [],
+            "btree_depth": [],
+            "btree_leaf_pages": [],
+            "btree_internal_pages": [],
+            "btree_leaf_fill": [],
+            "btree_fragmentation": [],
+            "btree_page_splits": [],
+            **{f"btree_fill_{i}": [] for i in range(FILL_BUCKETS)},  # leaf pages in each fill bucket
+        }
+        self.reading_series = {
+            "btree_reading_rows_written": [],
+            "btree_reading_io_read": [],
+            "btree_reading_io_write": [],
+        }
+
+    def _read(self):
+        with self._writer.connection.begin():
+            return self._writer.btree_stats() or []
+
+    def sample(self, rows_written):
+        """
+        Missing values are saved as -1 and NaN
+        """
+        if self._exclude_io is None:
+            stats = self._read()
+        else:
+            stats, io = self._exclude_io(self._read)
+            io_values = (rows_written, -1 if io.read_bytes is None else io.read_bytes,
+                         -1 if io.write_bytes is None else io.write_bytes)
+            for name, value in zip(self.reading_series, io_values):
+                self.reading_series[name].append(value)
+            if self._reading_store is not None:
+                self._reading_store.append(*io_values)
+
+        series = self.series
+        for btree in stats:
+            if btree.name not in self.names:
+                self.names.append(btree.name)
+            last = self.last.get(btree.name)
+            if btree.page_splits is None and btree.depth is not None and btree.leaf_pages is not None:
+                # b-trees only, the PostgreSQL heap doesn't split; the first reading counts from a single leaf
+                growth = btree.leaf_pages - (1 if last is None else last.leaf_pages)
+                btree.page_splits = (0 if last is None else last.page_splits) + max(0, growth)
+            self.last[btree.name] = btree
+
+            values = (
+                rows_written,
+                self.names.index(btree.name),
+                -1 if btree.depth is None else btree.depth,
+                -1 if btree.leaf_pages is None else btree.leaf_pages,
+                -1 if btree.internal_pages is None else btree.internal_pages,
+                np.nan if btree.avg_leaf_fill is None else btree.avg_leaf_fill,
+                np.nan if btree.fragmentation is None else btree.fragmentation,
+                -1 if btree.page_splits is None else btree.page_splits,
+            )
+            histogram = btree.fill_histogram()
+            histogram = [-1] * FILL_BUCKETS if histogram is None else histogram.tolist()
+            values += tuple(histogram)
+
+            for name, value in zip(series, values):
+                series[name].append(value)
+
+            if self._store is not None:
+                self._store.append(*values)
+
+    def summary(self):
+        """
+        :return: Last reading of every b-tree, by name
+        """
+        summary = {}
+        for name, btree in self.last.items():
+            histogram = btree.fill_histogram()
+            summary[name] = {
+                "depth": btree.depth,
+                "leaf_pages": btree.leaf_pages,
+                "internal_pages": btree.internal_pages,
+                "avg_leaf_fill": btree.avg_leaf_fill,
+                "fragmentation": btree.fragmentation,
+                "page_splits": btree.page_splits,
+                "fill_histogram": None if histogram is None else histogram.tolist(),
+            }
+
+            print(f"{name}: depth {btree.depth} ; {btree.leaf_pages} leaves ; "
+                  f"avg leaf fill {'n/a' if btree.avg_leaf_fill is None else f'{btree.avg_leaf_fill:.2f}'} ; "
+                  f"fragmentation {'n/a' if btree.fragmentation is None else f'{btree.fragmentation:.2f}'}")
+
+        return summary
+
+    def reading_summary(self):
+        """
+        :return: Number of readings and the bytes they read and wrote, -1 where the probe doesn't count them
+        """
+        series = self.reading_series
+        io_read, io_write = series["btree_reading_io_read"], series["btree_reading_io_write"]
+        return {
+            "count": len(series["btree_reading_rows_written"]),
+            "io_read": -1 if -1 in io_read else sum(io_read),
+            "io_write": -1 if -1 in io_write else sum(io_write),
+        }
@@ -0,0 +1,163 @@
+import random
+import threading
+import time
+
+import numpy as np
+from sqlalchemy.exc import DBAPIError
+
+from io_probe import io_probe_for
+from result_store import SAMPLE_COLUMNS
+from sampler import MetricsSampler, RowCounter
+from timing import PhaseTimer
+
+MAX_RETRIES = 20  # attempts after the first one before a batch is given up
+RETRY_BACKOFF = 0.001  # seconds, doubled after every failed attempt
+RETRY_BACKOFF_MAX = 0.1
+
+
+def latency_summary(latencies):
+    """
+    :param latencies: Latencies in seconds
+    :return: Percentiles and max in seconds
+    """
+    if not latencies:
+        return {}
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    return {"p50": p50, "p90": p90, "p99": p99, "max": max(latencies)}
+
+
+class WriterThread(threading.Thread):
+    """
+    Writes batches with one writer, retrying batches that failed on a lock conflict with the other writers.
+    A batch is built once and only its execution is retried, so the key generator doesn't skip keys.
+    Retries back off exponentially with full jitter, and a batch still failing after max_retries is given up.
+    """
+
+    def __init__(self, writer, batch_count, batch_size, row_counter, start_barrier, max_retries=MAX_RETRIES):
+        super(WriterThread, self).__init__(daemon=True)
+        self.writer = writer
+        self._batch_count = batch_count
+        self._batch_size = batch_size
+        self._row_counter = row_counter
+        self._start_barrier = start_barrier
+        self._max_retries = max_retries
+
+        self.timer = writer.timer = PhaseTimer()
+        self.commit_latencies = []  # time to execute and commit every successfully written batch
+        self.lock_waits = []  # time spent in the failed attempts and the backoff of every batch
+        self.retries = 0
+        self.gave_up = 0  # batches not written because they kept failing
+        self.error = None
+
+    def _write(self, execute):
+        """
+        :return: Seconds spent executing and committing the batch or None if it was given up, seconds lost before
+        """
+        lock_wait = 0.0
+        for attempt in range(self._max_retries + 1):
+            start = time.perf_counter()
+            try:
+                return self.writer.execute_batch(execute), lock_wait
+            except DBAPIError as e:
+                if not self.writer.is_lock_error(e):
+                    raise
+            if attempt < self._max_retries:
+                self.retries += 1
+                # jittered, so writers which conflicted with each other don't retry in lockstep
+                time.sleep(random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * 2 ** attempt)))
+            lock_wait += time.perf_counter() - start
+
+        self.gave_up += 1
+        return None, lock_wait
+
+    def run(self):
+        try:
+            self.writer.connection  # connect before the clock starts
+            self._start_barrier.wait()
+
+            for _ in range(self._batch_count):
+                execute, build_time = self.writer.prepare_batch(self._batch_size)
+                execute_time, lock_wait = self._write(execute)
+                self.lock_waits.append(lock_wait)
+                if execute_time is None:
+                    self.timer.discard_batch()
+                    continue
+
+                self.commit_latencies.append(execute_time)
+                self.timer.end_batch()
+                self._row_counter.add(self._batch_size)
+        except Exception as e:
+            self.error = e
+            self._start_barrier.abort()
+
+
+def run_concurrent(run_config, batch_count, batch_size, sample_interval=1.0, run_store=None):
+    """
+    Run several writers against the same table at the same time, each with its own connection and key generator
+    :param run_config: (config name, list of writers, I/O probe target), the first writer initializes the table
+    :param batch_count: Number of batches written by each of the writers
+    :param run_store: result_store.RunStore the samples are streamed into
+    """
+    config_name, writers, io_container = run_config
+
+    print(f"Initializing writers for {config_name}")
+    writers[0].init_db()
+
+    io_probe = io_probe_for(io_container)
+    written_records = RowCounter()
+    sample_store = run_store.table("samples", SAMPLE_COLUMNS) if run_store is not None else None
+    sampler = MetricsSampler(config_name, writers[0], io_probe, written_records, interval=sample_interval,
+                             store=sample_store)
+
+    start_barrier = threading.Barrier(len(writers) + 1)
+    threads = [WriterThread(writer, batch_count, batch_size, written_records, start_barrier) for writer in writers]
+    for thread in threads:
+        thread.start()
+
+    try:
+        start_barrier.wait()
+    except threading.BrokenBarrierError:
+        pass
+    sampler.start()
+    start_time = time.monotonic()
+
+    for thread in threads:
+        thread.join()
+    time_elapsed = time.monotonic() - start_time
+
+    sampler.stop()
+    for writer in writers[1:]:
+        writer.disconnect()
+    writers[0].close()
+    io_probe.close()
+
+    errors = [thread.error for thread in threads if thread.error is not None]
+    if errors:
+        # the other threads only fail on the barrier aborted by the thread which failed first
+        raise next((e for e in errors if not isinstance(e, threading.BrokenBarrierError)), errors[0])
+
+    timer = PhaseTimer()
+    for thread in threads:
+        timer.merge(thread.timer)
+
+    retries = [thread.retries for thread in threads]
+    gave_up = [thread.gave_up for thread in threads]
+    lock_wait = sum(sum(thread.lock_waits) for thread in threads)
+    print(f"{config_name}: {written_records.value / time_elapsed:.0f} rows/s with {len(writers)} writers, "
+          f"{sum(retries)} retried batches, {sum(gave_up)} given up, {lock_wait:.1f} s lost to lock conflicts")
+
+    return {
+        "name": config_name,
+        **sampler.series,
+        "writers": len(writers),
+        "row_size": writers[0].row_size,
+        "rows_per_sec": written_records.value / time_elapsed,
+        "retries": retries,
+        "gave_up": gave_up,
+        "commit_latency": [latency_summary(thread.commit_latencies) for thread in threads],
+        "execute_time": [thread.commit_latencies for thread in threads],
+        "lock_wait": [thread.lock_waits for thread in threads],
+        "lock_wait_total": [sum(thread.lock_waits) for thread in threads],
+        "phases": timer.summary(),
+        "phase_histograms": timer.to_dict(),
+    }
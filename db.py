@@ -1,5 +1,5 @@
 import os
-from sqlalchemy import Table, Column, String, MetaData
+from sqlalchemy import Table, Column, Index, String, MetaData, create_engine, text
 from sqlalchemy.ext.compiler import compiles
 from sqlalchemy import schema
 
@@ -12,13 +12,22 @@ def compile(element, compiler, **kw):
     return text
 
 
-def get_table_def(primary_key_datatype, **kwargs):
+def index_name(columns):
+    return "ix_signals_" + "_".join(columns)
 
+
+def get_table_def(primary_key_datatype, indexes=(), **kwargs):
+    """
+    :param indexes: Secondary indexes, each a column name or a sequence of column names, e.g. ("time_created", "id")
+    for an index covering the primary key lookups by time_created
+    """
     metadata = MetaData()
+    index_columns = [(index,) if isinstance(index, str) else tuple(index) for index in indexes]
     signals = Table('signals', metadata,
                   Column('id', primary_key_datatype, primary_key=True),
                   Column('time_created', String(64)),
                   Column('data', String(1024*10)),
+                  *(Index(index_name(columns), *columns) for columns in index_columns),
                   **kwargs
                   )
 
@@ -45,24 +54,148 @@ def clear_db(metadata, db_engine):
         print(e)
 
 
-def pg_table_size(dburi, table):
-    m = MetaData(dburi)
-    e = lambda x: m.bind.execute(x).first()[0]
+_engines = {}
+
+
+def get_engine(dburi, **kwargs):
+    """
+    Engine shared by the writers and the size probes, one per connection string and engine options
+    for the whole process
+    :param kwargs: create_engine() options, e.g. connect_args or isolation_level
+    """
+    key = (dburi, repr(sorted(kwargs.items())))  # the options may contain dicts, which aren't hashable
+    engine = _engines.get(key)
+    if engine is None:
+        engine = _engines[key] = create_engine(dburi, **kwargs)
+    return engine
+
+
+PG_TABLE_SIZE_QUERY = text("SELECT pg_total_relation_size(:table);")
+
+MARIADB_TABLE_SIZE_QUERY = text(
+    "SELECT SQL_NO_CACHE (data_length + index_length) tbl_size FROM information_schema.TABLES "
+    "WHERE table_schema = :schema AND table_name = :table;"
+)
+
+
+PG_BUFFER_COUNTERS_QUERY = text(
+    "SELECT coalesce(heap_blks_hit, 0) + coalesce(idx_blks_hit, 0), "
+    "coalesce(heap_blks_read, 0) + coalesce(idx_blks_read, 0) FROM pg_statio_user_tables WHERE relname = :table;"
+)
+
+
+# the heap and every index of the table, the blocks read are the ones not found in shared buffers
+PG_INDEX_STATS_QUERY = text(
+    "SELECT relname, pg_relation_size(relid), heap_blks_read * current_setting('block_size')::bigint "
+    "FROM pg_statio_user_tables WHERE relname = :table "
+    "UNION ALL SELECT indexrelname, pg_relation_size(indexrelid), idx_blks_read * current_setting('block_size')::bigint "
+    "FROM pg_statio_user_indexes WHERE relname = :table;"
+)
+
+# PRIMARY is the clustered index holding the rows, the sizes are updated with the persistent statistics,
+# the same as data_length and index_length (the sum of the secondary indexes) of information_schema.TABLES
+MARIADB_INDEX_STATS_QUERY = text(
+    "SELECT index_name, stat_value * @@innodb_page_size FROM mysql.innodb_index_stats "
+    "WHERE database_name = :schema AND table_name = :table AND stat_name = 'size';"
+)
 
-    query = f"SELECT pg_total_relation_size('{table}');"
+# one aggregated row per b-tree, the table's own b-tree is named after the table
+SQLITE_INDEX_STATS_QUERY = (
+    "SELECT name, pgsize FROM dbstat WHERE aggregate = TRUE "
+    "AND name IN (SELECT name FROM sqlite_master WHERE tbl_name = ?)"
+)
 
-    return e(query)
 
+def pg_table_size(connection, table):
 
-def mariadb_table_size(dburi, schema, table):
-    m = MetaData(dburi)
-    e = lambda x: m.bind.execute(x).first()[0]
+    return connection.execute(PG_TABLE_SIZE_QUERY, {"table": table}).scalar()
 
-    query = f'SELECT SQL_NO_CACHE (data_length + index_length) tbl_size FROM information_schema.TABLES WHERE table_schema = "{schema}" AND table_name = "{table}";'
 
-    return e(query)
+def pg_buffer_counters(connection, table):
+    """
+    :return: Blocks of the table and its indexes found in shared buffers, blocks read from the OS
+    """
+    connection.execute("SELECT pg_stat_clear_snapshot();")  # otherwise the counters are cached for the transaction
+    return tuple(connection.execute(PG_BUFFER_COUNTERS_QUERY, {"table": table}).one())
+
+
+def pg_index_stats(connection, table):
+    """
+    :return: List of (name, size in bytes, bytes read from the OS) of the table's heap and each of its indexes
+    """
+    connection.execute("SELECT pg_stat_clear_snapshot();")
+    return [tuple(row) for row in connection.execute(PG_INDEX_STATS_QUERY, {"table": table})]
+
+
+def mariadb_table_size(connection, schema, table):
+
+    return connection.execute(MARIADB_TABLE_SIZE_QUERY, {"schema": schema, "table": table}).scalar()
+
+
+def mariadb_index_stats(connection, schema, table):
+    """
+    :return: List of (name, size in bytes, None) of each index of the table, InnoDB has no per-index I/O counters
+    """
+    return [(name, int(size), None)
+            for name, size in connection.execute(MARIADB_INDEX_STATS_QUERY, {"schema": schema, "table": table})]
+
+
+def sqlite_index_stats(connection, table):
+    """
+    Full dbstat scan of the table and its indexes
+    :return: List of (name, size in bytes, None) of the table's b-tree and each of its indexes
+    """
+    return [(name, size, None) for name, size in connection.exec_driver_sql(SQLITE_INDEX_STATS_QUERY, (table,))]
 
 
 def sqlite_db_size(sqlite_file):
 
     return os.path.getsize(sqlite_file)
+
+
+class SQLiteSizeTracker:
+    """
+    Size of the b-tree of a table in an SQLite database (the rows, without the secondary indexes and the primary key
+    index of a rowid table), read from the page counters of the database file in constant time.
+
+    The counters cover the whole file, so the readings are scaled by the table's share of the used pages, measured
+    by a dbstat scan of the table's b-tree at the first reading and whenever the used pages doubled since the last
+    scan, which keeps the cost of the scans proportional to the final size of the file.
+    Optionally every dbstat_interval-th reading is a scan too, and exact.
+    """
+
+    def __init__(self, connection, table, dbstat_interval=None):
+        """
+        :param dbstat_interval: Do a full dbstat scan every n readings, None to only scan when calibrating
+        """
+        self._connection = connection
+        self._table = table
+        self._dbstat_interval = dbstat_interval
+        self._readings = 0
+        self._table_share = None
+        self._scanned_size = None  # used size at the last scan
+        self._page_size = None
+
+    def _pragma(self, name):
+        return self._connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+
+    def size(self):
+        if self._page_size is None:
+            self._page_size = self._pragma("page_size")
+
+        used_size = (self._pragma("page_count") - self._pragma("freelist_count")) * self._page_size
+
+        scan = (self._table_share is None or used_size >= 2 * self._scanned_size
+                or self._dbstat_interval is not None and self._readings % self._dbstat_interval == 0)
+        self._readings += 1
+
+        if not scan:
+            return int(used_size * self._table_share)
+
+        # using aggregate mode, so the size of the b-tree is the size of its pages summed
+        table_size = next(size for name, size, _ in sqlite_index_stats(self._connection, self._table)
+                          if name == self._table)
+        self._table_share = table_size / used_size
+        self._scanned_size = used_size
+
+        return table_size
@@ -1,16 +1,29 @@
 import docker
 
 
-def get_container_io(container_name):
-    client = docker.from_env()
-    container = client.containers.get(container_name)
+_client = None
 
-    stats = container.stats(stream=False)
 
-    blkio_stats = stats["blkio_stats"]["io_service_bytes_recursive"]
-    if blkio_stats is None:
-        return 0, 0
-    total_reads = sum(dev["value"] for dev in blkio_stats if dev["op"] == "read")
-    total_writes = sum(dev["value"] for dev in blkio_stats if dev["op"] == "write")
+def get_client():
+    """
+    Docker client shared by the whole process, creating a new one for every call is expensive
+    """
+    global _client
+    if _client is None:
+        _client = docker.from_env()
+    return _client
 
-    return total_reads, total_writes
+
+def get_container_id(container_name):
+    return get_client().containers.get(container_name).id
+
+
+def exec_in_container(container_name, cmd):
+    """
+    :param cmd: Command as a list of arguments
+    :return: Output of the command
+    """
+    exit_code, output = get_client().containers.get(container_name).exec_run(cmd)
+    if exit_code != 0:
+        raise RuntimeError(f"{cmd} failed in {container_name} with exit code {exit_code}: {output.decode()}")
+    return output
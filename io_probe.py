@@ -0,0 +1,183 @@
+import os
+import threading
+from collections import namedtuple
+
+import docker_utils
+
+
+FIRST_SAMPLE_TIMEOUT = 30  # seconds to wait for the first sample of the docker stats stream
+
+
+class IOStats(namedtuple("IOStats", ["read_bytes", "write_bytes", "read_ops", "write_ops"])):
+    """
+    Cumulative I/O counters, ops are block I/Os, None where the probe can't count them
+    """
+
+    def __add__(self, other):
+        return IOStats(*(None if a is None or b is None else a + b for a, b in zip(self, other)))
+
+    def __sub__(self, other):
+        return IOStats(*(None if a is None or b is None else a - b for a, b in zip(self, other)))
+
+
+class IOProbe:
+
+    def read(self):
+        """
+        :return: Cumulative IOStats of the probed target, should be cheap enough to call after every batch
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        return
+
+
+def _read_file(file, chunk_size=4096):
+    """
+    Read a whole file from the start with pread, which doesn't move the shared file offset,
+    so the probes can be read from several threads at the same time
+    """
+    chunks = []
+    while True:
+        chunk = os.pread(file.fileno(), chunk_size, sum(len(c) for c in chunks))
+        chunks.append(chunk)
+        if len(chunk) < chunk_size:
+            return b"".join(chunks)
+
+
+class CgroupIOProbe(IOProbe):
+    """
+    Reads io.stat of a cgroup v2 directly from the filesystem
+    """
+
+    def __init__(self, cgroup_dir):
+        self._path = os.path.join(cgroup_dir, "io.stat")
+        self._file = open(self._path, "rb", buffering=0)
+
+    @classmethod
+    def own(cls):
+        """
+        Probe of the cgroup the current process is in (e.g. the benchmark container itself)
+        """
+        with open("/proc/self/cgroup") as f:
+            cgroup = next(line for line in f if line.startswith("0::")).strip()[3:]
+        return cls("/sys/fs/cgroup" + cgroup.rstrip("/"))
+
+    @classmethod
+    def for_container(cls, container_id, cgroup_root="/sys/fs/cgroup"):
+        candidates = [
+            os.path.join(cgroup_root, "system.slice", f"docker-{container_id}.scope"),  # systemd cgroup driver
+            os.path.join(cgroup_root, "docker", container_id),  # cgroupfs cgroup driver
+        ]
+        for cgroup_dir in candidates:
+            if os.path.exists(os.path.join(cgroup_dir, "io.stat")):
+                return cls(cgroup_dir)
+        raise FileNotFoundError(f"No cgroup v2 io.stat found for container {container_id}")
+
+    def read(self):
+        totals = dict(rbytes=0, wbytes=0, rios=0, wios=0)
+
+        for line in _read_file(self._file).split(b"\n"):
+            for field in line.split()[1:]:  # first field is the MAJ:MIN device number
+                key, value = field.split(b"=")
+                key = key.decode()
+                if key in totals:
+                    totals[key] += int(value)
+
+        return IOStats(totals["rbytes"], totals["wbytes"], totals["rios"], totals["wios"])
+
+    def close(self):
+        self._file.close()
+
+
+class ProcIOProbe(IOProbe):
+    """
+    Reads /proc/<pid>/io, meant for SQLite, which runs inside the benchmark process
+    """
+
+    def __init__(self, pid="self"):
+        self._file = open(f"/proc/{pid}/io", "rb", buffering=0)
+
+    def read(self):
+        values = {}
+        for line in _read_file(self._file).split(b"\n"):
+            if line:
+                key, value = line.split(b":")
+                values[key] = int(value)
+
+        # read_bytes/write_bytes count what actually reached the storage layer, the block I/Os aren't counted
+        # (syscr/syscw are read/write syscalls, most of them served from the page cache)
+        return IOStats(values[b"read_bytes"], values[b"write_bytes"], None, None)
+
+    def close(self):
+        self._file.close()
+
+
+def _parse_blkio_stats(stats):
+    blkio_stats = stats["blkio_stats"]
+    service_bytes = blkio_stats["io_service_bytes_recursive"] or []
+    serviced = blkio_stats.get("io_serviced_recursive") or []  # not reported on cgroup v2
+
+    def total(entries, op):
+        return sum(dev["value"] for dev in entries if dev["op"].lower() == op)
+
+    # no bytes reported means nothing read or written yet (e.g. an idle container), while the op counts
+    # are missing altogether on cgroup v2
+    read_ops = total(serviced, "read") if serviced else None
+    write_ops = total(serviced, "write") if serviced else None
+    return IOStats(total(service_bytes, "read"), total(service_bytes, "write"), read_ops, write_ops)
+
+
+class DockerIOProbe(IOProbe):
+    """
+    Keeps a single streaming stats connection to a container open and returns the latest sample.
+    Docker publishes a sample about once a second, so the values lag behind by up to a second.
+    """
+
+    def __init__(self, container_name):
+        self._container_name = container_name
+        self._client = docker_utils.get_client()
+        self._stream = self._client.containers.get(container_name).stats(stream=True, decode=True)
+        self._latest = None
+        self._error = None
+        self._first_sample = threading.Event()
+
+        self._thread = threading.Thread(target=self._consume, daemon=True)
+        self._thread.start()
+
+    def _consume(self):
+        try:
+            for stats in self._stream:
+                self._latest = _parse_blkio_stats(stats)
+                self._first_sample.set()
+        except Exception as e:  # the stream is closed under our hands in close()
+            self._error = e
+        finally:
+            self._first_sample.set()  # don't leave read() waiting for a stream that ended
+
+    def read(self):
+        if not self._first_sample.wait(FIRST_SAMPLE_TIMEOUT):
+            raise TimeoutError(f"No I/O stats of container {self._container_name} in {FIRST_SAMPLE_TIMEOUT} s")
+        if self._latest is None:
+            raise RuntimeError(f"The stats stream of container {self._container_name} ended") from self._error
+        return self._latest
+
+    def close(self):
+        self._stream.close()
+
+
+def io_probe_for(target):
+    """
+    :param target: IOProbe instance, "self" for the benchmark process itself or name of a docker container
+    :return: The cheapest probe available for the target
+    """
+    if isinstance(target, IOProbe):
+        return target
+
+    if target == "self":
+        return ProcIOProbe()
+
+    try:
+        return CgroupIOProbe.for_container(docker_utils.get_container_id(target))
+    except OSError:  # cgroups of other containers are usually not visible from inside of a container
+        return DockerIOProbe(target)
@@ -1,78 +1,465 @@
+import itertools
+import os
 import random
+import threading
+import time
 import uuid
 
+import numpy as np
 from sqlalchemy import BIGINT, BINARY
-from uuid_fastertime import uuid1_fastertime
 
-from uuid6 import uuid6, uuid7
+from uuid7_boundary import uuid7_time_boundary
+
+
+# 0x01b21dd213814000 is the number of 100-ns intervals between the
+# UUID epoch 1582-10-15 00:00:00 and the Unix epoch 1970-01-01 00:00:00.
+UUID_EPOCH_OFFSET = 0x01b21dd213814000
+
+SNOWFLAKE_EPOCH_MS = 1288834974657  # 2010-11-04 01:42:54.657 UTC, the epoch of Twitter's Snowflake
+
+_RFC_4122_VARIANT = 0x8000 << 48
+
+
+def _random_u64(n):
+    return np.frombuffer(os.urandom(8 * n), dtype=np.uint64)
+
+
+def _boundary_ms(dt):
+    """
+    :return: Millisecond of dt since the Unix epoch, the same as in uuid7_time_boundary
+    """
+    return int(dt.timestamp() * 1000)
+
+
+def _uuid_bytes(hi, lo):
+    return ((hi << 64) | lo).to_bytes(16, "big")
+
+
+def _pack_uuids(hi, lo):
+    """
+    Pack the upper and lower 64 bits of each UUID into a contiguous big-endian (n, 16) byte array
+    """
+    out = np.empty((len(hi), 2), dtype=">u8")
+    out[:, 0] = hi
+    out[:, 1] = lo
+    return out.view(np.uint8).reshape(len(hi), 16)
 
 
 class KeyGenerator:
 
-    def get_next(self):
+    def get_batch(self, n):
+        """
+        Generate the next n keys in one go
+        :return: int64 array of shape (n,) or uint8 array of shape (n, 16), depending on the key type
+        """
         raise NotImplementedError()
 
-    def datatype(self):
+    def get_next(self):
+        return self.to_list(self.get_batch(1))[0]
+
+    def for_writer(self, index, count):
+        """
+        Independent generator for one of several writers inserting into the same table at the same time,
+        the generators of all the writers must not produce colliding keys
+        :param index: Index of the writer
+        :param count: Number of writers
+        """
+        return type(self)()
+
+    def to_list(self, batch):
+        """
+        Convert a batch returned by get_batch() to a list of values insertable by the DB driver
+        """
         raise NotImplementedError()
 
+    def get_state(self):
+        """
+        :return: Picklable state, set_state() resumes the generation right after the last generated key
+        """
+        return dict(self.__dict__)
 
-class RandomInt64KeyGenerator(KeyGenerator):
-    def get_next(self):
-        return random.getrandbits(63)  # -1 bit because we're using singed numbers
+    def set_state(self, state):
+        self.__dict__.update(state)
+
+    def time_boundary(self, dt, lower=True):
+        """
+        Key comparing lower (or higher) than every key generated in the same millisecond as dt
+        :return: Key value insertable by the DB driver, None if the keys aren't ordered by time of creation
+        """
+        return None
 
     def datatype(self):
-        return BIGINT
+        raise NotImplementedError()
 
 
-class SequentialInt64KeyGenerator(KeyGenerator):
-    def __init__(self):
-        self._cur_val = 0
+class Int64KeyGenerator(KeyGenerator):
+    key_size = 8  # bytes
 
-    def get_next(self):
-        self._cur_val +=1
-        return self._cur_val
+    def to_list(self, batch):
+        return batch.tolist()
 
     def datatype(self):
         return BIGINT
 
 
-class UUID1KeyGenerator(KeyGenerator):
-    def get_next(self):
-        return uuid.uuid1().bytes
+class UUIDKeyGenerator(KeyGenerator):
+    key_size = 16
+
+    def to_list(self, batch):
+        buf = batch.tobytes()
+        return [buf[i:i + 16] for i in range(0, len(buf), 16)]
 
     def datatype(self):
         return BINARY(length=16)
 
 
-class UUID1FastRolloverKeyGenerator(KeyGenerator):
-    def get_next(self):
-        return uuid1_fastertime(time_multiplier=1000).bytes
+class RandomInt64KeyGenerator(Int64KeyGenerator):
+    def __init__(self):
+        self._rng = np.random.default_rng(random.getrandbits(64))  # follows the seed of the random module
 
-    def datatype(self):
-        return BINARY(length=16)
+    def get_batch(self, n):
+        return self._rng.integers(0, 1 << 63, size=n, dtype=np.int64)  # 63 bits because we're using singed numbers
 
 
-class UUID4KeyGenerator(KeyGenerator):
-    def get_next(self):
-        return uuid.uuid4().bytes
+class SequentialInt64KeyGenerator(Int64KeyGenerator):
+    def __init__(self, start=1, step=1):
+        self._next_val = start
+        self._step = step
 
-    def datatype(self):
-        return BINARY(length=16)
+    def get_batch(self, n):
+        batch = np.arange(self._next_val, self._next_val + n * self._step, self._step, dtype=np.int64)
+        self._next_val += n * self._step
+        return batch
 
+    def for_writer(self, index, count):
+        # interleaved sequences, so the writers still compete for the right-most page
+        return SequentialInt64KeyGenerator(start=index + 1, step=count)
 
-class UUID6KeyGenerator(KeyGenerator):
-    def get_next(self):
-        return uuid6().bytes
 
-    def datatype(self):
-        return BINARY(length=16)
+class TimeOrderedKeyGenerator(KeyGenerator):
+    """
+    Base of the time-ordered keys. Every key gets a tick of a monotonic clock: the ticks are strictly increasing
+    within the generator (or within a thread with per_thread=True), even when the system clock stands still
+    or goes back, so keys of the same generator are unique and ordered regardless of the random bits.
 
+    Keys of different generators (processes, writers) are kept apart by a partition ID stored
+    in place of the clock sequence, random bits or worker ID.
+    """
+    partition_bits = 14
+    tick_bits = 64  # width of the timestamp field, the ticks roll over at 2^tick_bits
 
-class UUID7KeyGenerator(KeyGenerator):
-    def get_next(self):
-        return uuid7().bytes
+    def __init__(self, partition=None, per_thread=False, random_increment_bits=0):
+        """
+        :param partition: Partition ID, "pid" to take it from the process ID (looked up per batch, so forked
+        processes get their own), None to use random bits instead. The process ID is XOR-folded into the
+        partition bits, so processes whose IDs are less than 2^bits apart never share a partition.
+        :param per_thread: Keep the monotonic state in each thread instead of sharing it under a lock.
+        The lower 4 bits of the partition are then the thread's slot, so threads don't collide within a tick,
+        and the partition ID (or the random bits) takes the remaining bits.
+        :param random_increment_bits: Advance the clock by a random 1 to 2^bits ticks per key instead of by 1
+        (RFC 9562 monotonic random), so consecutive keys can't be guessed
+        """
+        self._partition = partition
+        self._per_thread = per_thread
+        self._random_increment_bits = random_increment_bits
+        self._last_tick = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._thread_slots = itertools.count()
 
-    def datatype(self):
-        return BINARY(length=16)
+    def _now(self):
+        """
+        :return: Current tick of the clock
+        """
+        raise NotImplementedError()
+
+    def for_writer(self, index, count):
+        return type(self)(partition=index, per_thread=self._per_thread,
+                          random_increment_bits=self._random_increment_bits)
+
+    def get_state(self):
+        return {"last_tick": self._thread_state()["last_tick"] if self._per_thread else self._last_tick}
+
+    def set_state(self, state):
+        self._last_tick = state["last_tick"]
+        self._local = threading.local()
+
+    def _thread_state(self):
+        state = self._local.__dict__
+        if not state:
+            state["last_tick"] = self._last_tick
+            state["slot"] = next(self._thread_slots) & 0xf  # itertools.count is atomic
+        return state
+
+    def _ticks(self, n):
+        """
+        :return: n strictly increasing ticks as a uint64 array
+        """
+        if self._random_increment_bits:
+            increments = (_random_u64(n) & np.uint64((1 << self._random_increment_bits) - 1)) + np.uint64(1)
+            offsets = np.cumsum(increments) - increments[0]
+        else:
+            offsets = np.arange(n, dtype=np.uint64)
+        span = int(offsets[-1])
+
+        now = self._now()
+        if self._per_thread:
+            state = self._thread_state()
+            first = now if state["last_tick"] is None else max(now, state["last_tick"] + 1)
+            state["last_tick"] = first + span
+        else:
+            with self._lock:  # only the reservation of the ticks, the keys are built outside of the lock
+                first = now if self._last_tick is None else max(now, self._last_tick + 1)
+                self._last_tick = first + span
+
+        # the clock can pass 2^64 before the keys roll over, e.g. 10-ns UUID1 ticks in 2028
+        return offsets + np.uint64(first & ((1 << self.tick_bits) - 1))
+
+    def _partitions(self, n):
+        """
+        :return: partition_bits-wide values for the n keys as a uint64 array
+        """
+        if self._partition is None:
+            partitions = self._unpartitioned(n)
+        else:
+            partitions = np.full(n, self._partition_id(), dtype=np.uint64)
+        if self._per_thread:
+            partitions = (partitions << np.uint64(4)) | np.uint64(self._thread_state()["slot"])
+        return partitions & np.uint64((1 << self.partition_bits) - 1)
+
+    def _unpartitioned(self, n):
+        """
+        :return: Values in place of the partition ID when none is set
+        """
+        return _random_u64(n)
+
+    def _partition_id(self):
+        if self._partition != "pid":
+            return self._partition
+
+        bits = self.partition_bits - 4 if self._per_thread else self.partition_bits
+        pid, folded = os.getpid(), 0
+        while pid:
+            folded ^= pid & ((1 << bits) - 1)
+            pid >>= bits
+        return folded
+
+    @property
+    def _partitioned(self):
+        """
+        Whether the keys carry a partition, i.e. a partition ID or a thread slot
+        """
+        return self._partition is not None or self._per_thread
+
+
+class UUID1KeyGenerator(TimeOrderedKeyGenerator, UUIDKeyGenerator):
+    """
+    The lowest 32 bits of the timestamp come first, so the keys aren't ordered by time of creation and have no
+    time_boundary: they roll over every 7 minutes (every 0.43 s with the fast rollover)
+    """
+    tick_bits = 60
+    time_multiplier = 1
+
+    _node = None  # looked up once per process
+
+    def _now(self):
+        return time.time_ns() * self.time_multiplier // 100 + UUID_EPOCH_OFFSET
+
+    def get_batch(self, n):
+        if UUID1KeyGenerator._node is None:
+            UUID1KeyGenerator._node = uuid.getnode()
+
+        timestamps = self._ticks(n) & np.uint64(0x0fffffffffffffff)
+        time_low = timestamps & np.uint64(0xffffffff)
+        time_mid = (timestamps >> np.uint64(32)) & np.uint64(0xffff)
+        time_hi_version = (timestamps >> np.uint64(48)) | np.uint64(1 << 12)
+        hi = (time_low << np.uint64(32)) | (time_mid << np.uint64(16)) | time_hi_version
+
+        clock_seq = self._partitions(n)  # random 14-bit sequence number instead of stable storage, unless partitioned
+        lo = (clock_seq << np.uint64(48)) | np.uint64(_RFC_4122_VARIANT | self._node)
+
+        return _pack_uuids(hi, lo)
+
+
+class UUID1FastRolloverKeyGenerator(UUID1KeyGenerator):
+    time_multiplier = 1000
+
+
+class UUID4KeyGenerator(UUIDKeyGenerator):
+    def get_batch(self, n):
+        batch = np.frombuffer(os.urandom(16 * n), dtype=np.uint8).reshape(n, 16).copy()
+        batch[:, 6] = (batch[:, 6] & 0x0f) | 0x40  # version 4
+        batch[:, 8] = (batch[:, 8] & 0x3f) | 0x80  # RFC 4122 variant
+        return batch
+
+
+class UUID6KeyGenerator(TimeOrderedKeyGenerator, UUIDKeyGenerator):
+    tick_bits = 60
+
+    def _now(self):
+        return time.time_ns() // 100 + UUID_EPOCH_OFFSET
+
+    def get_batch(self, n):
+        timestamps = self._ticks(n)
+
+        hi = ((timestamps >> np.uint64(12)) << np.uint64(16)) | np.uint64(6 << 12) | (timestamps & np.uint64(0x0fff))
+        # clock sequence (random or the partition) and random node, only the variant bits are fixed
+        lo = (np.uint64(_RFC_4122_VARIANT) | (self._partitions(n) << np.uint64(48))
+              | (_random_u64(n) & np.uint64(0xffffffffffff)))
+
+        return _pack_uuids(hi, lo)
+
+    def time_boundary(self, dt, lower=True):
+        ms = _boundary_ms(dt)
+        tick = ms * 10**4 + UUID_EPOCH_OFFSET if lower else (ms + 1) * 10**4 + UUID_EPOCH_OFFSET - 1
+        hi = ((tick >> 12) << 16) | (6 << 12) | (tick & 0x0fff)
+        lo = _RFC_4122_VARIANT if lower else _RFC_4122_VARIANT | ((1 << 62) - 1)
+        return _uuid_bytes(hi, lo)
+
+
+class UUID7KeyGenerator(TimeOrderedKeyGenerator, UUIDKeyGenerator):
+    """
+    UUID7 with a 48-bit millisecond timestamp followed by a 20-bit sub-millisecond fraction,
+    same layout as the uuid6 library (RFC 9562 method 3). The fraction is bumped by one for every key
+    (or a random increment), so keys within a batch are strictly ordered and don't depend on the random bits
+    for ordering. The partition, if any, takes the next 14 bits.
+    """
+
+    def _now(self):
+        timestamp_ms, timestamp_ns = divmod(time.time_ns(), 10**6)
+        return (timestamp_ms << 20) | (timestamp_ns * 2**20 // 10**6)
+
+    def get_batch(self, n):
+        ticks = self._ticks(n)
+        ms = ticks >> np.uint64(20)
+        subsec = ticks & np.uint64(0xfffff)
+
+        hi = ((ms & np.uint64(0xffffffffffff)) << np.uint64(16)) | np.uint64(7 << 12) | (subsec >> np.uint64(8))
+        if not self._partitioned:
+            rand_b = _random_u64(n) & np.uint64((1 << 54) - 1)
+        else:
+            rand_b = (self._partitions(n) << np.uint64(40)) | (_random_u64(n) & np.uint64((1 << 40) - 1))
+        lo = np.uint64(_RFC_4122_VARIANT) | ((subsec & np.uint64(0xff)) << np.uint64(54)) | rand_b
+
+        return _pack_uuids(hi, lo)
+
+    def time_boundary(self, dt, lower=True):
+        return uuid7_time_boundary(dt, lower).bytes
+
+
+class SnowflakeKeyGenerator(TimeOrderedKeyGenerator, Int64KeyGenerator):
+    """
+    Snowflake ID in a BIGINT: 41-bit milliseconds since SNOWFLAKE_EPOCH_MS, 10-bit worker ID (the partition,
+    0 if not set) and a 12-bit sequence. More than 4096 keys per millisecond borrow from the following milliseconds.
+    """
+    partition_bits = 10
+
+    def _now(self):
+        return (time.time_ns() // 10**6 - SNOWFLAKE_EPOCH_MS) << 12
+
+    def _unpartitioned(self, n):
+        return np.zeros(n, dtype=np.uint64)  # one worker, the sequence alone keeps the keys unique
+
+    def get_batch(self, n):
+        ticks = self._ticks(n)
+        ms = (ticks >> np.uint64(12)) & np.uint64((1 << 41) - 1)
+        keys = (ms << np.uint64(22)) | (self._partitions(n) << np.uint64(12)) | (ticks & np.uint64(0xfff))
+        return keys.view(np.int64)
+
+    def time_boundary(self, dt, lower=True):
+        ms = _boundary_ms(dt) - SNOWFLAKE_EPOCH_MS
+        return ms << 22 if lower else ((ms + 1) << 22) - 1
+
+
+class ULIDKeyGenerator(TimeOrderedKeyGenerator, UUIDKeyGenerator):
+    """
+    Monotonic ULID in its 16-byte binary form: 48-bit millisecond timestamp followed by 80 bits,
+    of which the first 16 are a counter within the millisecond (the monotonic ULID increments
+    the random part instead) and the rest are random, or the partition followed by random bits.
+    """
+
+    def _now(self):
+        return (time.time_ns() // 10**6) << 16
+
+    def get_batch(self, n):
+        ticks = self._ticks(n)
+        hi = ticks & np.uint64(0xffffffffffffffff)  # 48-bit timestamp and 16-bit counter
+        if not self._partitioned:
+            lo = _random_u64(n)
+        else:
+            lo = (self._partitions(n) << np.uint64(50)) | (_random_u64(n) & np.uint64((1 << 50) - 1))
+        return _pack_uuids(hi, lo)
+
+    def time_boundary(self, dt, lower=True):
+        ms = _boundary_ms(dt)
+        return (ms << 80).to_bytes(16, "big") if lower else (((ms + 1) << 80) - 1).to_bytes(16, "big")
+
+
+class CombKeyGenerator(UUIDKeyGenerator):
+    """
+    COMB GUID: UUID4 with 6 bytes replaced by a millisecond timestamp. In the SQL Server layout the timestamp
+    is in the last 6 bytes, which SQL Server compares first, but other engines compare the bytes in order,
+    so there the keys are as random as UUID4. timestamp_first=True puts the timestamp in the first 6 bytes instead.
+    """
+
+    def __init__(self, timestamp_first=False):
+        self._timestamp_first = timestamp_first
+
+    def for_writer(self, index, count):
+        return CombKeyGenerator(self._timestamp_first)
+
+    def get_batch(self, n):
+        batch = np.frombuffer(os.urandom(16 * n), dtype=np.uint8).reshape(n, 16).copy()
+        batch[:, 6] = (batch[:, 6] & 0x0f) | 0x40  # version 4
+        batch[:, 8] = (batch[:, 8] & 0x3f) | 0x80  # RFC 4122 variant
+
+        timestamp = np.frombuffer((time.time_ns() // 10**6).to_bytes(8, "big")[2:], dtype=np.uint8)
+        if self._timestamp_first:
+            batch[:, :6] = timestamp
+        else:
+            batch[:, 10:] = timestamp
+        return batch
+
+    def time_boundary(self, dt, lower=True):
+        if not self._timestamp_first:
+            return None
+        return _boundary_ms(dt).to_bytes(6, "big") + (b"\x00" if lower else b"\xff") * 10
+
+
+class ShardPrefixKeyGenerator(Int64KeyGenerator):
+    """
+    Sequential keys spread over a number of shards, each shard owning an equal slice of the positive BIGINT range.
+    Consecutive keys go to consecutive shards, so inserts hit as many hot spots as there are shards.
+    """
+
+    def __init__(self, shards=16, start=0, step=1):
+        self._shards = shards
+        self._shard_size = (1 << 63) // shards
+        self._next_index = start
+        self._step = step
+
+    def for_writer(self, index, count):
+        return ShardPrefixKeyGenerator(self._shards, start=index, step=count)
+
+    def get_batch(self, n):
+        indexes = np.arange(self._next_index, self._next_index + n * self._step, self._step, dtype=np.int64)
+        self._next_index += n * self._step
+        shard, sequence = np.divmod(indexes, self._shards)[::-1]
+        return shard * self._shard_size + sequence + 1
 
 
+# generators by name, so they can be combined with any writer
+KEY_GENERATORS = {
+    "int64_random": RandomInt64KeyGenerator,
+    "int64_sequential": SequentialInt64KeyGenerator,
+    "uuid1": UUID1KeyGenerator,
+    "uuid1_fast_rollover": UUID1FastRolloverKeyGenerator,
+    "uuid4": UUID4KeyGenerator,
+    "uuid6": UUID6KeyGenerator,
+    "uuid7": UUID7KeyGenerator,
+    "snowflake": SnowflakeKeyGenerator,
+    "ulid": ULIDKeyGenerator,
+    "comb": CombKeyGenerator,
+    "comb_timestamp_first": lambda: CombKeyGenerator(timestamp_first=True),
+    "shard_prefix_16": ShardPrefixKeyGenerator,
+}
@@ -0,0 +1,215 @@
+import threading
+import time
+
+import numpy as np
+
+
+def _comparable(keys):
+    """
+    :return: 1-D array of the keys, UUIDs as 16-byte strings, so they can be looked up with np.isin
+    """
+    if keys.ndim == 1:
+        return keys
+    return np.ascontiguousarray(keys).view(f"S{keys.shape[1]}").ravel()
+
+
+class KeyReservoir:
+    """
+    Written keys kept in a numpy array instead of a list of Python objects: int64 keys take 8 bytes each,
+    UUIDs 16 bytes (rows of a (n, 16) uint8 array). The array grows geometrically up to the capacity,
+    after that a uniform sample of all the written keys is kept (reservoir sampling).
+    The most recently written keys are also kept in a separate ring buffer, the removed ones are marked there.
+    The time every key was added is kept too, so the keys removed by a time-range delete can be pruned.
+    Thread-safe, the keys may be added by the producer thread of a pipeline.PipelinedWriter.
+    """
+
+    def __init__(self, capacity=None, recent_size=10000, seed=None):
+        """
+        :param capacity: Max number of keys kept, None to keep all of them
+        :param recent_size: Number of most recent keys kept for the "recent keys" lookups
+        """
+        self._capacity = capacity
+        self._recent_size = recent_size
+        self._rng = np.random.default_rng(seed)
+        self._keys = None
+        self._times = None  # milliseconds since the Unix epoch when each of the kept keys was added
+        self._size = 0
+        self._recent = None
+        self._recent_times = None
+        self._recent_removed = None  # keys of the ring removed by pop or remove_before
+        self._recent_pos = 0
+        self._lock = threading.Lock()
+        self.seen = 0  # number of keys added, including the ones not kept
+
+    def __len__(self):
+        return self._size
+
+    def _grow(self, size):
+        new_len = max(1024, len(self._keys) if self._keys is not None else 0)
+        while new_len < size:
+            new_len *= 2
+        if self._capacity is not None:
+            new_len = min(new_len, self._capacity)
+
+        keys = np.empty((new_len,) + self._recent.shape[1:], dtype=self._recent.dtype)
+        times = np.empty(new_len, dtype=np.int64)
+        if self._keys is not None:
+            keys[:self._size] = self._keys[:self._size]
+            times[:self._size] = self._times[:self._size]
+        self._keys = keys
+        self._times = times
+
+    def add(self, keys, ms=None):
+        """
+        :param keys: Batch returned by KeyGenerator.get_batch()
+        :param ms: Time the keys were written at in milliseconds since the Unix epoch, defaults to now
+        """
+        if ms is None:
+            ms = time.time_ns() // 10**6
+
+        with self._lock:
+            n = len(keys)
+            if self._recent is None:
+                self._recent = np.empty((self._recent_size,) + keys.shape[1:], dtype=keys.dtype)
+                self._recent_times = np.empty(self._recent_size, dtype=np.int64)
+                self._recent_removed = np.zeros(self._recent_size, dtype=bool)
+
+            self._add_recent(keys, ms)
+
+            free = n if self._capacity is None else min(n, self._capacity - self._size)
+            if free:
+                if self._keys is None or self._size + free > len(self._keys):
+                    self._grow(self._size + free)
+                self._keys[self._size:self._size + free] = keys[:free]
+                self._times[self._size:self._size + free] = ms
+                self._size += free
+
+            if free < n:
+                # algorithm R: the i-th key replaces a random kept key with probability capacity / i
+                counts = np.arange(self.seen + free + 1, self.seen + n + 1)
+                positions = (self._rng.random(n - free) * counts).astype(np.int64)
+                replaced = positions < self._capacity
+                self._keys[positions[replaced]] = keys[free:][replaced]
+                self._times[positions[replaced]] = ms
+
+            self.seen += n
+
+    def _add_recent(self, keys, ms):
+        keys = keys[-self._recent_size:]
+        end = self._recent_pos + len(keys)
+        if end <= self._recent_size:
+            self._recent[self._recent_pos:end] = keys
+            self._recent_times[self._recent_pos:end] = ms
+            self._recent_removed[self._recent_pos:end] = False
+        else:
+            split = self._recent_size - self._recent_pos
+            self._recent[self._recent_pos:] = keys[:split]
+            self._recent[:end - self._recent_size] = keys[split:]
+            self._recent_times[self._recent_pos:] = ms
+            self._recent_times[:end - self._recent_size] = ms
+            self._recent_removed[self._recent_pos:] = False
+            self._recent_removed[:end - self._recent_size] = False
+        self._recent_pos = end % self._recent_size
+
+    def get_state(self):
+        """
+        :return: Picklable state with the kept keys, set_state() restores them, e.g. with a table snapshot
+        """
+        with self._lock:
+            state = {"seen": self.seen, "recent_pos": self._recent_pos}
+            if self._recent is not None:
+                state.update(keys=self._keys[:self._size].copy(), times=self._times[:self._size].copy(),
+                             recent=self._recent.copy(), recent_times=self._recent_times.copy(),
+                             recent_removed=self._recent_removed.copy())
+            return state
+
+    def set_state(self, state):
+        """
+        Replace the keys with the ones of get_state(), sampled down if there are more than the capacity
+        """
+        with self._lock:
+            self.seen = state["seen"]
+            self._recent_pos = state["recent_pos"]
+            if "keys" not in state:
+                self._keys = self._times = self._recent = self._recent_times = self._recent_removed = None
+                self._size = 0
+                return
+
+            keys, times = state["keys"], state["times"]
+            if self._capacity is not None and len(keys) > self._capacity:
+                kept = self._rng.choice(len(keys), size=self._capacity, replace=False)
+                keys, times = keys[kept], times[kept]
+            self._keys, self._times, self._size = keys.copy(), times.copy(), len(keys)
+            self._recent, self._recent_times = state["recent"].copy(), state["recent_times"].copy()
+            self._recent_removed = state["recent_removed"].copy()
+            self._recent_size = len(self._recent)
+
+    def uniform(self, n):
+        with self._lock:
+            return self._keys[self._rng.integers(0, self._size, size=n)]
+
+    def pop(self, n):
+        """
+        Remove n random keys, e.g. the keys being deleted from the table
+        """
+        with self._lock:
+            n = min(n, self._size)
+            indexes = self._rng.choice(self._size, size=n, replace=False)
+            keys = self._keys[indexes]
+
+            kept = np.ones(self._size, dtype=bool)
+            kept[indexes] = False
+            self._compact(kept)
+
+            if self._recent is not None and n:
+                filled = min(self.seen, self._recent_size)
+                self._recent_removed[:filled] |= np.isin(_comparable(self._recent[:filled]), _comparable(keys))
+
+            return keys
+
+    def _compact(self, kept):
+        """
+        :param kept: Bool mask of the kept keys to keep
+        """
+        size = int(np.count_nonzero(kept))
+        self._keys[:size] = self._keys[:self._size][kept]
+        self._times[:size] = self._times[:self._size][kept]
+        self._size = size
+
+    def remove_before(self, ms):
+        """
+        Remove the keys added before a time, e.g. the keys of the rows removed by Writer.delete_created_before
+        :param ms: Milliseconds since the Unix epoch
+        :return: Number of removed keys
+        """
+        with self._lock:
+            if self._recent is not None:
+                self._recent_removed |= self._recent_times < ms
+            if not self._size:
+                return 0
+
+            size = self._size
+            self._compact(self._times[:size] >= ms)
+            return size - self._size
+
+    def zipfian(self, n, s=1.1):
+        """
+        Keys with Zipf-distributed popularity, the popular keys are spread over the whole key range
+        :param s: Exponent of the distribution, > 1
+        """
+        with self._lock:
+            ranks = self._rng.zipf(s, size=n)
+            ranks = np.where(ranks <= self._size, ranks, self._rng.integers(1, self._size + 1, size=n))
+            # scatter the ranks over the kept keys, 2654435761 (Knuth's multiplicative hash) is a prime
+            indexes = (ranks.astype(np.uint64) * np.uint64(2654435761)) % np.uint64(self._size)
+            return self._keys[indexes.astype(np.int64)]
+
+    def recent(self, n):
+        """
+        Keys drawn uniformly from the most recently written ones, except the ones removed by pop or remove_before
+        """
+        with self._lock:
+            indexes = np.flatnonzero(~self._recent_removed[:min(self.seen, self._recent_size)])
+            if not len(indexes):  # all of them removed, the kept keys are the most recent ones
+                return self._keys[self._rng.integers(0, self._size, size=n)]
+            return self._recent[indexes[self._rng.integers(0, len(indexes), size=n)]]
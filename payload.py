@@ -0,0 +1,95 @@
+import base64
+import datetime
+import os
+import time
+
+import numpy as np
+
+
+def random_string(n):
+    s = base64.b64encode(os.urandom(n))
+    return s[:n]  # some characters are wasted
+
+
+class PayloadPool:
+    """
+    Hands out random row payloads as slices of one large pre-generated arena.
+
+    The arena is generated the same way as a single payload used to be (base64 of os.urandom), so the payloads
+    have the same size and entropy. Every slice is handed out only once, the arena is regenerated when it runs out.
+    """
+
+    def __init__(self, row_size=512, arena_rows=8192):
+        self._row_size = row_size
+        self._arena_size = row_size * arena_rows
+        self._arena = None
+        self._offset = self._arena_size
+
+    def _refill(self):
+        # a new object instead of overwriting in place, so the views handed out earlier stay valid
+        self._arena = memoryview(random_string(self._arena_size))
+        self._offset = 0
+
+    def take(self, n, views=False):
+        """
+        :param n: Number of payloads
+        :param views: Return memoryview slices of the arena instead of bytes copies
+        """
+        payloads = []
+        while len(payloads) < n:
+            if self._offset >= self._arena_size:
+                self._refill()
+
+            count = min(n - len(payloads), (self._arena_size - self._offset) // self._row_size)
+            arena, size, start = self._arena, self._row_size, self._offset
+            if views:
+                payloads.extend(arena[o:o + size] for o in range(start, start + count * size, size))
+            else:
+                payloads.extend(arena[o:o + size].tobytes() for o in range(start, start + count * size, size))
+            self._offset += count * size
+
+        return payloads
+
+    def take_array(self, n):
+        """
+        :return: uint8 array of shape (n, row_size), a view of the arena unless the arena had to be regenerated
+        """
+        chunks = []
+        taken = 0
+        while taken < n:
+            if self._offset >= self._arena_size:
+                self._refill()
+
+            count = min(n - taken, (self._arena_size - self._offset) // self._row_size)
+            chunks.append(np.frombuffer(self._arena, dtype=np.uint8, count=count * self._row_size, offset=self._offset))
+            self._offset += count * self._row_size
+            taken += count
+
+        payloads = chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+        return payloads.reshape(n, self._row_size)
+
+
+def ms_datetime(ms):
+    """
+    :param ms: Milliseconds since the Unix epoch
+    :return: Naive local datetime, the time_created values are stored in local time
+    """
+    return datetime.datetime.fromtimestamp(ms // 1000).replace(microsecond=ms % 1000 * 1000)
+
+
+class TimestampCache:
+    """
+    Formats the current time once per millisecond tick
+    """
+
+    def __init__(self):
+        self._last_ms = None
+        self._last_str = None
+
+    def now(self):
+        ms = time.time_ns() // 10**6
+        if ms != self._last_ms:
+            # fixed width, same as datetime.now().isoformat()
+            self._last_str = ms_datetime(ms).isoformat(timespec="microseconds")
+            self._last_ms = ms
+        return self._last_str
@@ -0,0 +1,89 @@
+import struct
+
+import numpy as np
+
+
+COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)  # signature, flags, header extension length
+COPY_TRAILER = struct.pack(">h", -1)
+
+COPY_CHUNK_SIZE = 1 << 16  # bytes handed to libpq per read() of the COPY data
+
+_HEX_DIGITS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+
+
+def bytea_text(values):
+    """
+    Text form of bytea values ('\\x' followed by hex digits).
+
+    This is what ends up in a varchar column when psycopg2 inserts bytes into it, COPY has to send the same text
+    so that the stored rows are identical to the ones written by INSERT.
+    :param values: uint8 array of shape (n, width)
+    :return: uint8 array of shape (n, 2 + 2 * width)
+    """
+    n, width = values.shape
+    text = np.empty((n, 2 + 2 * width), dtype=np.uint8)
+    text[:, 0] = ord("\\")
+    text[:, 1] = ord("x")
+    text[:, 2::2] = _HEX_DIGITS[values >> 4]
+    text[:, 3::2] = _HEX_DIGITS[values & 0x0f]
+    return text
+
+
+class BinaryCopyEncoder:
+    """
+    Encodes rows of fixed-width fields into the binary COPY format, reusing buffers between batches
+    """
+
+    def __init__(self, buffer_count=1):
+        """
+        :param buffer_count: Number of buffers used in rotation, i.e. how many encoded batches stay valid at a time
+        """
+        self.buffer_count = buffer_count
+        self._buffers = [None] * buffer_count
+        self._next = 0
+
+    def encode(self, n, columns):
+        """
+        :param n: Number of rows
+        :param columns: Already encoded field values, uint8 arrays of shape (n, width) or (1, width) for a value
+        shared by all rows
+        :return: memoryview of the encoded data, valid for the next buffer_count - 1 calls
+        """
+        widths = [column.shape[1] for column in columns]
+        row_size = 2 + sum(4 + width for width in widths)
+        size = len(COPY_HEADER) + n * row_size + len(COPY_TRAILER)
+
+        buffer = self._buffers[self._next]
+        if buffer is None or len(buffer) != size:
+            buffer = self._buffers[self._next] = np.empty(size, dtype=np.uint8)
+            buffer[:len(COPY_HEADER)] = np.frombuffer(COPY_HEADER, dtype=np.uint8)
+            buffer[-len(COPY_TRAILER):] = np.frombuffer(COPY_TRAILER, dtype=np.uint8)
+        self._next = (self._next + 1) % self.buffer_count
+
+        rows = buffer[len(COPY_HEADER):len(COPY_HEADER) + n * row_size].reshape(n, row_size)
+        rows[:, :2] = np.frombuffer(struct.pack(">h", len(columns)), dtype=np.uint8)
+
+        offset = 2
+        for column, width in zip(columns, widths):
+            rows[:, offset:offset + 4] = np.frombuffer(struct.pack(">i", width), dtype=np.uint8)
+            rows[:, offset + 4:offset + 4 + width] = column
+            offset += 4 + width
+
+        return memoryview(buffer)
+
+
+class BufferReader:
+    """
+    File-like reader over an encoded batch for cursor.copy_expert(), which only accepts read() returning bytes,
+    so only one chunk at a time is copied instead of the whole batch
+    """
+
+    def __init__(self, buffer):
+        self._buffer = memoryview(buffer)
+        self._offset = 0
+
+    def read(self, size=-1):
+        end = len(self._buffer) if size < 0 else min(self._offset + size, len(self._buffer))
+        chunk = self._buffer[self._offset:end].tobytes()
+        self._offset = end
+        return chunk
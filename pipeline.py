@@ -0,0 +1,85 @@
+import queue
+import threading
+import time
+
+
+class PipelinedWriter:
+    """
+    Generates and encodes batches in a producer thread ahead of the writes, so that building the next batch overlaps
+    with executing and committing the current one. The write loop only executes and commits the prepared batches.
+    """
+
+    def __init__(self, writer, batch_size, batch_count, depth=2):
+        """
+        :param depth: Maximum number of prepared batches waiting in the queue
+        """
+        self._writer = writer
+        self._batch_size = batch_size
+        self._batch_count = batch_count
+        self._queue = queue.Queue(maxsize=depth)
+        self._stop = threading.Event()
+        self._thread = None
+
+        # the prepared batches in the queue, the one being prepared and the one being written have to stay valid
+        writer.batches_in_flight = depth + 2
+
+        self.queue_depth = []  # prepared batches waiting when the write loop asked for the next one
+        self.stall_time = []  # time the write loop waited for the producer, i.e. the producer was the bottleneck
+        self.producer_wait = []  # time the producer waited for free space in the queue, i.e. the DB was the bottleneck
+
+    def start(self):
+        self._writer.connection  # connect in the calling thread, the producer only needs the dialect
+        self._thread = threading.Thread(target=self._produce, name="batch-producer", daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        """
+        Wait for free space in the queue until the pipeline is stopped
+        :return: Whether the item was queued
+        """
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self):
+        try:
+            for _ in range(self._batch_count):
+                item = self._writer.prepare_batch(self._batch_size)
+
+                start = time.perf_counter()
+                queued = self._put(item)
+                self.producer_wait.append(time.perf_counter() - start)
+
+                if not queued:
+                    return
+        except Exception as e:
+            self._put(e)  # the write loop may have stopped reading, then stop() ends the wait
+
+    def write_batch(self, batch_size):
+        """
+        Write the next prepared batch, same interface as Writer.write_batch
+        """
+        if batch_size != self._batch_size:
+            raise ValueError(f"The pipeline prepares batches of {self._batch_size} rows, not {batch_size}")
+
+        self.queue_depth.append(self._queue.qsize())
+        start = time.perf_counter()
+        item = self._queue.get()
+        self.stall_time.append(time.perf_counter() - start)
+
+        if isinstance(item, Exception):
+            raise item
+
+        execute, build_time = item
+        return build_time, self._writer.execute_batch(execute)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._writer.batches_in_flight = 1
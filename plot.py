@@ -1,7 +1,16 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import matplotlib
+matplotlib.use("Agg")  # render headless, the figures are only saved to files
 import matplotlib.pyplot as plt
 import matplotlib.ticker as tkr
-import numpy as np
-import json
+
+import analysis
+
+
+MAX_POINTS = 2000  # longer series are downsampled with LTTB before plotting
 
 
 def sizeof_fmt(x, pos):
@@ -13,10 +22,6 @@ def sizeof_fmt(x, pos):
         x /= 1024.0
 
 
-def moving_average(x, w):
-    return np.convolve(x, np.ones(w), 'valid') / w
-
-
 def plot_io(fig_name, runs, title, datapoints=60, smooth=False, derivative=False):
 
     fig, ax = plt.subplots(figsize=(8, 5))
@@ -24,30 +29,20 @@ def plot_io(fig_name, runs, title, datapoints=60, smooth=False, derivative=False
     ax.set(xlabel='Rows written', ylabel='Disk writes (B)')
 
     for name, label, color, *other in runs:
-        with open(f"results/{name}.json", "r") as f:
-            data = json.load(f)
+        run = analysis.load(name)
 
-        rows_points = data["rows_written"][:datapoints]
+        rows_points = run.rows[:datapoints]
 
-        time_elapsed = data["time_elapsed"][:datapoints]
-
-        io_points = data["io_write"][:datapoints]
+        io_points = run.io_write[:datapoints]
 
         if smooth:
-            io_points = moving_average(io_points, 7)
-            rows_points = rows_points[3:-3]
-            time_elapsed = time_elapsed[3:-3]
+            rows_points, io_points = analysis.smooth(rows_points, io_points, 7)
 
         if derivative:
-            rows_diff = np.diff(rows_points)
-            rows_points = rows_points[:-1]
-            time_elapsed = time_elapsed[:-1]
-            io_points = np.diff(io_points) / rows_diff
-
-        # # ax2.set_xlim(ax.get_xlim())
-        # ax2.set_xticks(time_elapsed)
-        # # ax2.set_xticklabels(tick_function(new_tick_locations))
-        # ax2.set_xlabel(r"Elapsed time:")
+            rows_points, io_points = analysis.derivative(rows_points, io_points)
+
+        rows_points, io_points = analysis.lttb(rows_points, io_points, MAX_POINTS)
+
         kwargs = dict(label=label, color=color, linewidth=1.6)
         if other:
             kwargs = {**kwargs, **other[0]}
@@ -64,8 +59,40 @@ def plot_io(fig_name, runs, title, datapoints=60, smooth=False, derivative=False
     plt.title(title)
 
     fig.savefig(f"figs/{fig_name}.png")
-    # plt.tight_layout()
-    plt.show()
+    plt.close(fig)
+
+def plot_metric(fig_name, runs, title, metric, ylabel, datapoints=60):
+    """
+    :param metric: Name of a series of analysis.Run aligned with Run.rows, e.g. "write_amplification"
+    """
+
+    fig, ax = plt.subplots(figsize=(8, 5))
+
+    ax.set(xlabel='Rows written', ylabel=ylabel)
+
+    for name, label, color, *other in runs:
+        run = analysis.load(name)
+
+        values = getattr(run, metric)[:datapoints]
+        rows_points = run.rows[:len(values)]
+        rows_points, values = analysis.lttb(rows_points, values, MAX_POINTS)
+
+        kwargs = dict(label=label, color=color, linewidth=1.6)
+        if other:
+            kwargs = {**kwargs, **other[0]}
+
+        ax.plot(rows_points, values, **kwargs)
+
+    ax.grid()
+    leg = ax.legend()
+
+    for line in leg.get_lines():
+        line.set_linewidth(4.0)
+    plt.title(title)
+
+    fig.savefig(f"figs/{fig_name}.png")
+    plt.close(fig)
+
 
 def plot_bar(fig_name, runs, title, datapoints=60):
 
@@ -78,10 +105,7 @@ def plot_bar(fig_name, runs, title, datapoints=60):
     plt_colors = []
 
     for name, label, color, *other in runs:
-        with open(f"results/{name}.json", "r") as f:
-            data = json.load(f)
-
-        io_points = data["io_write"][:datapoints]
+        io_points = analysis.load(name).io_write[:datapoints]
         total_io = io_points[-1]
 
         plt_labels.append(label)
@@ -98,146 +122,223 @@ def plot_bar(fig_name, runs, title, datapoints=60):
 
     plt.title(title)
     fig.savefig(f"figs/{fig_name}.png")
-    # plt.tight_layout()
-    plt.show()
-
-
-plot_io(
-"sqlite_clustered",
-[
-       ("sqlite_clustered_int64_random", "Random Int64", "tab:red"),
-       ("sqlite_clustered_int64_sequential", "Sequential Int64", "orange"),
-], title="Written bytes to disk (cumulative), clustered index")
-
-plot_io(
-"sqlite_clustered_differenciated",
-[
-       ("sqlite_clustered_int64_random", "Random Int64", "tab:red"),
-       ("sqlite_clustered_int64_sequential", "Sequential Int64", "orange"),
-], title="Written bytes to disk (per row), clustered index", smooth=True, derivative=True, datapoints=500)
-
-
-
-plot_io(
-"sqlite_nonclustered",
-[
-       ("sqlite_nonclustered_int64_random", "Random Int64", "tab:blue"),
-       ("sqlite_nonclustered_int64_sequential", "Sequential Int64", "tab:green"),
-], title="Written bytes to disk (cumulative), non-clustered index")
-
-
-plot_io(
-"sqlite_clustered_nonclustered",
-[
-       ("sqlite_nonclustered_int64_random", "Non-clustered, Random Int64", "tab:blue"),
-       ("sqlite_nonclustered_int64_sequential", "Non-clustered, Sequential Int64", "tab:green"),
-       ("sqlite_clustered_int64_random", "Clustered, Random Int64", "tab:red"),
-       ("sqlite_clustered_int64_sequential", "Clustered, Sequential Int64", "orange"),
-], title="Written bytes to disk (cumulative), clustered vs. non-clustered index")
-
-plot_io(
-"mariadb_writes",
-[
-       ("mariadb_random", "Random Int64", (0.9, 0.62, 0)),
-       ("mariadb_sequential", "Sequential Int64", (0, 0.44, 0.69)),
-], title="Written bytes to disk (cumulative), MariaDB (InnoDB)")
-
-plot_io(
-"mariadb_differenciated",
-[
-       ("mariadb_random", "Random Int64", (0.9, 0.62, 0)),
-       ("mariadb_sequential", "Sequential Int64", (0, 0.44, 0.69)),
-], title="Written bytes to disk (per row), MariaDB (InnoDB)", smooth=True, derivative=True, datapoints=500)
-
-plot_io(
-"postgres_writes_short",
-[
-       ("postgres_random", "Random Int64", "tab:blue"),
-       ("postgres_sequential", "Sequential Int64", "tab:green"),
-], title="Written bytes to disk (cumulative), PostgreSQL")
-
-plot_io(
-"postgres_writes_long",
-[
-       ("postgres_random", "Random Int64", "tab:blue"),
-       ("postgres_sequential", "Sequential Int64", "tab:green"),
-], title="Written bytes to disk (cumulative), PostgreSQL", datapoints=500)
-
-plot_io(
-"postgres_differenciated",
-[
-       ("postgres_random", "Random Int64", "tab:blue"),
-       ("postgres_sequential", "Sequential Int64", "tab:green"),
-], title="Written bytes to disk (per row), PostgreSQL", smooth=True, derivative=True, datapoints=500)
-
-
-plot_io(
-"sqlite_clustered_uuid1_uuid4",
-[
-       ("sqlite_clustered_uuid1", "UUID1", "black"),
-       ("sqlite_clustered_uuid4", "UUID4", "tab:blue"),
-
-], title="Written bytes to disk (cumulative), SQLite, clustered index", datapoints=500)
-
-plot_io(
-"sqlite_clustered_uuid1_fastrollover_uuid4",
-[
-       ("sqlite_clustered_uuid1", "UUID1", "black"),
-       ("sqlite_clustered_uuid1_fast_rollover", "UUID1_fastrollover", "tab:red"),
-       ("sqlite_clustered_uuid4", "UUID4", "tab:blue"),
-
-], title="Written bytes to disk (cumulative), SQLite, clustered index", datapoints=500)
-
-
-plot_io(
-"sqlite_clustered_uuid",
-[
-       ("sqlite_clustered_uuid1_fast_rollover", "UUID1_fastrollover", "tab:red"),
-       ("sqlite_clustered_uuid4", "UUID4", "tab:blue"),
-       ("sqlite_clustered_uuid6", "UUID6", "tab:green"),
-       ("sqlite_clustered_uuid7", "UUID7", "tab:orange"),
-
-
-], title="Written bytes to disk (cumulative), SQLite, clustered index", datapoints=500)
-
-
-plot_io(
-"mariadb_uuid",
-[
-       ("mariadb_uuid1_fast_rollover", "UUID1_fastrollover", "tab:red"),
-       ("mariadb_uuid4", "UUID4", "tab:blue"),
-       ("mariadb_uuid7", "UUID7", "tab:orange", { "linewidth": 3}),  # uuid6 and uuid7 are identical
-       ("mariadb_uuid6", "UUID6", "tab:green", {"linestyle": ":", "linewidth": 3}),
-], title="Written bytes to disk (cumulative), MariaDB, clustered index", datapoints=1000)
-
-
-plot_bar("mariadb_uuid_totals",
-[
-    ("mariadb_uuid1_fast_rollover", "UUID1_fastrollover", "tab:red"),
-    ("mariadb_uuid4", "UUID4", "tab:blue"),
-    ("mariadb_uuid6", "UUID6", "tab:green"),
-    ("mariadb_uuid7", "UUID7", "tab:orange"),
-],
-title="Total written bytes after inserting 1M records, MariaDB, clustered index", datapoints=1000)
-
-
-plot_io(
-"postgres_uuid",
-[
-       ("postgres_uuid1_fast_rollover", "UUID1_fastrollover", "tab:red"),
-       ("postgres_uuid4", "UUID4", "tab:blue"),
-       ("postgres_uuid6", "UUID6", "tab:green"),
-       ("postgres_uuid7", "UUID7", "tab:orange"),
-
-
-], title="Written bytes to disk (cumulative), PostgreSQL, non-clustered index", datapoints=1000)
-
-
-plot_bar("postgres_uuid_totals",
-[
-    ("postgres_uuid1_fast_rollover", "UUID1_fastrollover", "tab:red"),
-    ("postgres_uuid4", "UUID4", "tab:blue"),
-    ("postgres_uuid6", "UUID6", "tab:green"),
-    ("postgres_uuid7", "UUID7", "tab:orange"),
-],
-title="Total written bytes after inserting 1M records, PostgreSQL, non-clustered index", datapoints=1000)
+    plt.close(fig)
+
+
+def _render(figure):
+    figure()
+    return figure.args[0]
+
+
+def render_all(figures, workers=None):
+    """
+    Render the figures in a pool of processes. The runs are loaded before forking the workers,
+    so every result file is read only once.
+    """
+    for figure in figures:
+        for name, *_ in figure.args[1]:
+            analysis.load(name)
+
+    context = multiprocessing.get_context("fork")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        for fig_name in executor.map(_render, figures):
+            print(f"Saved figs/{fig_name}.png")
+
+
+FIGURES = [
+
+    partial(plot_io,
+    "sqlite_clustered",
+    [
+           ("sqlite_clustered_int64_random", "Random Int64", "tab:red"),
+           ("sqlite_clustered_int64_sequential", "Sequential Int64", "orange"),
+    ], title="Written bytes to disk (cumulative), clustered index"),
+
+    partial(plot_io,
+    "sqlite_clustered_differenciated",
+    [
+           ("sqlite_clustered_int64_random", "Random Int64", "tab:red"),
+           ("sqlite_clustered_int64_sequential", "Sequential Int64", "orange"),
+    ], title="Written bytes to disk (per row), clustered index", smooth=True, derivative=True, datapoints=500),
+
+
+
+    partial(plot_io,
+    "sqlite_nonclustered",
+    [
+           ("sqlite_nonclustered_int64_random", "Random Int64", "tab:blue"),
+           ("sqlite_nonclustered_int64_sequential", "Sequential Int64", "tab:green"),
+    ], title="Written bytes to disk (cumulative), non-clustered index"),
+
+
+    partial(plot_io,
+    "sqlite_clustered_nonclustered",
+    [
+           ("sqlite_nonclustered_int64_random", "Non-clustered, Random Int64", "tab:blue"),
+           ("sqlite_nonclustered_int64_sequential", "Non-clustered, Sequential Int64", "tab:green"),
+           ("sqlite_clustered_int64_random", "Clustered, Random Int64", "tab:red"),
+           ("sqlite_clustered_int64_sequential", "Clustered, Sequential Int64", "orange"),
+    ], title="Written bytes to disk (cumulative), clustered vs. non-clustered index"),
+
+    partial(plot_io,
+    "mariadb_writes",
+    [
+           ("mariadb_random", "Random Int64", (0.9, 0.62, 0)),
+           ("mariadb_sequential", "Sequential Int64", (0, 0.44, 0.69)),
+    ], title="Written bytes to disk (cumulative), MariaDB (InnoDB)"),
+
+    partial(plot_io,
+    "mariadb_differenciated",
+    [
+           ("mariadb_random", "Random Int64", (0.9, 0.62, 0)),
+           ("mariadb_sequential", "Sequential Int64", (0, 0.44, 0.69)),
+    ], title="Written bytes to disk (per row), MariaDB (InnoDB)", smooth=True, derivative=True, datapoints=500),
+
+    partial(plot_io,
+    "postgres_writes_short",
+    [
+           ("postgres_random", "Random Int64", "tab:blue"),
+           ("postgres_sequential", "Sequential Int64", "tab:green"),
+    ], title="Written bytes to disk (cumulative), PostgreSQL"),
+
+    partial(plot_io,
+    "postgres_writes_long",
+    [
+           ("postgres_random", "Random Int64", "tab:blue"),
+           ("postgres_sequential", "Sequential Int64", "tab:green"),
+    ], title="Written bytes to disk (cumulative), PostgreSQL", datapoints=500),
+
+    partial(plot_io,
+    "postgres_differenciated",
+    [
+           ("postgres_random", "Random Int64", "tab:blue"),
+           ("postgres_sequential", "Sequential Int64", "tab:green"),
+    ], title="Written bytes to disk (per row), PostgreSQL", smooth=True, derivative=True, datapoints=500),
+
+
+    partial(plot_io,
+    "sqlite_clustered_uuid1_uuid4",
+    [
+           ("sqlite_clustered_uuid1", "UUID1", "black"),
+           ("sqlite_clustered_uuid4", "UUID4", "tab:blue"),
+
+    ], title="Written bytes to disk (cumulative), SQLite, clustered index", datapoints=500),
+
+    partial(plot_io,
+    "sqlite_clustered_uuid1_fastrollover_uuid4",
+    [
+           ("sqlite_clustered_uuid1", "UUID1", "black"),
+           ("sqlite_clustered_uuid1_fast_rollover", "UUID1_fastrollover", "tab:red"),
+           ("sqlite_clustered_uuid4", "UUID4", "tab:blue"),
+
+    ], title="Written bytes to disk (cumulative), SQLite, clustered index", datapoints=500),
+
+
+    partial(plot_io,
+    "sqlite_clustered_uuid",
+    [
+           ("sqlite_clustered_uuid1_fast_rollover", "UUID1_fastrollover", "tab:red"),
+           ("sqlite_clustered_uuid4", "UUID4", "tab:blue"),
+           ("sqlite_clustered_uuid6", "UUID6", "tab:green"),
+           ("sqlite_clustered_uuid7", "UUID7", "tab:orange"),
+
+
+    ], title="Written bytes to disk (cumulative), SQLite, clustered index", datapoints=500),
+
+
+    partial(plot_metric,
+    "sqlite_clustered_write_amplification",
+    [
+           ("sqlite_clustered_int64_random", "Random Int64", "tab:red"),
+           ("sqlite_clustered_int64_sequential", "Sequential Int64", "orange"),
+           ("sqlite_clustered_uuid4", "UUID4", "tab:blue"),
+           ("sqlite_clustered_uuid7", "UUID7", "tab:green"),
+    ], title="Written bytes per byte of inserted rows, SQLite, clustered index",
+    metric="write_amplification", ylabel="Write amplification", datapoints=1000),
+
+    partial(plot_metric,
+    "sqlite_clustered_size_amplification",
+    [
+           ("sqlite_clustered_int64_random", "Random Int64", "tab:red"),
+           ("sqlite_clustered_int64_sequential", "Sequential Int64", "orange"),
+           ("sqlite_clustered_uuid4", "UUID4", "tab:blue"),
+           ("sqlite_clustered_uuid7", "UUID7", "tab:green"),
+    ], title="Table size per byte of inserted rows, SQLite, clustered index",
+    metric="size_amplification", ylabel="Size amplification", datapoints=1000),
+
+    partial(plot_metric,
+    "sqlite_clustered_bytes_written_per_row",
+    [
+           ("sqlite_clustered_int64_random", "Random Int64", "tab:red"),
+           ("sqlite_clustered_int64_sequential", "Sequential Int64", "orange"),
+           ("sqlite_clustered_uuid4", "UUID4", "tab:blue"),
+           ("sqlite_clustered_uuid7", "UUID7", "tab:green"),
+    ], title="Written bytes per inserted row, SQLite, clustered index",
+    metric="bytes_written_per_row", ylabel="Bytes written per row", datapoints=1000),
+
+    partial(plot_metric,
+    "sqlite_clustered_rows_per_sec",
+    [
+           ("sqlite_clustered_int64_random", "Random Int64", "tab:red"),
+           ("sqlite_clustered_int64_sequential", "Sequential Int64", "orange"),
+           ("sqlite_clustered_uuid4", "UUID4", "tab:blue"),
+           ("sqlite_clustered_uuid7", "UUID7", "tab:green"),
+    ], title="Inserted rows per second, SQLite, clustered index",
+    metric="rows_per_sec", ylabel="Rows per second", datapoints=1000),
+
+    partial(plot_io,
+    "sqlite_clustered_simulated",
+    [
+           ("sqlite_clustered_int64_random", "Random Int64", "tab:red"),
+           ("sqlite_clustered_int64_sequential", "Sequential Int64", "orange"),
+           ("sim_sqlite_int64_random", "Random Int64, simulated", "tab:red", {"linestyle": "--"}),
+           ("sim_sqlite_int64_sequential", "Sequential Int64, simulated", "orange", {"linestyle": "--"}),
+    ], title="Written bytes to disk (cumulative), SQLite, measured vs. simulated", datapoints=1000),
+
+
+    partial(plot_io,
+    "mariadb_uuid",
+    [
+           ("mariadb_uuid1_fast_rollover", "UUID1_fastrollover", "tab:red"),
+           ("mariadb_uuid4", "UUID4", "tab:blue"),
+           ("mariadb_uuid7", "UUID7", "tab:orange", { "linewidth": 3}),  # uuid6 and uuid7 are identical
+           ("mariadb_uuid6", "UUID6", "tab:green", {"linestyle": ":", "linewidth": 3}),
+    ], title="Written bytes to disk (cumulative), MariaDB, clustered index", datapoints=1000),
+
+
+    partial(plot_bar, "mariadb_uuid_totals",
+    [
+        ("mariadb_uuid1_fast_rollover", "UUID1_fastrollover", "tab:red"),
+        ("mariadb_uuid4", "UUID4", "tab:blue"),
+        ("mariadb_uuid6", "UUID6", "tab:green"),
+        ("mariadb_uuid7", "UUID7", "tab:orange"),
+    ],
+    title="Total written bytes after inserting 1M records, MariaDB, clustered index", datapoints=1000),
+
+
+    partial(plot_io,
+    "postgres_uuid",
+    [
+           ("postgres_uuid1_fast_rollover", "UUID1_fastrollover", "tab:red"),
+           ("postgres_uuid4", "UUID4", "tab:blue"),
+           ("postgres_uuid6", "UUID6", "tab:green"),
+           ("postgres_uuid7", "UUID7", "tab:orange"),
+
+
+    ], title="Written bytes to disk (cumulative), PostgreSQL, non-clustered index", datapoints=1000),
+
+
+    partial(plot_bar, "postgres_uuid_totals",
+    [
+        ("postgres_uuid1_fast_rollover", "UUID1_fastrollover", "tab:red"),
+        ("postgres_uuid4", "UUID4", "tab:blue"),
+        ("postgres_uuid6", "UUID6", "tab:green"),
+        ("postgres_uuid7", "UUID7", "tab:orange"),
+    ],
+    title="Total written bytes after inserting 1M records, PostgreSQL, non-clustered index", datapoints=1000),
+
+]
+
+
+if __name__ == "__main__":
+    render_all(FIGURES)
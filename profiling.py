@@ -0,0 +1,250 @@
+"""
+Opt-in profiling of the write loop, to attribute the client-side overhead of a run.
+
+- cprofile: deterministic profile of the whole loop, saved as profile.pstats (open with pstats or snakeviz)
+- tracemalloc: snapshots of the live allocations every n batches, saved as tracemalloc_<batch>.snapshot
+- sampling: wall-clock stacks of the write loop thread sampled at a fixed interval, saved as wall_samples.folded
+  (one "frame;frame;... count" line per distinct stack, the input format of flamegraph.pl and speedscope)
+
+The summary splits the profiled time and allocations into key_gen, generate_batch (row and payload building,
+including key_gen), sqlalchemy and driver (the DB-API calls).
+"""
+import collections
+import cProfile
+import dis
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+from sqlalchemy.engine.default import DefaultDialect
+
+import writer as writer_module
+
+
+PROFILE_CPROFILE = "cprofile"
+PROFILE_TRACEMALLOC = "tracemalloc"
+PROFILE_SAMPLING = "sampling"
+
+PROFILE_MODES = (PROFILE_CPROFILE, PROFILE_TRACEMALLOC, PROFILE_SAMPLING)
+
+CATEGORIES = ("key_gen", "generate_batch", "sqlalchemy", "driver")
+
+DRIVER_MODULES = ("sqlite3", "psycopg2", "mariadb")
+
+# functions calling into the DB-API, the time spent in C code of the driver is seen as time spent in these
+DBAPI_CALL_SITES = [
+    DefaultDialect.do_execute.__code__,
+    DefaultDialect.do_executemany.__code__,
+    DefaultDialect.do_execute_no_params.__code__,
+    writer_module.Writer._raw_insert.__code__,
+    writer_module.PostgresWriter._raw_insert.__code__,
+]
+
+GENERATE_FUNCTIONS = ("generate_rows", "generate_batch")
+
+
+def _code_lines(code):
+    return {(code.co_filename, line) for _, line in dis.findlinestarts(code) if line is not None}
+
+
+_DBAPI_CALL_LINES = set().union(*(_code_lines(code) for code in DBAPI_CALL_SITES))
+_GENERATE_LINES = set().union(*(_code_lines(getattr(writer_module.Writer, name).__code__)
+                                for name in GENERATE_FUNCTIONS))
+
+
+def frame_category(filename, function):
+    """
+    :param function: Function name, C functions as reported by cProfile, e.g. "<method 'execute' of ...>"
+    :return: One of CATEGORIES or None
+    """
+    if filename == "~":  # C function
+        return "driver" if any(f"'{module}." in function for module in DRIVER_MODULES) else None
+    if any(f"{os.sep}{module}{os.sep}" in filename for module in DRIVER_MODULES):
+        return "driver"
+    if f"{os.sep}sqlalchemy{os.sep}" in filename:
+        return "sqlalchemy"
+    if os.path.basename(filename) == "key_gen.py":
+        return "key_gen"
+    if os.path.basename(filename) == "writer.py" and function in GENERATE_FUNCTIONS:
+        return "generate_batch"
+    return None
+
+
+def _line_category(filename, lineno):
+    """
+    Category of a frame of a tracemalloc traceback, which only has the file and line
+    """
+    if (filename, lineno) in _DBAPI_CALL_LINES:
+        return "driver"
+    if (filename, lineno) in _GENERATE_LINES:
+        return "generate_batch"
+    return frame_category(filename, None)
+
+
+def _shares(times):
+    total = times.pop("total")
+    return {category: times.get(category, 0) / total if total else 0.0 for category in CATEGORIES}
+
+
+def cprofile_shares(stats):
+    """
+    Inclusive share of each category in the profiled time: the time of the calls entering a category
+    from outside of it, so e.g. key_gen called from generate_batch is included in both
+    :param stats: pstats.Stats
+    """
+    categories = {func: frame_category(func[0], func[2]) for func in stats.stats}
+    times = collections.Counter(total=stats.total_tt)
+
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        category = categories[func]
+        if category is None:
+            continue
+        for caller, (_, _, _, cumulative) in callers.items():
+            if categories.get(caller) != category:
+                times[category] += cumulative
+
+    return _shares(times)
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of one thread at a fixed wall-clock interval, so time spent waiting for the DB counts too
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        self._thread_id = thread_id
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self.stacks = collections.Counter()  # (file:function, ...) from the outermost frame -> number of samples
+        self.categories = collections.Counter(total=0)  # categories of the samples, innermost category wins
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+
+            stack = []
+            category = None
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                if category is None:
+                    category = "driver" if code in DBAPI_CALL_SITES else frame_category(code.co_filename, code.co_name)
+                frame = frame.f_back
+
+            self.stacks[tuple(reversed(stack))] += 1
+            self.categories["total"] += 1
+            if category is not None:
+                self.categories[category] += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def save(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{';'.join(stack)} {count}\n")
+
+
+class RunProfiler:
+    """
+    Runs the selected profilers around the write loop of a run
+    """
+
+    def __init__(self, modes, output_dir=None, tracemalloc_every=100, sampling_interval=0.005):
+        """
+        :param modes: Any of PROFILE_MODES
+        :param output_dir: Directory the artifacts are saved into, None to only return the summary
+        :param tracemalloc_every: Take a tracemalloc snapshot every n batches
+        """
+        unknown = set(modes) - set(PROFILE_MODES)
+        if unknown:
+            raise ValueError(f"Unknown profiling modes {unknown}, expected some of {PROFILE_MODES}")
+
+        self._modes = modes
+        self._output_dir = output_dir
+        self._tracemalloc_every = tracemalloc_every
+        self._sampling_interval = sampling_interval
+        self._profile = None
+        self._sampler = None
+        self._snapshot = None
+        self._wall_time = None
+
+    def _path(self, filename):
+        return os.path.join(self._output_dir, filename) if self._output_dir is not None else None
+
+    def start(self):
+        """
+        Start profiling the calling thread
+        """
+        if PROFILE_TRACEMALLOC in self._modes:
+            tracemalloc.start(25)
+        if PROFILE_SAMPLING in self._modes:
+            self._sampler = SamplingProfiler(threading.get_ident(), self._sampling_interval)
+            self._sampler.start()
+        if PROFILE_CPROFILE in self._modes:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        self._wall_time = time.perf_counter()
+
+    def batch_done(self, batch_i):
+        if PROFILE_TRACEMALLOC in self._modes and (batch_i + 1) % self._tracemalloc_every == 0:
+            self._take_snapshot(batch_i)
+
+    def _take_snapshot(self, batch_i):
+        self._snapshot = tracemalloc.take_snapshot()
+        if self._output_dir is not None:
+            self._snapshot.dump(self._path(f"tracemalloc_{batch_i + 1}.snapshot"))
+
+    def stop(self, batch_count):
+        """
+        :return: Share of each category in the time and the live allocations measured by each of the profilers
+        """
+        wall_time = time.perf_counter() - self._wall_time
+        summary = {"wall_time": wall_time}
+
+        if self._profile is not None:
+            self._profile.disable()
+            stats = pstats.Stats(self._profile)
+            if self._output_dir is not None:
+                stats.dump_stats(self._path("profile.pstats"))
+            summary[PROFILE_CPROFILE] = cprofile_shares(stats)
+
+        if self._sampler is not None:
+            self._sampler.stop()
+            if self._output_dir is not None:
+                self._sampler.save(self._path("wall_samples.folded"))
+            summary[PROFILE_SAMPLING] = _shares(self._sampler.categories)
+
+        if PROFILE_TRACEMALLOC in self._modes:
+            if batch_count % self._tracemalloc_every:
+                self._take_snapshot(batch_count - 1)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            sizes = collections.Counter(total=0)
+            for trace in self._snapshot.traces:
+                sizes["total"] += trace.size
+                for frame in reversed(trace.traceback):  # innermost frame first
+                    category = _line_category(frame.filename, frame.lineno)
+                    if category is not None:
+                        sizes[category] += trace.size
+                        break
+            summary[PROFILE_TRACEMALLOC] = {**_shares(sizes), "peak": peak}
+
+        for mode in PROFILE_MODES:
+            if mode in summary:
+                shares = summary[mode]
+                print(f"{mode}: " + " ; ".join(f"{category} {shares[category] * 100:.1f}%" for category in CATEGORIES))
+
+        return summary
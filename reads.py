@@ -0,0 +1,244 @@
+import datetime
+import random
+import time
+
+from sqlalchemy import bindparam, select
+
+from contention import latency_summary
+from payload import ms_datetime
+
+
+READ_PK = 0  # primary key range, only for keys ordered by creation time, see KeyGenerator.time_boundary
+READ_TIME_CREATED = 1  # filter on the time_created column
+
+READ_METHODS = {READ_PK: "pk_range", READ_TIME_CREATED: "time_created"}
+
+LOOKUP_UNIFORM = 0
+LOOKUP_ZIPFIAN = 1
+LOOKUP_RECENT = 2
+
+LOOKUP_DISTRIBUTIONS = {LOOKUP_UNIFORM: "uniform", LOOKUP_ZIPFIAN: "zipfian", LOOKUP_RECENT: "recent"}
+
+
+class TimeRangeReader:
+    """
+    Read phases run between the write batches: every phase queries the same random time windows once as
+    a range of the primary key and once as a filter on time_created, and measures each query separately
+    """
+
+    def __init__(self, writer, io_probe, query_count, window=1.0, store=None):
+        """
+        :param query_count: Number of time windows queried in every phase
+        :param window: Seconds of inserts covered by every window
+        :param store: result_store.ColumnarWriter with READ_COLUMNS, every query is appended to it
+        """
+        self._writer = writer
+        self._io_probe = io_probe
+        self._query_count = query_count
+        self._window_ms = max(1, int(window * 1000))
+        self._store = store
+        self._start_ms = None
+
+        self.series = {
+            "read_rows_written": [],
+            "read_method": [],
+            "read_latency": [],
+            "read_rows": [],
+            "read_io": [],
+            "read_io_ops": [],  # block I/Os, -1 where the probe can't count them
+        }
+
+    def start(self):
+        """
+        Mark the start of the writes, the windows are taken from the rows written after this
+        """
+        self._start_ms = time.time_ns() // 10**6
+
+    def _statements(self, start_ms):
+        table = self._writer.table
+        end_ms = start_ms + self._window_ms
+        statements = {}
+
+        # mid-millisecond, so the float timestamp in time_boundary can't round down to the previous millisecond
+        lower = self._writer.key_gen.time_boundary(ms_datetime(start_ms) + datetime.timedelta(microseconds=500))
+        upper = self._writer.key_gen.time_boundary(ms_datetime(end_ms - 1) + datetime.timedelta(microseconds=500),
+                                                   lower=False)
+        if lower is not None:
+            statements[READ_PK] = select(table).where(table.c.id >= lower, table.c.id <= upper)
+
+        statements[READ_TIME_CREATED] = select(table).where(
+            table.c.time_created >= ms_datetime(start_ms).isoformat(timespec="microseconds"),
+            table.c.time_created < ms_datetime(end_ms).isoformat(timespec="microseconds"),
+        )
+
+        return statements
+
+    def _query(self, statement):
+        connection = self._writer.connection
+        io_start = self._io_probe.read()
+        start = time.perf_counter()
+
+        with connection.begin():
+            rows = len(connection.execute(statement).fetchall())
+
+        latency = time.perf_counter() - start
+        io = self._io_probe.read() - io_start
+
+        return latency, rows, io
+
+    def read_phase(self, rows_written):
+        """
+        :param rows_written: Rows in the table, recorded with every query
+        """
+        last_start_ms = time.time_ns() // 10**6 - self._window_ms
+        if self._start_ms is None or last_start_ms < self._start_ms:
+            return  # nothing written yet to read a whole window of
+
+        for _ in range(self._query_count):
+            start_ms = random.randint(self._start_ms, last_start_ms)
+
+            for method, statement in self._statements(start_ms).items():
+                latency, rows, io = self._query(statement)
+                read_ops = -1 if io.read_ops is None else io.read_ops
+
+                series = self.series
+                series["read_rows_written"].append(rows_written)
+                series["read_method"].append(method)
+                series["read_latency"].append(latency)
+                series["read_rows"].append(rows)
+                series["read_io"].append(io.read_bytes)
+                series["read_io_ops"].append(read_ops)
+
+                if self._store is not None:
+                    self._store.append(rows_written, method, latency, rows, io.read_bytes, read_ops)
+
+    def summary(self):
+        """
+        :return: Latency percentiles, rows per second and mean read I/O per query for each of the methods
+        """
+        summary = {}
+        series = self.series
+
+        for method, method_name in READ_METHODS.items():
+            indexes = [i for i, m in enumerate(series["read_method"]) if m == method]
+            if not indexes:
+                continue
+
+            latencies = [series["read_latency"][i] for i in indexes]
+            rows = sum(series["read_rows"][i] for i in indexes)
+            read_ops = [series["read_io_ops"][i] for i in indexes if series["read_io_ops"][i] >= 0]
+            summary[method_name] = {
+                "queries": len(indexes),
+                "latency": latency_summary(latencies),
+                "rows_per_sec": rows / sum(latencies),
+                "io_read_per_query": sum(series["read_io"][i] for i in indexes) / len(indexes),
+                "io_read_ops_per_query": sum(read_ops) / len(read_ops) if read_ops else None,
+            }
+
+            print(f"{method_name}: p50 {summary[method_name]['latency']['p50'] * 1000:.2f} ms ; "
+                  f"{summary[method_name]['rows_per_sec']:.0f} rows/s ; "
+                  f"{summary[method_name]['io_read_per_query']:.0f} B read per query")
+
+        return summary
+
+
+class PointLookupReader:
+    """
+    Lookup phases run between the write batches: single-row SELECTs by primary key, with the keys drawn from
+    the writer's KeyReservoir uniformly, with Zipf-distributed popularity and from the most recently written keys
+    """
+
+    def __init__(self, writer, reservoir, query_count, store=None):
+        """
+        :param reservoir: key_reservoir.KeyReservoir, set as the writer's reservoir so it records the written keys
+        :param query_count: Number of lookups of each distribution in every phase
+        :param store: result_store.ColumnarWriter with LOOKUP_COLUMNS, every lookup is appended to it
+        """
+        self._writer = writer
+        self._reservoir = reservoir
+        self._query_count = query_count
+        self._store = store
+        self._statement = None
+        writer.reservoir = reservoir
+
+        self.buffer_pool = {name: [0, 0] for name in LOOKUP_DISTRIBUTIONS.values()}  # hits, misses
+        self.series = {
+            "lookup_rows_written": [],
+            "lookup_distribution": [],
+            "lookup_latency": [],
+            "lookup_found": [],
+        }
+
+    def _keys(self, distribution):
+        if distribution == LOOKUP_UNIFORM:
+            keys = self._reservoir.uniform(self._query_count)
+        elif distribution == LOOKUP_ZIPFIAN:
+            keys = self._reservoir.zipfian(self._query_count)
+        else:
+            keys = self._reservoir.recent(self._query_count)
+
+        return self._writer.key_gen.to_list(keys)
+
+    def lookup_phase(self, rows_written):
+        """
+        :param rows_written: Rows in the table, recorded with every lookup
+        """
+        if not len(self._reservoir):
+            return
+
+        if self._statement is None:
+            table = self._writer.table
+            self._statement = select(table).where(table.c.id == bindparam("key"))
+
+        connection = self._writer.connection
+
+        for distribution, name in LOOKUP_DISTRIBUTIONS.items():
+            keys = self._keys(distribution)
+            counters_start = self._writer.buffer_pool_counters()
+
+            for key in keys:
+                start = time.perf_counter()
+                with connection.begin():
+                    found = len(connection.execute(self._statement, {"key": key}).fetchall())
+                latency = time.perf_counter() - start
+
+                series = self.series
+                series["lookup_rows_written"].append(rows_written)
+                series["lookup_distribution"].append(distribution)
+                series["lookup_latency"].append(latency)
+                series["lookup_found"].append(found)
+
+                if self._store is not None:
+                    self._store.append(rows_written, distribution, latency, found)
+
+            if counters_start is not None:
+                counters = self._writer.buffer_pool_counters()
+                self.buffer_pool[name][0] += counters[0] - counters_start[0]
+                self.buffer_pool[name][1] += counters[1] - counters_start[1]
+
+    def summary(self):
+        """
+        :return: Latency percentiles, share of keys found and buffer pool hit ratio for each of the distributions
+        """
+        summary = {}
+        series = self.series
+
+        for distribution, name in LOOKUP_DISTRIBUTIONS.items():
+            indexes = [i for i, d in enumerate(series["lookup_distribution"]) if d == distribution]
+            if not indexes:
+                continue
+
+            hits, misses = self.buffer_pool[name]
+            summary[name] = {
+                "queries": len(indexes),
+                "latency": latency_summary([series["lookup_latency"][i] for i in indexes]),
+                "found": sum(series["lookup_found"][i] for i in indexes) / len(indexes),
+                "buffer_pool_hit_ratio": hits / (hits + misses) if hits + misses else None,
+            }
+
+            hit_ratio = summary[name]["buffer_pool_hit_ratio"]
+            print(f"{name} lookups: p50 {summary[name]['latency']['p50'] * 1000:.2f} ms ; "
+                  f"p99 {summary[name]['latency']['p99'] * 1000:.2f} ms ; "
+                  f"buffer pool hit ratio {'n/a' if hit_ratio is None else f'{hit_ratio:.3f}'}")
+
+        return summary
@@ -0,0 +1,253 @@
+"""
+Streaming, crash-safe storage of run results.
+
+Every run is stored in its own directory, results/<name>/:
+
+- <table>.bin: fixed-width records of int64/float64 columns, appended and flushed one sample at a time.
+  The file starts with a magic string, the length of a JSON header describing the columns and the header itself,
+  padded so that the records are 8-byte aligned. A record cut short by a crash is ignored when reading.
+- meta.json: the run name and everything that isn't a series (e.g. summaries of contention runs),
+  written at the end of the run.
+
+Results of older runs saved as results/<name>.json can be loaded the same way and converted with
+`python result_store.py results/*.json`.
+"""
+import glob
+import json
+import os
+import struct
+import sys
+
+import numpy as np
+
+from btree_stats import FILL_BUCKETS
+from timing import PHASES
+
+
+MAGIC = b"PKRS0001"
+
+SAMPLE_COLUMNS = [
+    ("rows_written", "<i8"),
+    ("db_size", "<i8"),  # the table's b-tree for SQLite, the table with all its indexes for MariaDB and PostgreSQL
+    ("io_read", "<i8"),
+    ("io_write", "<i8"),
+    ("io_read_ops", "<i8"),
+    ("io_write_ops", "<i8"),
+    ("time_elapsed", "<f8"),
+]
+
+BATCH_COLUMNS = [
+    ("build_time", "<f8"),
+    ("execute_time", "<f8"),
+]
+
+PIPELINE_COLUMNS = [
+    ("pipeline_queue_depth", "<i8"),
+    ("pipeline_stall_time", "<f8"),
+]
+
+READ_COLUMNS = [
+    ("read_rows_written", "<i8"),
+    ("read_method", "<i8"),
+    ("read_latency", "<f8"),
+    ("read_rows", "<i8"),
+    ("read_io", "<i8"),
+    ("read_io_ops", "<i8"),
+]
+
+LOOKUP_COLUMNS = [
+    ("lookup_rows_written", "<i8"),
+    ("lookup_distribution", "<i8"),
+    ("lookup_latency", "<f8"),
+    ("lookup_found", "<i8"),
+]
+
+OP_COLUMNS = [
+    ("op", "<i8"),
+    ("op_rows", "<i8"),
+    ("op_latency", "<f8"),
+    ("op_io_read", "<i8"),
+    ("op_io_write", "<i8"),
+]
+
+INDEX_COLUMNS = [
+    ("index_rows_written", "<i8"),
+    ("index_id", "<i8"),
+    ("index_size", "<i8"),
+    ("index_io_read", "<i8"),
+]
+
+BTREE_COLUMNS = [
+    ("btree_rows_written", "<i8"),
+    ("btree_id", "<i8"),
+    ("btree_depth", "<i8"),
+    ("btree_leaf_pages", "<i8"),
+    ("btree_internal_pages", "<i8"),
+    ("btree_leaf_fill", "<f8"),
+    ("btree_fragmentation", "<f8"),
+    ("btree_page_splits", "<i8"),
+] + [(f"btree_fill_{i}", "<i8") for i in range(FILL_BUCKETS)]
+
+BTREE_READING_COLUMNS = [
+    ("btree_reading_rows_written", "<i8"),
+    ("btree_reading_io_read", "<i8"),  # I/O of the reading itself, left out of the io_* series
+    ("btree_reading_io_write", "<i8"),
+]
+
+TRACE_COLUMNS = [(f"trace_{phase}", "<f8") for phase in PHASES]
+
+
+class ColumnarWriter:
+
+    def __init__(self, path, columns):
+        """
+        :param columns: List of (name, numpy dtype string) pairs
+        """
+        self.columns = [name for name, _ in columns]
+        self._dtype = np.dtype(columns)
+
+        header = json.dumps({"columns": columns}).encode()
+        header_size = len(MAGIC) + 4 + len(header)
+        header += b" " * (-header_size % 8)
+
+        self._file = open(path, "wb")
+        self._file.write(MAGIC + struct.pack("<I", len(header)) + header)
+        self._file.flush()
+
+    def append(self, *values):
+        self._file.write(np.array([values], dtype=self._dtype).tobytes())
+        self._file.flush()
+
+    def append_all(self, series):
+        """
+        :param series: Dict of column name -> list of values, all of the same length
+        """
+        records = np.empty(len(series[self.columns[0]]), dtype=self._dtype)
+        for name in self.columns:
+            records[name] = series[name]
+        self._file.write(records.tobytes())
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def read_columns(path):
+    """
+    :return: Dict of column name -> read-only memory-mapped numpy array
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a result table")
+        header_len, = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(header_len))
+
+    dtype = np.dtype([tuple(column) for column in header["columns"]])
+    offset = len(MAGIC) + 4 + header_len
+    count = (os.path.getsize(path) - offset) // dtype.itemsize  # ignores a record cut short by a crash
+
+    if count == 0:
+        records = np.empty(0, dtype=dtype)
+    else:
+        records = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count,))
+
+    return {name: records[name] for name in dtype.names}
+
+
+class RunStore:
+
+    def __init__(self, results_dir, name):
+        self.name = name
+        self._dir = os.path.join(results_dir, name)
+        os.makedirs(self._dir, exist_ok=True)
+        self._tables = {}
+
+    def path(self, filename):
+        """
+        :return: Path of a file saved with the run's results, e.g. a profiling artifact
+        """
+        return os.path.join(self._dir, filename)
+
+    def table(self, table_name, columns):
+        """
+        :return: ColumnarWriter streaming into <table_name>.bin
+        """
+        writer = ColumnarWriter(os.path.join(self._dir, f"{table_name}.bin"), columns)
+        self._tables[table_name] = writer
+        return writer
+
+    def write_table(self, table_name, columns, series):
+        writer = self.table(table_name, columns)
+        writer.append_all(series)
+
+    def finish(self, data):
+        """
+        Close the tables and save everything from the run's data that wasn't streamed into them into meta.json
+        """
+        streamed = set()
+        for writer in self._tables.values():
+            writer.close()
+            streamed.update(writer.columns)
+
+        meta = {key: value for key, value in data.items() if key not in streamed}
+        meta["name"] = self.name
+        with open(os.path.join(self._dir, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+
+def load_run(name, results_dir="results"):
+    """
+    Load results of a run saved by RunStore or as a legacy JSON file
+    :return: Dict with the series as numpy arrays and the other values as they were saved
+    """
+    run_dir = os.path.join(results_dir, name)
+
+    if not os.path.isdir(run_dir):
+        with open(os.path.join(results_dir, f"{name}.json")) as f:
+            data = json.load(f)
+        return {key: _as_array(value) for key, value in data.items()}
+
+    data = {"name": name}
+    meta_path = os.path.join(run_dir, "meta.json")
+    if os.path.exists(meta_path):  # missing if the run crashed
+        with open(meta_path) as f:
+            data.update(json.load(f))
+
+    for path in sorted(glob.glob(os.path.join(run_dir, "*.bin"))):
+        data.update(read_columns(path))
+
+    return data
+
+
+def _as_array(value):
+    if isinstance(value, list) and value and all(isinstance(v, (int, float)) for v in value):
+        return np.array(value)
+    return value
+
+
+def convert_json(json_path, results_dir=None):
+    """
+    Convert a legacy results/<name>.json file into a run directory
+    """
+    if results_dir is None:
+        results_dir = os.path.dirname(json_path)
+
+    with open(json_path) as f:
+        data = json.load(f)
+
+    store = RunStore(results_dir, data["name"])
+    for table_name, columns in [("samples", SAMPLE_COLUMNS), ("batches", BATCH_COLUMNS),
+                                ("pipeline", PIPELINE_COLUMNS), ("reads", READ_COLUMNS),
+                                ("lookups", LOOKUP_COLUMNS), ("ops", OP_COLUMNS),
+                                ("indexes", INDEX_COLUMNS), ("btree", BTREE_COLUMNS),
+                                ("btree_readings", BTREE_READING_COLUMNS), ("trace", TRACE_COLUMNS)]:
+        columns = [(name, dtype) for name, dtype in columns if name in data]
+        if columns:
+            store.write_table(table_name, columns, data)
+    store.finish(data)
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        print(f"Converting {path}")
+        convert_json(path)
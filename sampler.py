@@ -0,0 +1,183 @@
+import threading
+import time
+
+
+def sizeof_fmt(num, suffix="B"):
+    for unit in ["", "Ki", "Mi", "Gi", "Ti", "Pi", "Ei", "Zi"]:
+        if abs(num) < 1024.0:
+            return f"{num:3.1f}{unit}{suffix}"
+        num /= 1024.0
+    return f"{num:.1f}Yi{suffix}"
+
+
+class RowCounter:
+    """
+    Count of written rows, published by the write loop(s) and read by the sampler
+    """
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def add(self, n):
+        with self._lock:  # += isn't atomic when several writer threads publish to the same counter
+            self.value += n
+
+
+class MetricsSampler:
+    """
+    Records rows written, table size and I/O counters, either on demand by calling sample()
+    or on a fixed wall-clock interval from a background thread.
+    All timestamps come from time.monotonic().
+    """
+
+    def __init__(self, name, writer, io_probe, row_counter, interval=None, store=None, index_every=None,
+                 index_store=None):
+        """
+        :param interval: Seconds between samples taken by the background thread, None to only sample on demand
+        :param store: result_store.ColumnarWriter with SAMPLE_COLUMNS, every sample is appended to it as it's taken
+        :param index_every: Also read the size and I/O of the table and each of its indexes every n samples,
+        see Writer.index_stats, None to never read them
+        :param index_store: result_store.ColumnarWriter with INDEX_COLUMNS, every index reading is appended to it
+        """
+        self._name = name
+        self._writer = writer
+        self._io_probe = io_probe
+        self._row_counter = row_counter
+        self._interval = interval
+        self._store = store
+        self._index_every = index_every
+        self._index_store = index_store
+        self._samples = 0
+        self._indexes_read = False  # whether the last sample read the indexes
+
+        self._start_time = None
+        self._starting_io = None
+        self._lock = threading.Lock()  # held while sampling and while the probe is paused, see exclude_io
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.series = {
+            "rows_written": [],
+            "db_size": [],
+            "io_read": [],
+            "io_write": [],
+            "io_read_ops": [],  # block I/Os, -1 where the probe can't count them
+            "io_write_ops": [],
+            "time_elapsed": [],
+        }
+        self.index_names = []  # names of the b-trees, positions in this list are the index_id of the index series
+        self.index_series = {
+            "index_rows_written": [],
+            "index_id": [],
+            "index_size": [],
+            "index_io_read": [],  # -1 where the engine doesn't count the reads per index
+        }
+
+    def start(self):
+        self._start_time = time.monotonic()
+        self._starting_io = self._io_probe.read()
+
+        if self._interval is not None:
+            self._thread = threading.Thread(target=self._run, name=f"sampler-{self._name}", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        next_sample = self._start_time + self._interval
+        while not self._stop.wait(max(0.0, next_sample - time.monotonic())):
+            self.sample()
+            next_sample += self._interval
+
+    def stop(self, final_sample=True):
+        """
+        Stop the background thread and take a final sample, so the series always ends with the last written row
+        :param final_sample: False to only stop the thread, e.g. when the run failed
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            if final_sample:
+                self.sample()
+
+        if final_sample and self._index_every is not None and not self._indexes_read:
+            self._sample_indexes(self._row_counter.value)
+
+    def exclude_io(self, fn):
+        """
+        Call fn with the I/O probe paused: the I/O done meanwhile is left out of the io_* series,
+        samples of the background thread wait for fn to return
+        :return: Return value of fn, IOStats of the I/O done meanwhile
+        """
+        with self._lock:
+            io_start = self._io_probe.read()
+            result = fn()
+            io = self._io_probe.read() - io_start
+            self._starting_io = self._starting_io + io
+        return result, io
+
+    def sample(self):
+        with self._lock:
+            self._sample()
+
+    def _sample(self):
+        rows_written = self._row_counter.value
+        db_size = self._writer.db_size()
+        io = self._io_probe.read() - self._starting_io
+        read_ops = -1 if io.read_ops is None else io.read_ops
+        write_ops = -1 if io.write_ops is None else io.write_ops
+        time_elapsed = time.monotonic() - self._start_time
+
+        series = self.series
+        series["rows_written"].append(rows_written)
+        series["db_size"].append(db_size)
+        series["io_read"].append(io.read_bytes)
+        series["io_write"].append(io.write_bytes)
+        series["io_read_ops"].append(read_ops)
+        series["io_write_ops"].append(write_ops)
+        series["time_elapsed"].append(time_elapsed)
+
+        if self._store is not None:
+            self._store.append(rows_written, db_size, io.read_bytes, io.write_bytes, read_ops, write_ops,
+                               time_elapsed)
+
+        self._indexes_read = self._index_every is not None and self._samples % self._index_every == 0
+        self._samples += 1
+        if self._indexes_read:
+            self._sample_indexes(rows_written)
+
+        print(f"{self._name}, written {rows_written} total records")
+        print(f"DB size: {sizeof_fmt(db_size)}")
+        print(f"IO reads: {sizeof_fmt(io.read_bytes)} ; writes: {sizeof_fmt(io.write_bytes)}")
+
+    def _sample_indexes(self, rows_written):
+        series = self.index_series
+        for name, size, io_read in self._writer.index_stats():
+            if name not in self.index_names:
+                self.index_names.append(name)
+            index_id = self.index_names.index(name)
+            io_read = -1 if io_read is None else io_read
+
+            series["index_rows_written"].append(rows_written)
+            series["index_id"].append(index_id)
+            series["index_size"].append(size)
+            series["index_io_read"].append(io_read)
+
+            if self._index_store is not None:
+                self._index_store.append(rows_written, index_id, size, io_read)
+
+    def index_summary(self):
+        """
+        :return: Last size and bytes read of the table and each of its indexes, by name
+        """
+        summary = {}
+        series = self.index_series
+        for i, index_id in enumerate(series["index_id"]):
+            summary[self.index_names[index_id]] = {
+                "size": series["index_size"][i],
+                "io_read": series["index_io_read"][i],
+            }
+
+        for name, index in summary.items():
+            print(f"{name}: {sizeof_fmt(index['size'])}")
+
+        return summary
@@ -0,0 +1,68 @@
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+# run configs of the current scheduling, inherited by the forked workers,
+# so the functions building the writers never have to be pickled
+_run_configs = None
+
+
+def resource_group(run_config):
+    """
+    Runs sharing an I/O probe target have to run one after another, otherwise their I/O would get mixed up.
+    Runs probed with "self" (SQLite in the benchmark process) measure only their own worker process,
+    so each of them is a group of its own.
+    """
+    config_name, writer, io_target = run_config
+    if io_target == "self":
+        return f"self:{config_name}"
+    if isinstance(io_target, str):
+        return io_target
+    return f"probe:{id(io_target)}"
+
+
+def group_run_configs(run_configs):
+    """
+    :return: Lists of indexes into run_configs, one per resource group, in the original order
+    """
+    groups = OrderedDict()
+    for i, run_config in enumerate(run_configs):
+        groups.setdefault(resource_group(run_config), []).append(i)
+    return list(groups.values())
+
+
+def _run_group(run_fn, indexes):
+    for i in indexes:
+        run_fn(_run_configs[i])
+    return [_run_configs[i][0] for i in indexes]
+
+
+def run_parallel(run_configs, run_fn, workers):
+    """
+    Run independent configs at the same time in a pool of worker processes, runs within a resource group are serialized
+    :param run_fn: Function running a single config and saving its results, called in the worker process
+    :param workers: Number of worker processes
+    """
+    global _run_configs
+    _run_configs = run_configs
+
+    groups = group_run_configs(run_configs)
+    print(f"Scheduling {len(run_configs)} runs in {len(groups)} resource groups on {workers} workers")
+
+    context = multiprocessing.get_context("fork")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = {executor.submit(_run_group, run_fn, indexes): indexes for indexes in groups}
+
+        failed = []
+        for future in as_completed(futures):
+            try:
+                print(f"Finished {', '.join(future.result())}")
+            except Exception as e:
+                names = [run_configs[i][0] for i in futures[future]]
+                print(f"Group {', '.join(names)} failed!")
+                print(e)
+                failed.extend(names)
+
+    _run_configs = None
+    return failed
@@ -0,0 +1,482 @@
+"""
+Offline model of inserting the keys of a KeyGenerator into a B+tree behind a buffer pool, to compare key schemes
+in seconds instead of running the engines for hours.
+
+The tree only keeps the key range, row count and smallest/largest key of every leaf, splits assume the keys
+already in a leaf are spread uniformly between its smallest and largest key. Internal pages are assumed to stay
+in the buffer pool, they only count towards the size. The results are saved in the series of main.run
+(time_elapsed is the time of the simulation), so they can be plotted next to measured runs:
+
+    python simulator.py uuid4 --engine sqlite --rows 1000000
+    python simulator.py uuid4 --engine mariadb --rows 100000000 --batch-size 100000
+
+The work per batch grows with the number of leaves, long simulations should use larger batches.
+"""
+import argparse
+import bisect
+import time
+
+import numpy as np
+
+from key_gen import KEY_GENERATORS
+from result_store import RunStore, SAMPLE_COLUMNS
+from writer import logical_row_size
+
+POLICY_LRU = "lru"
+POLICY_CLOCK = "clock"
+
+POLICIES = (POLICY_LRU, POLICY_CLOCK)
+
+# how the engines write pages back and split leaves, used as defaults of Simulator
+ENGINE_PRESETS = {
+    # pages are appended to the WAL when committed and copied into the database by the automatic checkpoints,
+    # only an append to the last leaf of the tree fills the page completely (balance_quick)
+    "sqlite": dict(wal=True, checkpoint_pages=1000, rightmost_only=True),
+    # dirty pages are written back when evicted, an insert after the last key of a leaf leaves 1/16 of it free
+    "mariadb": dict(append_fill=15 / 16),
+    # only the primary key index of the heap table, an index tuple has an 8-byte header and a 4-byte line pointer,
+    # the rightmost leaf is split at the fillfactor of 90%
+    "postgres": dict(page_size=8192, index_only=True, row_overhead=12, append_fill=0.9, rightmost_only=True),
+}
+
+SIM_COLUMNS = [
+    ("sim_leaf_pages", "<i8"),
+    ("sim_depth", "<i8"),
+    ("sim_page_splits", "<i8"),
+    ("sim_page_reads", "<i8"),
+    ("sim_page_writes", "<i8"),
+    ("sim_log_writes", "<i8"),
+]
+
+_SIGN_BIT = np.uint64(1 << 63)
+
+
+def sortable_keys(batch):
+    """
+    :param batch: Batch returned by KeyGenerator.get_batch()
+    :return: Keys as fixed-size byte strings, which numpy compares like the engines compare the keys
+    """
+    if batch.ndim == 2:
+        return np.ascontiguousarray(batch).view(f"S{batch.shape[1]}").ravel()
+    return (batch.astype(np.int64).view(np.uint64) ^ _SIGN_BIT).astype(">u8").view("S8")
+
+
+class BTreeModel:
+    """
+    Leaves of a B+tree in key order, every leaf is a page, new pages are allocated at the end of the file
+    """
+
+    def __init__(self, page_size, row_size, key_size, append_fill=1.0, rightmost_only=False):
+        """
+        :param row_size: Bytes taken by a row in a leaf
+        :param key_size: Bytes of a key, see sortable_keys
+        :param append_fill: Share of the rows a leaf keeps when split by keys inserted after its largest key,
+        the other leaves are split in half
+        :param rightmost_only: Only splits of the last leaf use append_fill
+        """
+        self.capacity = max(2, page_size // row_size)
+        self.fanout = max(2, page_size // (key_size + 8))  # key and child page number
+        self._append_rows = max(1, int(self.capacity * append_fill))
+        self._rightmost_only = rightmost_only
+        self._key_size = key_size
+        self._dtype = np.dtype(f"S{key_size}")
+
+        self._lows = np.zeros(1, dtype=self._dtype)  # lowest key of every leaf's key range
+        self._counts = np.zeros(1, dtype=np.int64)
+        self._mins = np.full(1, b"\xff" * key_size, dtype=self._dtype)  # smallest key in the leaf
+        self._maxs = np.zeros(1, dtype=self._dtype)  # largest key in the leaf
+        self._pages = np.zeros(1, dtype=np.int64)
+        self.page_count = 1
+        self.splits = 0
+
+    @property
+    def leaf_count(self):
+        return len(self._lows)
+
+    def internal_pages(self):
+        """
+        :return: Number of internal pages and depth of the tree
+        """
+        pages, depth, level = 0, 1, self.leaf_count
+        while level > 1:
+            level = -(-level // self.fanout)
+            pages += level
+            depth += 1
+        return pages, depth
+
+    def _to_int(self, key):
+        return int.from_bytes(bytes(key).ljust(self._key_size, b"\0"), "big")  # numpy strips the trailing zero bytes
+
+    def _to_key(self, value):
+        return value.to_bytes(self._key_size, "big")
+
+    def _append_split(self, new_keys, old_count):
+        keep = max(0, self._append_rows - old_count)
+        starts = np.arange(keep, len(new_keys), self._append_rows)
+        # equal keys stay in the same leaf
+        starts = np.unique(np.searchsorted(new_keys, new_keys[starts]))
+        if keep:
+            starts = starts[starts > 0]
+        ends = np.append(starts[1:], len(new_keys))
+        kept = old_count + (starts[0] if len(starts) else len(new_keys))
+        return kept, new_keys[starts], ends - starts, new_keys[ends - 1]
+
+    def _half_split(self, new_keys, old_count, old_min, old_max):
+        old_count = int(old_count)
+        count = old_count + len(new_keys)
+        pieces = 1 << int(np.ceil(np.log2(count / self.capacity)))
+
+        points = new_keys
+        if old_count:
+            low, high = self._to_int(old_min), self._to_int(old_max)
+            old_keys = np.array([self._to_key(low + (high - low) * k // max(1, old_count - 1))
+                                 for k in range(old_count)], dtype=self._dtype)
+            points = np.sort(np.concatenate([old_keys, new_keys]))
+
+        starts = np.unique(np.searchsorted(points, points[np.arange(1, pieces) * count // pieces]))
+        starts = starts[starts > 0]
+        ends = np.append(starts, count)
+        return starts[0] if len(starts) else count, points[starts], np.diff(ends), points[ends[1:] - 1], points
+
+    def _split_uniform(self, new_keys, old_count, old_min, old_max):
+        """
+        Same as _half_split computed only at the split points, without building the keys of the leaf
+        :param new_keys: Sorted Python ints, see _to_int
+        :return: None if a split point falls between equal keys
+        """
+        count = old_count + len(new_keys)
+        pieces = 1 << int(np.ceil(np.log2(count / self.capacity)))
+        span, steps = old_max - old_min, max(1, old_count - 1)  # old keys are old_min + span * k // steps
+
+        merged = []  # positions of the new keys among all the keys
+        for i, key in enumerate(new_keys):
+            if span:
+                position = min(max(0, -(-(key - old_min) * steps // span)), old_count)  # old keys lower than key
+            else:
+                position = old_count if key > old_min else 0
+            merged.append(position + i)
+
+        def point(k):
+            i = bisect.bisect_left(merged, k)
+            if i < len(merged) and merged[i] == k:
+                return new_keys[i]
+            return old_min + span * (k - i) // steps
+
+        starts = [piece * count // pieces for piece in range(1, pieces)]
+        if any(point(start) <= point(start - 1) for start in starts):
+            return None  # equal keys
+        ends = starts[1:] + [count]
+        return (starts[0], [self._to_key(point(start)) for start in starts],
+                [end - start for start, end in zip(starts, ends)], [self._to_key(point(end - 1)) for end in ends],
+                self._to_key(point(starts[0] - 1)))
+
+    def insert(self, keys):
+        """
+        :param keys: Keys returned by sortable_keys
+        :return: Pages of the existing leaves the keys were inserted into, new pages
+        """
+        keys = np.sort(keys)
+        leaves = np.searchsorted(self._lows, keys, side="right") - 1
+        leaves, starts, added = np.unique(leaves, return_index=True, return_counts=True)
+        touched = self._pages[leaves]
+
+        old_mins, old_maxs = self._mins[leaves], self._maxs[leaves]
+        appends = keys[starts] > old_maxs
+        if self._rightmost_only:
+            appends &= leaves == self.leaf_count - 1
+
+        self._counts[leaves] += added
+        self._mins[leaves] = np.where(keys[starts] < old_mins, keys[starts], old_mins)
+        last_keys = keys[starts + added - 1]
+        self._maxs[leaves] = np.where(last_keys > old_maxs, last_keys, old_maxs)
+
+        positions, lows, counts, maxs = [], [], [], []
+        for i in np.flatnonzero(self._counts[leaves] > self.capacity):
+            leaf = leaves[i]
+            new_keys = keys[starts[i]:starts[i] + added[i]]
+            old_count = self._counts[leaf] - added[i]
+
+            split = None
+            if not appends[i] and old_count:
+                split = self._split_uniform([self._to_int(key) for key in new_keys], int(old_count),
+                                            self._to_int(old_mins[i]), self._to_int(old_maxs[i]))
+
+            if appends[i]:
+                kept, piece_lows, piece_counts, piece_maxs = self._append_split(new_keys, old_count)
+                self._maxs[leaf] = new_keys[kept - old_count - 1] if kept > old_count else old_maxs[i]
+            elif split is not None:
+                kept, piece_lows, piece_counts, piece_maxs, self._maxs[leaf] = split
+            else:
+                kept, piece_lows, piece_counts, piece_maxs, points = self._half_split(
+                    new_keys, old_count, old_mins[i], old_maxs[i])
+                self._maxs[leaf] = points[kept - 1]
+
+            self._counts[leaf] = kept
+            positions += [leaf + 1] * len(piece_lows)
+            lows.extend(piece_lows)
+            counts.extend(piece_counts)
+            maxs.extend(piece_maxs)
+
+        new_pages = np.empty(0, dtype=np.int64)
+        if positions:
+            new_pages = np.arange(self.page_count, self.page_count + len(positions))
+            self.page_count += len(positions)
+            self.splits += len(positions)
+
+            lows = np.array(lows, dtype=self._dtype)
+            self._lows = np.insert(self._lows, positions, lows)
+            self._counts = np.insert(self._counts, positions, counts)
+            self._mins = np.insert(self._mins, positions, lows)  # the lowest key of a new leaf is in it
+            self._maxs = np.insert(self._maxs, positions, np.array(maxs, dtype=self._dtype))
+            self._pages = np.insert(self._pages, positions, new_pages)
+
+        return touched, new_pages
+
+
+class BufferPool:
+    """
+    Pages cached in a fixed number of frames, evicted in LRU or clock order, dirty pages are written back when
+    evicted or flushed. All the pages touched by a batch are accessed at once, in key order.
+    """
+
+    def __init__(self, frames, policy=POLICY_LRU):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown policy {policy}, expected one of {POLICIES}")
+
+        self._capacity = frames
+        self._policy = policy
+        self._dirty = np.zeros(1024, dtype=bool)
+        self._frame_of = np.full(1024, -1, dtype=np.int64)  # frame of every page, -1 if not cached
+
+        self._frames = np.full(frames, -1, dtype=np.int64)  # page in every frame
+        self._used = 0  # frames filled so far, the first ones
+        self._last_used = np.zeros(frames, dtype=np.int64)  # LRU
+        self._referenced = np.zeros(frames, dtype=bool)  # clock
+        self._hand = 0
+        self._tick = 0
+
+    def _grow(self, page_count):
+        if page_count > len(self._dirty):
+            size = max(page_count, 2 * len(self._dirty))
+            self._dirty = np.concatenate([self._dirty, np.zeros(size - len(self._dirty), dtype=bool)])
+            self._frame_of = np.concatenate([self._frame_of, np.full(size - len(self._frame_of), -1, np.int64)])
+
+    def _victim_frames(self, n):
+        """
+        :return: Frames to reuse, in the order they're chosen
+        """
+        if self._policy == POLICY_LRU:
+            return np.argpartition(self._last_used, n - 1)[:n] if n < self._capacity else np.arange(self._capacity)
+
+        order = (self._hand + np.arange(self._capacity)) % self._capacity
+        referenced = self._referenced[order]
+        # the first sweep clears the reference bits up to the last victim, the second one takes them in order
+        candidates = np.concatenate([np.flatnonzero(~referenced), np.flatnonzero(referenced) + self._capacity])[:n]
+        last = candidates[-1]
+        self._referenced[order[:min(last + 1, self._capacity)]] = False
+        self._hand = (self._hand + last + 1) % self._capacity
+        return order[candidates % self._capacity]
+
+    def access(self, pages, new_pages, dirty=True):
+        """
+        :param pages: Existing pages, read if not cached
+        :param new_pages: Pages created by the batch, never read
+        :param dirty: Whether the pages are modified
+        :return: Pages read, dirty pages written back
+        """
+        pages = np.concatenate([pages, new_pages])
+        self._grow(int(pages.max()) + 1 if len(pages) else 0)
+
+        frames = self._frame_of[pages]
+        cached = frames >= 0
+        reads = int(np.count_nonzero(~cached[:len(pages) - len(new_pages)]))
+        self._dirty[pages] |= dirty
+
+        self._last_used[frames[cached]] = self._tick + np.flatnonzero(cached)
+        self._referenced[frames[cached]] = True
+
+        # pages not cached, beyond the pool's capacity only the last ones are kept
+        missing = pages[~cached]
+        writes = 0
+        if len(missing) > self._capacity:
+            passed = missing[:len(missing) - self._capacity]
+            writes += int(np.count_nonzero(self._dirty[passed]))
+            self._dirty[passed] = False
+            missing = missing[len(passed):]
+
+        free = min(len(missing), self._capacity - self._used)
+        frames = np.arange(self._used, self._used + free)
+        self._used += free
+        if len(missing) > free:
+            victims = self._victim_frames(len(missing) - free)
+            evicted = self._frames[victims]
+            writes += int(np.count_nonzero(self._dirty[evicted]))
+            self._dirty[evicted] = False
+            self._frame_of[evicted] = -1
+            frames = np.concatenate([frames, victims])
+
+        self._frames[frames] = missing
+        self._frame_of[missing] = frames
+        self._last_used[frames] = self._tick + len(pages) - len(missing) + np.arange(len(missing))
+        self._referenced[frames] = True
+        self._tick += len(pages)
+
+        return reads, writes
+
+    def flush(self):
+        """
+        :return: Dirty pages written back
+        """
+        cached = self._frames[:self._used]
+        writes = int(np.count_nonzero(self._dirty[cached]))
+        self._dirty[cached] = False
+        return writes
+
+
+class Simulator:
+    """
+    Inserts the keys of a KeyGenerator batch by batch and records the series of main.run
+    """
+
+    def __init__(self, key_gen, page_size=16384, row_size=None, buffer_pool_size=10485760, policy=POLICY_LRU,
+                 wal=False, checkpoint_pages=None, append_fill=1.0, rightmost_only=False, index_only=False,
+                 row_overhead=0, store=None, sim_store=None):
+        """
+        :param row_size: Bytes of a row, defaults to the key, time_created and the 512-byte payload
+        :param buffer_pool_size: Bytes, the SQLite page cache, InnoDB buffer pool or PostgreSQL shared buffers
+        :param wal: Write every page modified by a batch to a write-ahead log when the batch is committed,
+        the pages are written back by the checkpoints only, like SQLite. Otherwise dirty pages stay cached
+        until they're evicted or checkpointed.
+        :param checkpoint_pages: Checkpoint after this many pages were modified, which writes back every page
+        in the WAL or every dirty page, None to never checkpoint
+        :param append_fill, rightmost_only: see BTreeModel
+        :param index_only: The rows are only the keys, e.g. a secondary index or the primary key index
+        of a PostgreSQL heap table
+        :param row_overhead: Bytes added to every row, e.g. a tuple header
+        :param store: result_store.ColumnarWriter with SAMPLE_COLUMNS
+        :param sim_store: result_store.ColumnarWriter with SIM_COLUMNS
+        """
+        key_size = key_gen.key_size
+        if row_size is None:
+            row_size = key_size if index_only else logical_row_size(key_gen)
+        row_size += row_overhead
+
+        self._key_gen = key_gen
+        self._page_size = page_size
+        self._wal = wal
+        self._checkpoint_pages = checkpoint_pages
+        self._store = store
+        self._sim_store = sim_store
+        self.tree = BTreeModel(page_size, row_size, key_size, append_fill, rightmost_only)
+        self.pool = BufferPool(max(1, buffer_pool_size // page_size), policy)
+
+        self._rows = 0
+        self._reads = 0
+        self._writes = 0
+        self._log_writes = 0
+        self._modified_since_checkpoint = 0
+        self._logged = []  # pages in the WAL since the last checkpoint
+        self._start_time = time.monotonic()
+
+        self.series = {name: [] for name, _ in SAMPLE_COLUMNS + SIM_COLUMNS}
+
+    def _checkpoint(self):
+        if self._wal:
+            self._writes += len(np.unique(np.concatenate(self._logged))) if self._logged else 0
+            self._logged = []
+        else:
+            self._writes += self.pool.flush()
+        self._modified_since_checkpoint = 0
+
+    def insert_batch(self, batch_size):
+        touched, new_pages = self.tree.insert(sortable_keys(self._key_gen.get_batch(batch_size)))
+        modified = np.concatenate([touched, new_pages])
+
+        reads, writes = self.pool.access(touched, new_pages, dirty=not self._wal)
+        self._rows += batch_size
+        self._reads += reads
+        self._writes += writes
+
+        if self._wal:
+            self._log_writes += len(modified)
+            self._logged.append(modified)
+
+        self._modified_since_checkpoint += len(modified)
+        if self._checkpoint_pages is not None and self._modified_since_checkpoint >= self._checkpoint_pages:
+            self._checkpoint()
+
+        self._sample()
+
+    def _sample(self):
+        internal_pages, depth = self.tree.internal_pages()
+        page_writes = self._writes + self._log_writes
+        values = (
+            self._rows,
+            (self.tree.leaf_count + internal_pages) * self._page_size,
+            self._reads * self._page_size,
+            page_writes * self._page_size,
+            self._reads,
+            page_writes,
+            time.monotonic() - self._start_time,
+            self.tree.leaf_count,
+            depth,
+            self.tree.splits,
+            self._reads,
+            self._writes,
+            self._log_writes,
+        )
+
+        for name, value in zip(self.series, values):
+            self.series[name].append(value)
+
+        if self._store is not None:
+            self._store.append(*values[:len(SAMPLE_COLUMNS)])
+        if self._sim_store is not None:
+            self._sim_store.append(*values[len(SAMPLE_COLUMNS):])
+
+    def run(self, batch_size, batch_count):
+        for batch_i in range(batch_count):
+            self.insert_batch(batch_size)
+
+        print(f"Simulated {self._rows} rows in {time.monotonic() - self._start_time:.1f} s ; "
+              f"{self.tree.leaf_count} leaves ; {self.tree.splits} splits ; "
+              f"{self._reads} page reads ; {self._writes + self._log_writes} page writes")
+
+
+def simulate_and_save(name, key_gen, batch_size, batch_count, results_dir="results", **kwargs):
+    """
+    :param kwargs: Simulator parameters, saved with the results
+    """
+    run_store = RunStore(results_dir, name)
+    simulator = Simulator(key_gen, store=run_store.table("samples", SAMPLE_COLUMNS),
+                          sim_store=run_store.table("simulation", SIM_COLUMNS), **kwargs)
+    simulator.run(batch_size, batch_count)
+    run_store.finish({**simulator.series, "row_size": logical_row_size(key_gen), "simulation": {
+        "key_gen": type(key_gen).__name__, "batch_size": batch_size, "batch_count": batch_count, **kwargs}})
+
+
+def main_cli(args=None):
+    parser = argparse.ArgumentParser(description="Simulate the inserts of a key generator into a B+tree")
+    parser.add_argument("key_gen", choices=list(KEY_GENERATORS))
+    parser.add_argument("--engine", choices=list(ENGINE_PRESETS), help="Split and write-back behavior of the engine")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--page-size", type=int, help="Defaults to 16384, 8192 for postgres")
+    parser.add_argument("--row-size", type=int, help="Defaults to the key, time_created and the 512-byte payload")
+    parser.add_argument("--buffer-pool-size", type=int)
+    parser.add_argument("--policy", choices=POLICIES)
+    parser.add_argument("--name", help="Defaults to sim_<engine>_<key_gen>")
+    parser.add_argument("--results-dir", default="results")
+    args = parser.parse_args(args)
+
+    kwargs = dict(ENGINE_PRESETS.get(args.engine, {}))
+    for param in ("page_size", "row_size", "buffer_pool_size", "policy"):
+        if getattr(args, param) is not None:
+            kwargs[param] = getattr(args, param)
+    name = args.name or f"sim_{args.engine or 'btree'}_{args.key_gen}"
+    simulate_and_save(name, KEY_GENERATORS[args.key_gen](), args.batch_size, args.rows // args.batch_size,
+                      args.results_dir, **kwargs)
+
+
+if __name__ == "__main__":
+    main_cli()
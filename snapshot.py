@@ -0,0 +1,57 @@
+import json
+import os
+import pickle
+
+
+def fast_forward(writer, config_name, rows, batch_size, snapshot_dir="snapshots", reservoir=None):
+    """
+    Bring the writer's table to the given number of rows, instead of starting from an empty table.
+
+    The first time, the table is filled from scratch and saved as a snapshot together with the state
+    of the key generator. Later runs restore the snapshot and resume the key generator right after the last key
+    written into it, so only the following increment has to be measured.
+
+    :param reservoir: key_reservoir.KeyReservoir filled with the keys of the snapshot's rows. They are saved with
+    the snapshot only if it is built with a reservoir, a snapshot built without one leaves it empty.
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    name = f"{config_name}_{rows}"
+    meta_path = os.path.join(snapshot_dir, f"{name}.json")
+    key_gen_path = os.path.join(snapshot_dir, f"{name}.keygen.pickle")
+    reservoir_path = os.path.join(snapshot_dir, f"{name}.reservoir.pickle")
+
+    if os.path.exists(meta_path):
+        print(f"Restoring snapshot {name}")
+        writer.restore_snapshot(snapshot_dir, name)
+        with open(key_gen_path, "rb") as f:
+            writer.key_gen.set_state(pickle.load(f))
+        if reservoir is not None:
+            if os.path.exists(reservoir_path):
+                with open(reservoir_path, "rb") as f:
+                    reservoir.set_state(pickle.load(f))
+            else:
+                print(f"Snapshot {name} was saved without its keys, only the rows written after it are looked up")
+        return
+
+    print(f"Building snapshot {name}")
+    writer.init_db()
+
+    previous_reservoir, writer.reservoir = writer.reservoir, reservoir
+    try:
+        written = 0
+        while written < rows:
+            count = min(batch_size, rows - written)
+            writer.write_batch(count)
+            written += count
+    finally:
+        writer.reservoir = previous_reservoir
+
+    writer.save_snapshot(snapshot_dir, name)
+    with open(key_gen_path, "wb") as f:
+        pickle.dump(writer.key_gen.get_state(), f)
+    if reservoir is not None:
+        with open(reservoir_path, "wb") as f:
+            pickle.dump(reservoir.get_state(), f)
+
+    with open(meta_path, "w") as f:  # written last, marks the snapshot as complete
+        json.dump({"rows": rows, "key_gen": type(writer.key_gen).__name__, **writer.snapshot_metadata(name)}, f)
@@ -0,0 +1,193 @@
+"""
+Parameter sweeps: every combination of the values listed in a JSON config is run once,
+the writers are only built when their run starts.
+
+    python sweep.py sweep_example.json --dry-run
+    python sweep.py sweep_example.json --filter "sqlite_*uuid7*" --parallel 4
+
+A config is an object, or a list of objects whose runs are concatenated, with any of the keys of DEFAULTS,
+each given as a single value or a list of values. `indexes` is a set of secondary indexes,
+e.g. ["time_created", "time_created,id"], or a list of such sets. Parameters not applying to an engine
+(see ENGINE_PARAMETERS) are left out of its runs, so e.g. Postgres is run once for all the page sizes.
+Runs whose results already exist in the results directory are skipped, unless --force is given.
+"""
+import argparse
+import fnmatch
+import functools
+import itertools
+import json
+import os
+
+import main
+from key_gen import KEY_GENERATORS
+from scheduler import run_parallel
+from writer import SQLiteWriter, MariaDBWriter, PostgresWriter
+
+
+DEFAULTS = {
+    "engine": "sqlite",
+    "key_gen": "uuid7",
+    "batch_size": main.BATCH_SIZE,
+    "batch_count": main.BATCH_COUNT,
+    "page_size": 16384,  # bytes
+    "cache_size": 10485760,  # bytes, SQLite page cache or InnoDB buffer pool
+    "clustered": True,
+    "indexes": [],  # secondary indexes, each a comma-separated list of columns, see db.get_table_def
+}
+
+# parameters of the writer each engine is swept over, the page size of InnoDB and Postgres is fixed when the
+# server is initialized and shared_buffers needs a restart of Postgres
+ENGINE_PARAMETERS = {
+    "sqlite": ("page_size", "cache_size", "clustered"),
+    "mariadb": ("cache_size",),
+    "postgres": (),
+}
+
+IO_TARGETS = {
+    "sqlite": "self",
+    "mariadb": "primary_key_perf_mariadb_1",
+    "postgres": "primary_key_perf_postgres_1",
+}
+
+
+def _size_name(size):
+    for unit, suffix in ((1 << 20, "m"), (1 << 10, "k")):
+        if size % unit == 0:
+            return f"{size // unit}{suffix}"
+    return str(size)
+
+
+class RunSpec:
+    """
+    Parameters of a single run of a sweep
+    """
+
+    def __init__(self, engine, key_gen, batch_size, batch_count, page_size=None, cache_size=None, clustered=None,
+                 indexes=()):
+        if engine not in ENGINE_PARAMETERS:
+            raise ValueError(f"Unknown engine {engine}, expected one of {tuple(ENGINE_PARAMETERS)}")
+        if key_gen not in KEY_GENERATORS:
+            raise ValueError(f"Unknown key generator {key_gen}, expected one of {tuple(KEY_GENERATORS)}")
+
+        self.engine = engine
+        self.key_gen = key_gen
+        self.batch_size = batch_size
+        self.batch_count = batch_count
+        self.indexes = [tuple(index.split(",")) for index in indexes]
+        # None for the parameters not applying to the engine
+        parameters = ENGINE_PARAMETERS[engine]
+        self.page_size = page_size if "page_size" in parameters else None
+        self.cache_size = cache_size if "cache_size" in parameters else None
+        self.clustered = clustered if "clustered" in parameters else None
+
+    @property
+    def name(self):
+        parts = [self.engine]
+        if self.clustered is not None:
+            parts.append("clustered" if self.clustered else "nonclustered")
+        parts += [self.key_gen, f"b{self.batch_size}x{self.batch_count}"]
+        if self.page_size is not None:
+            parts.append(f"p{_size_name(self.page_size)}")
+        if self.cache_size is not None:
+            parts.append(f"c{_size_name(self.cache_size)}")
+        if self.indexes:
+            parts.append("ix-" + "+".join("-".join(columns) for columns in self.indexes))
+        return "_".join(parts)
+
+    def build_writer(self):
+        key_gen = KEY_GENERATORS[self.key_gen]()
+        if self.engine == "sqlite":
+            return SQLiteWriter(key_gen, f"{main.SQLITE_DIR}/{self.name}.sqlite", clustered_index=self.clustered,
+                                page_size=self.page_size, cache_size=self.cache_size, indexes=self.indexes)
+        if self.engine == "mariadb":
+            return MariaDBWriter(key_gen, main.MARIADB_CONN, buffer_pool_size=self.cache_size, indexes=self.indexes)
+        return PostgresWriter(key_gen, main.POSTGRES_CONN, indexes=self.indexes)
+
+    def run_config(self):
+        """
+        :return: Run config with the spec in place of the writer, see run_spec
+        """
+        return self.name, self, IO_TARGETS[self.engine]
+
+
+def expand(config):
+    """
+    :param config: Dict of parameter -> value or list of values, or a list of such dicts
+    :return: RunSpecs of the cartesian product of the values, without duplicates, in the order of the config
+    """
+    if isinstance(config, list):
+        specs = [spec for block in config for spec in expand(block)]
+    else:
+        unknown = set(config) - set(DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown sweep parameters {unknown}, expected some of {tuple(DEFAULTS)}")
+
+        values = {key: config.get(key, default) for key, default in DEFAULTS.items()}
+        if not any(isinstance(index_set, list) for index_set in values["indexes"]):
+            values["indexes"] = [values["indexes"]]  # a single set of indexes
+        values = {key: value if isinstance(value, list) else [value] for key, value in values.items()}
+        specs = [RunSpec(**dict(zip(values, combination))) for combination in itertools.product(*values.values())]
+
+    unique = {}
+    for spec in specs:
+        unique.setdefault(spec.name, spec)
+    return list(unique.values())
+
+
+def load_config(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def result_exists(results_dir, name):
+    """
+    Only finished runs count, the meta.json of a run is saved last
+    """
+    return (os.path.exists(os.path.join(results_dir, name, "meta.json"))
+            or os.path.exists(os.path.join(results_dir, f"{name}.json")))
+
+
+def run_spec(run_config, results_dir=None):
+    name, spec, io_target = run_config
+    main.run_and_save((name, spec.build_writer, io_target), spec.batch_size, spec.batch_count, results_dir)
+
+
+def main_cli(args=None):
+    parser = argparse.ArgumentParser(description="Run every combination of the parameters in a sweep config")
+    parser.add_argument("config", help="JSON sweep config")
+    parser.add_argument("--filter", action="append", default=[],
+                        help="Only run the configs with names matching the pattern, e.g. 'sqlite_*', can be repeated")
+    parser.add_argument("--results-dir", default=main.RESULTS_DIR)
+    parser.add_argument("--parallel", type=int, default=main.PARALLEL_RUNS, help="Number of worker processes")
+    parser.add_argument("--force", action="store_true", help="Run even if the results already exist")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the runs")
+    args = parser.parse_args(args)
+
+    specs = expand(load_config(args.config))
+    if args.filter:
+        specs = [spec for spec in specs if any(fnmatch.fnmatchcase(spec.name, pattern) for pattern in args.filter)]
+
+    pending = []
+    for spec in specs:
+        if not args.force and result_exists(args.results_dir, spec.name):
+            print(f"Skipping {spec.name}, results exist")
+        else:
+            pending.append(spec)
+
+    print(f"{len(pending)} of {len(specs)} runs to do")
+    if args.dry_run:
+        for spec in pending:
+            print(spec.name)
+        return
+
+    run_fn = functools.partial(run_spec, results_dir=args.results_dir)
+    run_configs = [spec.run_config() for spec in pending]
+    if args.parallel > 1:
+        run_parallel(run_configs, run_fn, args.parallel)
+    else:
+        for run_config in run_configs:
+            run_fn(run_config)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,978 @@
+import contextlib
+import datetime
+import io
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+import uuid
+from unittest import mock
+
+import numpy as np
+from sqlalchemy.exc import DBAPIError
+
+from key_gen import UUID_EPOCH_OFFSET, UUID1KeyGenerator, UUID1FastRolloverKeyGenerator, UUID6KeyGenerator, \
+    UUID4KeyGenerator, UUID7KeyGenerator, ULIDKeyGenerator, SnowflakeKeyGenerator, CombKeyGenerator, \
+    RandomInt64KeyGenerator, SequentialInt64KeyGenerator, ShardPrefixKeyGenerator
+from payload import PayloadPool, TimestampCache, ms_datetime
+from analysis import Run
+from btree_stats import BTreeAnalyzer
+from db import SQLiteSizeTracker, get_engine
+try:
+    from contention import WriterThread
+    from io_probe import CgroupIOProbe, IOStats, ProcIOProbe, _parse_blkio_stats
+except ImportError:  # the probes need the docker package
+    IOStats = None
+from key_reservoir import KeyReservoir, _comparable
+from pipeline import PipelinedWriter
+from result_store import RunStore, load_run
+from sampler import MetricsSampler, RowCounter
+from scheduler import group_run_configs, run_parallel
+from simulator import BTreeModel, Simulator, sortable_keys
+from timing import LatencyHistogram
+from pg_copy import COPY_HEADER, COPY_TRAILER, BinaryCopyEncoder, BufferReader
+
+
+def _time_ns(year):
+    return int(datetime.datetime(year, 1, 1, tzinfo=datetime.timezone.utc).timestamp()) * 10**9
+
+
+def _pinned_clock(year):
+    return mock.patch("key_gen.time.time_ns", return_value=_time_ns(year))
+
+
+def _uuids(batch):
+    return [uuid.UUID(bytes=key) for key in UUID1KeyGenerator().to_list(batch)]
+
+
+class TestClockRollover(unittest.TestCase):
+
+    def test_time_ordered_uuids_past_2028(self):
+        for key_gen_class, version in ((UUID1KeyGenerator, 1), (UUID1FastRolloverKeyGenerator, 1),
+                                       (UUID6KeyGenerator, 6)):
+            with self.subTest(key_gen_class.__name__), _pinned_clock(2030):
+                keys = _uuids(key_gen_class().get_batch(100))
+                self.assertEqual({key.version for key in keys}, {version})
+                self.assertEqual(len(set(keys)), 100)
+
+    def test_uuid1_timestamp_past_2028(self):
+        with _pinned_clock(2030):
+            key, = _uuids(UUID1KeyGenerator().get_batch(1))
+        self.assertEqual(key.time, _time_ns(2030) // 100 + UUID_EPOCH_OFFSET)
+
+    def test_fast_rollover_ticks_past_2_64(self):
+        key_gen = UUID1FastRolloverKeyGenerator()
+        key_gen.set_state({"last_tick": (1 << 65) - 3})  # ahead of the clock, past 2^64
+        with _pinned_clock(2030):
+            keys = _uuids(key_gen.get_batch(10))
+        self.assertEqual([key.time for key in keys], [((1 << 65) - 2 + i) & ((1 << 60) - 1) for i in range(10)])
+
+
+class TestKeyLayout(unittest.TestCase):
+
+    def test_uuid_version_and_variant(self):
+        for key_gen, version in ((UUID1KeyGenerator(), 1), (UUID4KeyGenerator(), 4), (UUID6KeyGenerator(), 6),
+                                 (UUID7KeyGenerator(), 7), (UUID7KeyGenerator(partition=3), 7),
+                                 (CombKeyGenerator(), 4), (CombKeyGenerator(timestamp_first=True), 4)):
+            with self.subTest(type(key_gen).__name__):
+                keys = _uuids(key_gen.get_batch(100))
+                self.assertEqual({key.version for key in keys}, {version})
+                self.assertEqual({key.variant for key in keys}, {uuid.RFC_4122})
+
+    def test_uuid7_timestamp(self):
+        with _pinned_clock(2030):
+            key, = _uuids(UUID7KeyGenerator().get_batch(1))
+        self.assertEqual(key.int >> 80, _time_ns(2030) // 10**6)
+
+    def test_monotonic_while_the_clock_stands_still_or_goes_back(self):
+        for key_gen in (UUID6KeyGenerator(), UUID7KeyGenerator(), UUID7KeyGenerator(random_increment_bits=8),
+                        UUID7KeyGenerator(per_thread=True), ULIDKeyGenerator(), SnowflakeKeyGenerator(),
+                        SequentialInt64KeyGenerator()):
+            with self.subTest(type(key_gen).__name__):
+                batches = []
+                for year in (2030, 2030, 2025):
+                    with _pinned_clock(year):
+                        batches.append(sortable_keys(key_gen.get_batch(1000)))
+                keys = np.concatenate(batches)
+                self.assertTrue(np.all(keys[1:] > keys[:-1]))
+
+    def test_threads_apart_within_a_tick(self):
+        for key_gen in (UUID7KeyGenerator(per_thread=True), ULIDKeyGenerator(per_thread=True),
+                        SnowflakeKeyGenerator(per_thread=True)):
+            with self.subTest(type(key_gen).__name__), _pinned_clock(2030):
+                batches = [None, None]
+
+                def get_batch(i):
+                    batches[i] = key_gen.get_batch(100)
+
+                threads = [threading.Thread(target=get_batch, args=(i,)) for i in range(2)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                self.assertEqual(len(set(sortable_keys(np.concatenate(batches)).tolist())), 200)
+
+    def test_pid_partition(self):
+        for per_thread, pids in ((False, (5, 5 + (1 << 14))), (True, (5, 5 + (1 << 10)))):
+            with self.subTest(per_thread=per_thread):
+                key_gen = UUID7KeyGenerator(partition="pid", per_thread=per_thread)
+                partitions = []
+                for pid in pids:
+                    with mock.patch("os.getpid", return_value=pid):
+                        partitions.append(int(key_gen._partitions(1)[0]))
+                self.assertNotEqual(partitions[0], partitions[1])
+
+    def test_uuid1_timestamps_increase(self):
+        key_gen = UUID1KeyGenerator()
+        with _pinned_clock(2025):
+            keys = _uuids(key_gen.get_batch(1000)) + _uuids(key_gen.get_batch(1000))
+        times = [key.time for key in keys]
+        self.assertEqual(times, sorted(set(times)))
+
+    def test_state_round_trip(self):
+        for key_gen_class in (UUID1KeyGenerator, UUID6KeyGenerator, UUID7KeyGenerator, ULIDKeyGenerator,
+                              SnowflakeKeyGenerator):
+            with self.subTest(key_gen_class.__name__), _pinned_clock(2025):
+                key_gen = key_gen_class()
+                last = key_gen.get_batch(100)[-1:]
+                resumed = key_gen_class()
+                resumed.set_state(key_gen.get_state())
+                with _pinned_clock(2020):  # clock went back, e.g. a snapshot restored on another machine
+                    first = resumed.get_batch(1)
+                if key_gen_class is UUID1KeyGenerator:
+                    self.assertGreater(_uuids(first)[0].time, _uuids(last)[0].time)
+                else:
+                    self.assertGreater(sortable_keys(first)[0], sortable_keys(last)[0])
+
+        for key_gen in (SequentialInt64KeyGenerator(), ShardPrefixKeyGenerator()):
+            with self.subTest(type(key_gen).__name__):
+                key_gen.get_batch(100)
+                resumed = type(key_gen)()
+                resumed.set_state(key_gen.get_state())
+                np.testing.assert_array_equal(resumed.get_batch(100), key_gen.get_batch(100))
+
+
+class TestTimeBoundary(unittest.TestCase):
+
+    def test_keys_within_boundaries_of_their_millisecond(self):
+        ms = _time_ns(2025) // 10**6 + 123
+        for key_gen in (UUID6KeyGenerator(), UUID7KeyGenerator(), ULIDKeyGenerator(), SnowflakeKeyGenerator(),
+                        CombKeyGenerator(timestamp_first=True)):
+            with self.subTest(type(key_gen).__name__):
+                with mock.patch("key_gen.time.time_ns", return_value=ms * 10**6 + 300000):
+                    keys = key_gen.to_list(key_gen.get_batch(100))
+
+                def boundary(boundary_ms, lower):
+                    # mid-millisecond, like the callers
+                    return key_gen.time_boundary(ms_datetime(boundary_ms) + datetime.timedelta(microseconds=500),
+                                                 lower)
+
+                for key in keys:
+                    self.assertLess(boundary(ms - 1, False), key)
+                    self.assertLessEqual(boundary(ms, True), key)
+                    self.assertLessEqual(key, boundary(ms, False))
+                    self.assertLess(key, boundary(ms + 1, True))
+
+    def test_no_boundary_for_keys_not_ordered_by_time(self):
+        dt = ms_datetime(_time_ns(2025) // 10**6)
+        for key_gen in (UUID1KeyGenerator(), UUID1FastRolloverKeyGenerator(), UUID4KeyGenerator(), CombKeyGenerator()):
+            with self.subTest(type(key_gen).__name__):
+                self.assertIsNone(key_gen.time_boundary(dt))
+
+
+class TestPayloadPool(unittest.TestCase):
+
+    def test_payloads(self):
+        pool = PayloadPool(row_size=64, arena_rows=4)
+        payloads = pool.take(10) + [bytes(view) for view in pool.take(10, views=True)]
+        self.assertEqual({len(payload) for payload in payloads}, {64})
+        self.assertEqual(len(set(payloads)), 20)  # every slice handed out once, across regenerated arenas
+        self.assertTrue(all(re.fullmatch(rb"[A-Za-z0-9+/]+", payload) for payload in payloads))
+
+        array = pool.take_array(10)
+        self.assertEqual((array.shape, array.dtype), ((10, 64), np.uint8))
+
+    def test_views_outlive_the_arena(self):
+        pool = PayloadPool(row_size=64, arena_rows=4)
+        views = pool.take(4, views=True)
+        array = pool.take_array(2)
+        copies = [bytes(view) for view in views], array.copy()
+        pool.take(20)  # regenerates the arena several times
+        self.assertEqual([bytes(view) for view in views], copies[0])
+        np.testing.assert_array_equal(array, copies[1])
+
+
+class TestTimestampCache(unittest.TestCase):
+
+    def test_formatted_once_per_ms(self):
+        from writer import TIME_CREATED_SIZE
+
+        cache = TimestampCache()
+        ms = _time_ns(2025) // 10**6
+        with mock.patch("payload.time.time_ns", side_effect=[ms * 10**6, ms * 10**6 + 999999, (ms + 1) * 10**6]):
+            stamps = [cache.now() for _ in range(3)]
+        self.assertEqual(stamps[0], stamps[1])
+        self.assertEqual(datetime.datetime.fromisoformat(stamps[2]) - datetime.datetime.fromisoformat(stamps[0]),
+                         datetime.timedelta(milliseconds=1))
+        self.assertEqual({len(stamp) for stamp in stamps}, {TIME_CREATED_SIZE})
+
+
+class TestBinaryCopy(unittest.TestCase):
+
+    def test_encoded_rows_read_in_chunks(self):
+        keys = np.arange(3, dtype=">i8").view(np.uint8).reshape(3, 8)
+        time_created = np.array([list(f"2030-01-01T00:00:00.00000{i}".encode()) for i in range(3)], dtype=np.uint8)
+        buffer = BinaryCopyEncoder().encode(3, [keys, time_created])
+
+        reader = BufferReader(buffer)
+        data = b"".join(iter(lambda: reader.read(7), b""))
+
+        self.assertEqual(data, bytes(buffer))
+        self.assertTrue(data.startswith(COPY_HEADER) and data.endswith(COPY_TRAILER))
+        rows = data[len(COPY_HEADER):-len(COPY_TRAILER)]
+        row_size = 2 + 4 + 8 + 4 + 26
+        self.assertEqual(len(rows), 3 * row_size)
+        self.assertEqual(rows[row_size + 18:2 * row_size], b"2030-01-01T00:00:00.000001")
+
+
+class TestLatencyHistogram(unittest.TestCase):
+
+    def test_percentiles_within_bucket_error(self):
+        histogram = LatencyHistogram()
+        values = np.arange(1, 10001) / 10**5  # 10 us to 100 ms
+        for value in values:
+            histogram.record(value)
+
+        expected = np.percentile(values, [50, 90, 99], method="inverted_cdf")
+        np.testing.assert_allclose(histogram.percentiles([50, 90, 99]), expected, rtol=2**-5)
+        self.assertLessEqual(histogram.percentiles([100])[0], histogram.max)
+        self.assertEqual(histogram.max, 0.1)
+        self.assertEqual(histogram.count, 10000)
+
+    def test_small_values_exact(self):
+        histogram = LatencyHistogram()
+        for ns in (1, 2, 3, 40):
+            histogram.record(ns / 10**9)
+        self.assertEqual(histogram.percentiles([25, 50, 75]), [1e-9, 2e-9, 3e-9])
+
+    def test_merge_and_dict_round_trip(self):
+        first, second = LatencyHistogram(), LatencyHistogram(max_seconds=1)
+        for value in (0.001, 0.002):
+            first.record(value)
+        second.record(0.5)
+
+        merged = LatencyHistogram.from_dict(first.to_dict())
+        merged.merge(LatencyHistogram.from_dict(second.to_dict()))
+        first.merge(second)
+
+        self.assertEqual(merged.summary(), first.summary())
+        self.assertEqual((merged.count, merged.max), (3, 0.5))
+        with self.assertRaises(ValueError):
+            first.merge(LatencyHistogram(sub_bucket_bits=3))
+
+
+class TestRunStore(unittest.TestCase):
+
+    def test_round_trip(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        store = RunStore(directory.name, "run")
+        table = store.table("samples", [("rows_written", "<i8"), ("time_elapsed", "<f8")])
+        table.append(1000, 0.5)
+        table.append(2000, 1.25)
+        store.write_table("batches", [("build_time", "<f8")], {"build_time": [0.1, 0.2, 0.3]})
+        store.finish({"rows_written": [1000, 2000], "row_size": 546, "ops": {"insert": {"rows": 2000}}})
+
+        data = load_run("run", directory.name)
+        np.testing.assert_array_equal(data["rows_written"], [1000, 2000])
+        np.testing.assert_array_equal(data["time_elapsed"], [0.5, 1.25])
+        np.testing.assert_array_equal(data["build_time"], [0.1, 0.2, 0.3])
+        self.assertEqual((data["name"], data["row_size"], data["ops"]), ("run", 546, {"insert": {"rows": 2000}}))
+
+        with open(os.path.join(directory.name, "run", "meta.json")) as f:
+            self.assertNotIn("rows_written", f.read())  # streamed series aren't saved twice
+
+    def test_record_cut_short_by_a_crash_ignored(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        table = RunStore(directory.name, "crashed").table("samples", [("rows_written", "<i8")])
+        table.append(1000)
+        table._file.write(b"\x01\x02\x03")
+        table._file.flush()
+
+        data = load_run("crashed", directory.name)
+        self.assertNotIn("row_size", data)  # no meta.json
+        np.testing.assert_array_equal(data["rows_written"], [1000])
+
+
+class TestSimulator(unittest.TestCase):
+
+    def assert_tree_consistent(self, tree, rows):
+        counts = tree._counts
+        self.assertEqual(counts.sum(), rows)
+        self.assertTrue(np.all(counts <= tree.capacity))
+        self.assertTrue(np.all(tree._lows[1:] > tree._lows[:-1]))
+        self.assertEqual(tree.leaf_count, tree.splits + 1)
+        self.assertEqual(sorted(tree._pages.tolist()), list(range(tree.page_count)))
+
+    def test_sequential_keys_fill_the_leaves(self):
+        simulator = Simulator(SequentialInt64KeyGenerator(), page_size=4096)
+        simulator.run(100, 50)
+
+        tree = simulator.tree
+        self.assert_tree_consistent(tree, 5000)
+        self.assertTrue(np.all(tree._counts[:-1] == tree.capacity))
+        self.assertEqual(tree._pages.tolist(), list(range(tree.page_count)))  # leaves in physical order
+
+    def test_random_keys_split_in_half(self):
+        simulator = Simulator(RandomInt64KeyGenerator(), page_size=4096, rightmost_only=True)
+        simulator.run(100, 50)
+
+        tree = simulator.tree
+        self.assert_tree_consistent(tree, 5000)
+        self.assertTrue(np.all(tree._counts[:-1] >= tree.capacity // 2))  # the last leaf is split by appends
+        self.assertTrue(0.5 < tree._counts.mean() / tree.capacity < 0.9)
+        self.assertEqual(simulator.series["sim_page_splits"][-1], tree.splits)
+
+    def test_append_fill(self):
+        tree = BTreeModel(4096, 100, 8, append_fill=0.5)
+        tree.insert(sortable_keys(np.arange(1000, dtype=np.int64)))
+        self.assertTrue(np.all(tree._counts[:-1] == tree.capacity // 2))
+        self.assert_tree_consistent(tree, 1000)
+
+
+class TestGetEngine(unittest.TestCase):
+
+    def test_engine_per_options(self):
+        uri = "sqlite:///:memory:"
+        engine = get_engine(uri, connect_args={"check_same_thread": False})
+        self.assertIs(get_engine(uri, connect_args={"check_same_thread": False}), engine)
+
+        autocommit = get_engine(uri, isolation_level="AUTOCOMMIT")
+        self.assertIsNot(autocommit, engine)
+        self.assertEqual(autocommit.dialect.isolation_level, "AUTOCOMMIT")
+
+
+class TestAnalysis(unittest.TestCase):
+
+    def test_amplification_uses_the_key_size(self):
+        series = {"rows_written": [10, 20], "time_elapsed": [1, 2], "io_read": [0, 0], "io_write": [5460, 10920],
+                  "db_size": [5460, 5460]}
+        int64_run = Run({"name": "sqlite_clustered_int64_random", **series}, legacy=True)
+        uuid_run = Run({"name": "sqlite_clustered_uuid4", **series}, legacy=True)
+        saved_run = Run({"name": "uuid4_b1000", "row_size": 546, **series})
+
+        self.assertEqual((int64_run.row_size, uuid_run.row_size, saved_run.row_size), (546, 554, 546))
+        np.testing.assert_allclose(int64_run.write_amplification, [1.0, 1.0])
+        np.testing.assert_allclose(saved_run.size_amplification, [1.0, 0.5])
+        with self.assertRaises(ValueError):  # only the legacy names are guessed
+            Run({"name": "sqlite_clustered_int64_random", **series}).row_size
+
+    def test_per_row_and_throughput(self):
+        run = Run({"name": "run", "rows_written": [10, 20, 40], "time_elapsed": [1, 2, 3], "io_read": [0, 0, 0],
+                   "io_write": [100, 600, 1600], "db_size": [0, 0, 0]})
+        np.testing.assert_allclose(run.bytes_written_per_row, [50, 50])
+        np.testing.assert_allclose(run.rows_per_sec, [10, 20])
+
+
+class FailingWriter:
+    """
+    Prepares fail_after batches, then fails
+    """
+    connection = None
+
+    def __init__(self, fail_after):
+        self.batches_in_flight = 1
+        self._fail_after = fail_after
+
+    def prepare_batch(self, batch_size):
+        if not self._fail_after:
+            raise ValueError("prepare failed")
+        self._fail_after -= 1
+        return lambda: None, 0.0
+
+    def execute_batch(self, execute):
+        execute()
+        return 0.0
+
+
+class TestPipelinedWriter(unittest.TestCase):
+
+    def test_producer_error_raised_by_write_batch(self):
+        pipeline = PipelinedWriter(FailingWriter(1), 10, 5, depth=2)
+        pipeline.start()
+        self.addCleanup(pipeline.stop)
+        pipeline.write_batch(10)
+        with self.assertRaises(ValueError):
+            pipeline.write_batch(10)
+
+    def test_stop_with_full_queue_after_producer_error(self):
+        pipeline = PipelinedWriter(FailingWriter(2), 10, 5, depth=2)
+        pipeline.start()
+        while pipeline._queue.qsize() < 2:  # the queue is full, the error is waiting to be queued
+            time.sleep(0.01)
+
+        stopper = threading.Thread(target=pipeline.stop, daemon=True)
+        stopper.start()
+        stopper.join(5)
+        self.assertFalse(stopper.is_alive())
+
+
+class TestSnapshotDatabase(unittest.TestCase):
+
+    def test_names(self):
+        from writer import PG_MAX_IDENTIFIER_LENGTH, pg_snapshot_database
+
+        self.assertEqual(pg_snapshot_database("uuid4_1000000"), "snapshot_uuid4_1000000")
+
+        long_names = [f"postgres_uuid7_fastertime_copy_secondary_index_pipelined_{rows}" for rows in (10**8, 2 * 10**8)]
+        databases = [pg_snapshot_database(name) for name in long_names]
+        self.assertEqual([len(database) for database in databases], [PG_MAX_IDENTIFIER_LENGTH] * 2)
+        self.assertNotEqual(databases[0], databases[1])  # the same after truncation to 63 bytes
+        self.assertTrue(databases[0].startswith("snapshot_postgres_uuid7"))
+
+
+class SQLiteTestCase(unittest.TestCase):
+
+    def make_writer(self, key_gen=None, **kwargs):
+        from writer import SQLiteWriter
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        writer = SQLiteWriter(key_gen or UUID4KeyGenerator(), os.path.join(directory.name, "test.sqlite"),
+                              page_size=4096, **kwargs)
+        writer.init_db()
+        self.addCleanup(writer.disconnect)
+        return writer
+
+
+class TestInsertModes(SQLiteTestCase):
+
+    def test_rows_written(self):
+        from writer import INSERT_MODES
+
+        for insert_mode in INSERT_MODES:
+            with self.subTest(insert_mode):
+                writer = self.make_writer(key_gen=SequentialInt64KeyGenerator(), insert_mode=insert_mode)
+                writer.write_batch(100)
+                writer.write_batch(50)
+
+                rows = writer.connection.exec_driver_sql(
+                    "SELECT id, time_created, data FROM signals ORDER BY id").fetchall()
+                self.assertEqual([row[0] for row in rows], list(range(1, 151)))
+                for _, time_created, data in rows:
+                    self.assertEqual(len(data), 512)
+                    datetime.datetime.fromisoformat(time_created)
+
+    def test_raw_cursor_closed(self):
+        from writer import INSERT_RAW
+
+        writer = self.make_writer(insert_mode=INSERT_RAW)
+        cursors = []
+        with mock.patch.object(writer, "_raw_insert", side_effect=lambda cursor, rows: cursors.append(cursor)):
+            writer.write_batch(10)
+        with self.assertRaises(sqlite3.ProgrammingError):  # closed
+            cursors[0].execute("SELECT 1")
+
+
+class TestProfiling(SQLiteTestCase):
+
+    def test_frame_category(self):
+        from profiling import frame_category
+
+        sqlalchemy_file = os.path.join("site-packages", "sqlalchemy", "engine", "base.py")
+        for (filename, function), category in (
+                (("~", "<method 'execute' of 'sqlite3.Cursor' objects>"), "driver"),
+                (("~", "<built-in method builtins.len>"), None),
+                ((sqlalchemy_file, "_execute_context"), "sqlalchemy"),
+                ((os.path.join("package", "key_gen.py"), "get_batch"), "key_gen"),
+                ((os.path.join("package", "writer.py"), "generate_batch"), "generate_batch"),
+                ((os.path.join("package", "writer.py"), "execute_batch"), None)):
+            with self.subTest(function):
+                self.assertEqual(frame_category(filename, function), category)
+
+    def test_run_profiler(self):
+        from profiling import CATEGORIES, PROFILE_MODES, RunProfiler
+
+        output_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(output_dir.cleanup)
+        writer = self.make_writer(insert_mode="executemany")
+
+        profiler = RunProfiler(PROFILE_MODES, output_dir.name, tracemalloc_every=10, sampling_interval=0.001)
+        profiler.start()
+        for batch_i in range(25):
+            writer.write_batch(100)
+            profiler.batch_done(batch_i)
+        summary = profiler.stop(25)
+
+        self.assertEqual(sorted(os.listdir(output_dir.name)),
+                         ["profile.pstats", "tracemalloc_10.snapshot", "tracemalloc_20.snapshot",
+                          "tracemalloc_25.snapshot", "wall_samples.folded"])
+        for mode in PROFILE_MODES:
+            with self.subTest(mode):
+                self.assertTrue(all(0 <= summary[mode][category] <= 1 for category in CATEGORIES))
+        self.assertGreater(summary["cprofile"]["driver"], 0)
+        self.assertGreater(summary["cprofile"]["generate_batch"], summary["cprofile"]["key_gen"])
+
+        with self.assertRaises(ValueError):
+            RunProfiler(["perf"])
+
+
+class TestSQLiteSizeTracker(SQLiteTestCase):
+
+    def test_table_only_size_with_indexes(self):
+        writer = self.make_writer(clustered_index=False, indexes=["time_created"])
+        tracker = SQLiteSizeTracker(writer.size_connection, "signals")
+        exact = SQLiteSizeTracker(writer.size_connection, "signals", dbstat_interval=1)
+
+        for _ in range(20):
+            writer.write_batch(200)
+            size, exact_size = tracker.size(), exact.size()
+            self.assertLess(abs(size - exact_size), 0.1 * exact_size)
+
+        used_size = writer.size_connection.exec_driver_sql("PRAGMA page_count").scalar() * 4096
+        self.assertLess(exact_size, 0.9 * used_size)  # the indexes aren't counted
+
+
+class CountingProbe:
+    """
+    I/O probe whose counters are bumped by the test
+    """
+
+    def __init__(self):
+        self.read_bytes = 0
+
+    def read(self):
+        return IOStats(self.read_bytes, 0, None, None)
+
+
+def _record_run(run_config):
+    config_name, log_path, io_target = run_config
+    if config_name == "failing":
+        raise ValueError("failed run")
+    with open(log_path, "a") as f:
+        f.write(f"{config_name}\n")
+
+
+class TestScheduler(unittest.TestCase):
+
+    def test_groups(self):
+        probe = CountingProbe()
+        run_configs = [("pg_a", None, "postgres"), ("sqlite_a", None, "self"), ("pg_b", None, "postgres"),
+                       ("sqlite_b", None, "self"), ("probed_a", None, probe), ("probed_b", None, probe)]
+        self.assertEqual(group_run_configs(run_configs), [[0, 2], [1], [3], [4, 5]])
+
+    def test_run_parallel(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        pg_log, sqlite_log = (os.path.join(directory.name, name) for name in ("postgres", "sqlite"))
+        run_configs = [("pg_a", pg_log, "postgres"), ("sqlite_a", sqlite_log, "self"),
+                       ("pg_b", pg_log, "postgres"), ("failing", sqlite_log, "self")]
+
+        failed = run_parallel(run_configs, _record_run, workers=2)
+
+        self.assertEqual(failed, ["failing"])
+        with open(pg_log) as f:
+            self.assertEqual(f.read().split(), ["pg_a", "pg_b"])  # one after another, in order
+        with open(sqlite_log) as f:
+            self.assertEqual(f.read().split(), ["sqlite_a"])
+
+
+@unittest.skipIf(IOStats is None, "needs the docker package")
+class TestProcIOProbe(unittest.TestCase):
+
+    def test_read_from_several_threads(self):
+        probe = ProcIOProbe()
+        self.addCleanup(probe.close)
+        errors = []
+
+        def read():
+            try:
+                for _ in range(20000):
+                    probe.read()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=read) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertIsNone(probe.read().read_ops)
+
+
+@unittest.skipIf(IOStats is None, "needs the docker package")
+class TestCgroupIOProbe(unittest.TestCase):
+
+    def test_devices_summed(self):
+        cgroup_root = tempfile.TemporaryDirectory()
+        self.addCleanup(cgroup_root.cleanup)
+        cgroup_dir = os.path.join(cgroup_root.name, "system.slice", "docker-abc.scope")
+        os.makedirs(cgroup_dir)
+        io_stat = os.path.join(cgroup_dir, "io.stat")
+        with open(io_stat, "w") as f:
+            f.write("8:0 rbytes=4096 wbytes=8192 rios=1 wios=2 dbytes=0 dios=0\n"
+                    "8:16 rbytes=1 wbytes=2 rios=3 wios=4 dbytes=0 dios=0\n")
+
+        probe = CgroupIOProbe.for_container("abc", cgroup_root=cgroup_root.name)
+        self.addCleanup(probe.close)
+        before = probe.read()
+        self.assertEqual(before, IOStats(4097, 8194, 4, 6))
+
+        with open(io_stat, "r+") as f:  # the kernel updates the file in place
+            f.write("8:0 rbytes=8192")
+        self.assertEqual(probe.read() - before, IOStats(4096, 0, 0, 0))
+
+        with self.assertRaises(FileNotFoundError):
+            CgroupIOProbe.for_container("missing", cgroup_root=cgroup_root.name)
+
+    def test_ops_not_counted(self):
+        self.assertEqual(IOStats(10, 20, None, 4) - IOStats(1, 2, None, 1), IOStats(9, 18, None, 3))
+
+
+@unittest.skipIf(IOStats is None, "needs the docker package")
+class TestDockerStats(unittest.TestCase):
+
+    def test_blkio_stats(self):
+        stats = {"blkio_stats": {
+            "io_service_bytes_recursive": [{"op": "Read", "value": 4096}, {"op": "Write", "value": 8192},
+                                           {"op": "read", "value": 1}],
+            "io_serviced_recursive": [{"op": "Read", "value": 2}, {"op": "Write", "value": 3}],
+        }}
+        self.assertEqual(_parse_blkio_stats(stats), IOStats(4097, 8192, 2, 3))
+
+    def test_missing_counters(self):
+        for blkio_stats in ({"io_service_bytes_recursive": None}, {"io_service_bytes_recursive": []},
+                            {"io_service_bytes_recursive": None, "io_serviced_recursive": None}):
+            with self.subTest(blkio_stats):
+                self.assertEqual(_parse_blkio_stats({"blkio_stats": blkio_stats}), IOStats(0, 0, None, None))
+
+
+@unittest.skipIf(IOStats is None, "needs the docker package")
+class TestBTreeAnalyzer(SQLiteTestCase):
+
+    def test_reading_io_excluded_and_page_splits_estimated(self):
+        writer = self.make_writer(key_gen=RandomInt64KeyGenerator())
+        probe = CountingProbe()
+        sampler = MetricsSampler("test", writer, probe, RowCounter())
+        analyzer = BTreeAnalyzer(writer, exclude_io=sampler.exclude_io)
+        sampler.start()
+
+        btree_stats = writer.btree_stats
+
+        def reading():
+            probe.read_bytes += 1000  # the dbstat scan
+            return btree_stats()
+
+        with mock.patch.object(writer, "btree_stats", reading):
+            leaf_pages = []
+            for _ in range(3):
+                writer.write_batch(500)
+                probe.read_bytes += 10
+                analyzer.sample(0)
+                sampler.sample()
+                leaf_pages.append(analyzer.last["signals"].leaf_pages)
+
+        self.assertEqual(sampler.series["io_read"], [10, 20, 30])
+        self.assertEqual(analyzer.reading_series["btree_reading_io_read"], [1000] * 3)
+        self.assertEqual(analyzer.reading_summary(), {"count": 3, "io_read": 3000, "io_write": 0})
+        self.assertEqual(analyzer.series["btree_page_splits"], [pages - 1 for pages in leaf_pages])
+        self.assertGreater(leaf_pages[-1], leaf_pages[0])
+
+
+class TestKeyReservoir(unittest.TestCase):
+
+    def test_remove_before(self):
+        reservoir = KeyReservoir(recent_size=10)
+        reservoir.add(np.arange(0, 10).reshape(10, 1), ms=1000)
+        reservoir.add(np.arange(10, 15).reshape(5, 1), ms=2000)
+
+        self.assertEqual(reservoir.remove_before(2000), 10)
+        self.assertEqual(len(reservoir), 5)
+        self.assertTrue(np.all(reservoir.uniform(100) >= 10))
+        self.assertTrue(np.all(reservoir.recent(100) >= 10))
+
+        self.assertEqual(reservoir.remove_before(3000), 5)
+        self.assertEqual(len(reservoir), 0)
+
+    def test_zipfian(self):
+        reservoir = KeyReservoir(seed=0)
+        reservoir.add(np.arange(1000))
+        keys, counts = np.unique(reservoir.zipfian(10000), return_counts=True)
+        self.assertTrue(np.all((keys >= 0) & (keys < 1000)))
+
+        popular = keys[np.argsort(counts)[::-1][:10]]
+        self.assertGreater(counts.max(), 500)  # 10 expected with uniform popularity
+        self.assertGreater(popular.max() - popular.min(), 500)  # not the first keys written
+
+    def test_recent(self):
+        reservoir = KeyReservoir(recent_size=100, seed=0)
+        for start in range(0, 1000, 50):
+            reservoir.add(np.arange(start, start + 50))
+        self.assertEqual(set(reservoir.recent(10000).tolist()), set(range(900, 1000)))
+
+    def test_capacity(self):
+        reservoir = KeyReservoir(capacity=100, seed=0)
+        for start in range(0, 10000, 100):
+            reservoir.add(np.arange(start, start + 100))
+        self.assertEqual((len(reservoir), reservoir.seen), (100, 10000))
+        kept = reservoir.uniform(10000)
+        self.assertEqual(len(np.unique(kept)), 100)
+        self.assertTrue(3000 < kept.mean() < 7000)  # a sample of all the keys, not the first or last ones
+
+    def test_popped_keys_not_recent(self):
+        for keys in (np.arange(100), UUID4KeyGenerator().get_batch(100)):
+            with self.subTest(keys.dtype):
+                reservoir = KeyReservoir(recent_size=50)
+                reservoir.add(keys)
+                popped = _comparable(reservoir.pop(40))
+                self.assertFalse(np.any(np.isin(_comparable(reservoir.recent(1000)), popped)))
+                self.assertFalse(np.any(np.isin(_comparable(reservoir.uniform(1000)), popped)))
+
+
+@unittest.skipIf(IOStats is None, "needs the docker package")
+class TestPointLookupReader(SQLiteTestCase):
+
+    def test_lookup_phase(self):
+        from reads import PointLookupReader
+
+        writer = self.make_writer()
+        reader = PointLookupReader(writer, KeyReservoir(recent_size=100), 20)
+        reader.lookup_phase(0)  # nothing written yet
+        for _ in range(5):
+            writer.write_batch(100)
+        reader.lookup_phase(500)
+
+        self.assertEqual(reader.series["lookup_distribution"], [0] * 20 + [1] * 20 + [2] * 20)
+        self.assertEqual(set(reader.series["lookup_found"]), {1})
+        self.assertEqual(set(reader.summary()), {"uniform", "zipfian", "recent"})
+
+
+class TestReservoirCommittedKeys(SQLiteTestCase):
+
+    def test_keys_added_when_committed(self):
+        writer = self.make_writer(key_gen=SequentialInt64KeyGenerator())
+        writer.reservoir = KeyReservoir()
+
+        execute, _ = writer.prepare_batch(10)
+        self.assertEqual(len(writer.reservoir), 0)  # prepared, e.g. ahead in a pipeline, not written yet
+        writer.execute_batch(execute)
+        self.assertEqual(sorted(writer.reservoir.uniform(100).tolist())[-1], 10)
+
+        from writer import PreparedInsert
+
+        with self.assertRaises(ZeroDivisionError):
+            writer.execute_batch(PreparedInsert(lambda: 1 / 0, np.arange(11, 21)))
+        self.assertEqual(len(writer.reservoir), 10)
+
+
+class LockedWriter:
+    """
+    Fails the first executions of every batch with a lock error
+    """
+
+    def __init__(self, failures):
+        self._failures = failures
+        self.connection = None
+        self.timer = None
+        self.executed = []
+
+    def prepare_batch(self, batch_size):
+        self._attempts = 0
+        return len(self.executed), 0.0
+
+    def execute_batch(self, execute):
+        self._attempts += 1
+        if self._attempts <= self._failures:
+            raise DBAPIError("INSERT", None, sqlite3.OperationalError("database is locked"))
+        self.executed.append(execute)
+        return 0.0
+
+    def is_lock_error(self, error):
+        return "database is locked" in str(error.orig)
+
+
+@unittest.skipIf(IOStats is None, "needs the docker package")
+class TestWriterThread(unittest.TestCase):
+
+    def run_thread(self, writer, batch_count, **kwargs):
+        row_counter = RowCounter()
+        thread = WriterThread(writer, batch_count, 10, row_counter, threading.Barrier(1), **kwargs)
+        with mock.patch("contention.RETRY_BACKOFF", 0.0001):
+            thread.run()
+        self.assertIsNone(thread.error)
+        return thread, row_counter
+
+    def test_retried(self):
+        writer = LockedWriter(failures=2)
+        thread, row_counter = self.run_thread(writer, 3)
+        self.assertEqual(writer.executed, [0, 1, 2])
+        self.assertEqual((thread.retries, thread.gave_up, row_counter.value), (6, 0, 30))
+        self.assertEqual(len(thread.commit_latencies), 3)
+
+    def test_gave_up(self):
+        writer = LockedWriter(failures=5)
+        thread, row_counter = self.run_thread(writer, 3, max_retries=4)
+        self.assertEqual(writer.executed, [])
+        self.assertEqual((thread.retries, thread.gave_up, row_counter.value), (12, 3, 0))
+        self.assertEqual((len(thread.commit_latencies), len(thread.lock_waits)), (0, 3))
+
+
+@unittest.skipIf(IOStats is None, "needs the docker package")
+class TestSweep(unittest.TestCase):
+
+    def test_expand(self):
+        from sweep import expand
+
+        specs = expand({"engine": "sqlite", "key_gen": ["uuid4", "uuid7"], "batch_size": [100, 1000],
+                        "batch_count": 10, "page_size": 4096, "cache_size": 2097152})
+        self.assertEqual([spec.name for spec in specs], [
+            "sqlite_clustered_uuid4_b100x10_p4k_c2m", "sqlite_clustered_uuid4_b1000x10_p4k_c2m",
+            "sqlite_clustered_uuid7_b100x10_p4k_c2m", "sqlite_clustered_uuid7_b1000x10_p4k_c2m",
+        ])
+
+    def test_parameters_not_applying_to_the_engine(self):
+        from sweep import expand
+
+        specs = expand([{"engine": ["sqlite", "postgres"], "batch_count": 10, "page_size": [4096, 16384],
+                         "indexes": [[], ["time_created", "time_created,id"]]},
+                        {"engine": "postgres", "batch_count": 10}])  # a duplicate of a run of the first block
+        self.assertEqual([spec.name for spec in specs if spec.engine == "postgres"], [
+            f"postgres_uuid7_b{specs[0].batch_size}x10",
+            f"postgres_uuid7_b{specs[0].batch_size}x10_ix-time_created+time_created-id",
+        ])
+        self.assertEqual(len(specs), 6)
+        self.assertEqual(specs[-1].indexes, [("time_created",), ("time_created", "id")])
+
+    def test_invalid(self):
+        from sweep import expand
+
+        for config in ({"engine": "oracle"}, {"key_gen": "uuid5"}, {"page_sizes": [4096]}):
+            with self.subTest(config), self.assertRaises(ValueError):
+                expand(config)
+
+    def test_dry_run(self):
+        import main
+        from sweep import main_cli
+
+        results_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(results_dir.cleanup)
+        names = [f"sqlite_clustered_{key_gen}_b100x{main.BATCH_COUNT}_p16k_c10m"
+                 for key_gen in ("int64_sequential", "uuid4", "uuid7")]
+        os.makedirs(os.path.join(results_dir.name, names[1]))
+        with open(os.path.join(results_dir.name, names[1], "meta.json"), "w"):
+            pass
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            main_cli([os.path.join(os.path.dirname(__file__), "sweep_example.json"),
+                      "--filter", "sqlite_clustered_*_b100x*_p16k_c10m",
+                      "--results-dir", results_dir.name, "--dry-run"])
+        self.assertEqual(output.getvalue().splitlines(),
+                         [f"Skipping {names[1]}, results exist", "2 of 3 runs to do", names[0], names[2]])
+
+
+@unittest.skipIf(IOStats is None, "needs the docker package")
+class TestRunConcurrent(unittest.TestCase):
+
+    def test_writers(self):
+        from contention import run_concurrent
+        from writer import SQLiteWriter
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "test.sqlite")
+        writers = [SQLiteWriter(SequentialInt64KeyGenerator().for_writer(i, 3), path, page_size=4096) for i in range(3)]
+        writers[0].close = writers[0].disconnect  # keep the database file to count the rows
+
+        result = run_concurrent(("contention", writers, "self"), 5, 100, sample_interval=0.01)
+
+        self.assertEqual((result["writers"], result["gave_up"]), (3, [0, 0, 0]))
+        self.assertEqual([len(latencies) for latencies in result["execute_time"]], [5, 5, 5])
+        self.addCleanup(writers[0].disconnect)
+        count, distinct = writers[0].connection.exec_driver_sql(
+            f"SELECT COUNT(*), COUNT(DISTINCT id) FROM {writers[0].table.name}").one()
+        self.assertEqual((count, distinct), (1500, 1500))
+
+
+class TestFailedCommit(SQLiteTestCase):
+
+    def test_rolled_back(self):
+        from sqlalchemy.engine.base import RootTransaction
+
+        writer = self.make_writer(key_gen=SequentialInt64KeyGenerator())
+        execute, _ = writer.prepare_batch(10)
+        with mock.patch.object(RootTransaction, "_connection_commit_impl",
+                               side_effect=DBAPIError("COMMIT", None, sqlite3.OperationalError("database is locked"))):
+            with self.assertRaises(DBAPIError):
+                writer.execute_batch(execute)
+
+        writer.execute_batch(execute)  # retried on the same connection
+        count, = writer.connection.exec_driver_sql(f"SELECT COUNT(*) FROM {writer._sig_tbl.name}").one()
+        self.assertEqual(count, 10)
+
+
+class TestUpdatePayloads(SQLiteTestCase):
+
+    def test_insert_pool_untouched(self):
+        writer = self.make_writer()
+        writer.reservoir = KeyReservoir()
+        writer.write_batch(10)
+        offset = writer._payloads._offset
+
+        # the inserts may be prepared in a pipeline's producer thread at the same time
+        writer.update_batch(writer.reservoir.uniform(5))
+        self.assertEqual(writer._payloads._offset, offset)
+
+
+class TestFastForward(SQLiteTestCase):
+
+    def test_restored(self):
+        from snapshot import fast_forward
+
+        snapshot_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(snapshot_dir.cleanup)
+
+        built = KeyReservoir(recent_size=50)
+        writer = self.make_writer(key_gen=SequentialInt64KeyGenerator())
+        fast_forward(writer, "test", 250, 100, snapshot_dir=snapshot_dir.name, reservoir=built)
+        self.assertIsNone(writer.reservoir)
+        with open(os.path.join(snapshot_dir.name, "test_250.json")) as f:
+            self.assertEqual(json.load(f), {"rows": 250, "key_gen": "SequentialInt64KeyGenerator"})
+
+        reservoir = KeyReservoir(capacity=100)
+        writer = self.make_writer(key_gen=SequentialInt64KeyGenerator())
+        fast_forward(writer, "test", 250, 100, snapshot_dir=snapshot_dir.name, reservoir=reservoir)
+        count, = writer.connection.exec_driver_sql(f"SELECT COUNT(*) FROM {writer._sig_tbl.name}").one()
+        self.assertEqual(count, 250)
+        self.assertEqual(writer.key_gen.get_batch(1).tolist(), [251])
+
+        # sampled down to the capacity, the recent keys are the last ones written
+        self.assertEqual((len(reservoir), reservoir.seen), (100, 250))
+        self.assertTrue(set(reservoir.uniform(1000).tolist()) <= set(range(1, 251)))
+        self.assertTrue(set(reservoir.recent(1000).tolist()) <= set(range(201, 251)))
+
+
+class TestWriterRowcount(SQLiteTestCase):
+
+    def test_rows_updated_and_deleted(self):
+        writer = self.make_writer()
+        writer.reservoir = KeyReservoir()
+        writer.write_batch(10)
+        keys = writer.reservoir.pop(4)
+        missing = UUID4KeyGenerator().get_batch(3)
+
+        self.assertEqual(writer.update_batch(np.concatenate([keys, missing]))[2], 4)
+        self.assertEqual(writer.delete_batch(np.concatenate([keys, missing]))[2], 4)
+        self.assertEqual(writer.delete_batch(keys)[2], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
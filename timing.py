@@ -0,0 +1,161 @@
+import threading
+import time
+
+import numpy as np
+
+
+# phases of the write loop, in the order of the columns of the per-batch trace
+PHASES = (
+    "key_gen",  # generating the keys
+    "payload",  # payloads, timestamps and the row tuples/dicts
+    "statement",  # compiling the statement or encoding the COPY buffer
+    "execute",  # executing the statement
+    "commit",  # committing the transaction, i.e. the WAL/redo log flush
+    "probe",  # reading the I/O counters around the batch
+    "batch",  # the whole batch including the probes, see workload.WorkloadRunner.run_batch
+    "sample",  # taking a metrics sample
+    "read",  # read and lookup phases
+    "btree",  # reading the shape of the b-trees, see btree_stats.BTreeAnalyzer
+)
+
+
+class LatencyHistogram:
+    """
+    Durations counted in log-linear buckets like HdrHistogram: nanosecond values below 2 * 2^sub_bucket_bits
+    have their own bucket, above that every power of two is split into 2^sub_bucket_bits buckets,
+    so any value is recorded with a relative error below 2^-sub_bucket_bits.
+    Histograms with the same sub_bucket_bits can be merged by adding the counts.
+    """
+
+    def __init__(self, sub_bucket_bits=5, max_seconds=3600):
+        self.sub_bucket_bits = sub_bucket_bits
+        self._sub_buckets = 1 << sub_bucket_bits
+        self.counts = np.zeros(self._index(int(max_seconds * 10**9)) + 1, dtype=np.int64)
+        self.max = 0.0
+
+    def _index(self, ns):
+        shift = max(0, ns.bit_length() - self.sub_bucket_bits - 1)
+        return shift * self._sub_buckets + (ns >> shift)
+
+    def _bucket_value(self, index):
+        """
+        :return: Middle of the bucket in seconds
+        """
+        shift = max(0, index // self._sub_buckets - 1)
+        low = (index - shift * self._sub_buckets) << shift
+        return (low + ((1 << shift) - 1) / 2) / 10**9
+
+    def record(self, seconds):
+        index = min(self._index(max(0, int(seconds * 10**9))), len(self.counts) - 1)
+        self.counts[index] += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        if other.sub_bucket_bits != self.sub_bucket_bits:
+            raise ValueError("Only histograms with the same number of sub-buckets can be merged")
+
+        if len(other.counts) > len(self.counts):
+            self.counts = np.concatenate([self.counts, np.zeros(len(other.counts) - len(self.counts), np.int64)])
+        self.counts[:len(other.counts)] += other.counts
+        self.max = max(self.max, other.max)
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    def percentiles(self, percentiles):
+        """
+        :param percentiles: Percentiles between 0 and 100
+        :return: Values in seconds
+        """
+        cumulative = np.cumsum(self.counts)
+        ranks = np.ceil(np.asarray(percentiles) / 100 * cumulative[-1]).clip(min=1)
+        return [min(self._bucket_value(int(index)), self.max)
+                for index in np.searchsorted(cumulative, ranks)]
+
+    def summary(self):
+        """
+        :return: Count, percentiles and max in seconds
+        """
+        if not self.count:
+            return {"count": 0}
+        p50, p90, p99 = self.percentiles([50, 90, 99])
+        return {"count": self.count, "p50": p50, "p90": p90, "p99": p99, "max": self.max}
+
+    def to_dict(self):
+        """
+        :return: JSON-serializable histogram with only the non-empty buckets
+        """
+        indexes = np.flatnonzero(self.counts)
+        return {"sub_bucket_bits": self.sub_bucket_bits, "max": self.max,
+                "buckets": indexes.tolist(), "counts": self.counts[indexes].tolist()}
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls(data["sub_bucket_bits"], max_seconds=0)
+        size = max(data["buckets"], default=0) + 1
+        histogram.counts = np.zeros(max(size, len(histogram.counts)), dtype=np.int64)
+        histogram.counts[data["buckets"]] = data["counts"]
+        histogram.max = data["max"]
+        return histogram
+
+
+class PhaseTimer:
+    """
+    Durations of the phases of every batch, recorded into a LatencyHistogram per phase when the batch ends.
+    The phases may be timed in several threads, e.g. the producer thread of a pipeline.PipelinedWriter,
+    in which case the build phases in a batch's trace come from a batch being prepared ahead.
+    """
+
+    def __init__(self, trace_store=None):
+        """
+        :param trace_store: result_store.ColumnarWriter with TRACE_COLUMNS, the phases of every batch are appended to it
+        """
+        self._trace_store = trace_store
+        self._current = {}
+        self._lock = threading.Lock()
+        self.histograms = {phase: LatencyHistogram() for phase in PHASES}
+
+    def add(self, phase, seconds):
+        with self._lock:
+            self._current[phase] = self._current.get(phase, 0.0) + seconds
+
+    def lap(self, phase, start):
+        """
+        Add the time since start to the phase
+        :return: Current time, the start of the next phase
+        """
+        now = time.perf_counter()
+        self.add(phase, now - start)
+        return now
+
+    def end_batch(self):
+        with self._lock:
+            current, self._current = self._current, {}
+
+        for phase, seconds in current.items():
+            self.histograms[phase].record(seconds)
+
+        if self._trace_store is not None:
+            self._trace_store.append(*(current.get(phase, 0.0) for phase in PHASES))
+
+    def discard_batch(self):
+        """
+        Drop the phases timed so far, e.g. for a batch that wasn't written
+        """
+        with self._lock:
+            self._current = {}
+
+    def merge(self, other):
+        for phase, histogram in other.histograms.items():
+            self.histograms[phase].merge(histogram)
+
+    def summary(self):
+        """
+        :return: Percentiles of every phase that was timed
+        """
+        return {phase: histogram.summary() for phase, histogram in self.histograms.items() if histogram.count}
+
+    def to_dict(self):
+        return {phase: histogram.to_dict() for phase, histogram in self.histograms.items() if histogram.count}
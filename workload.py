@@ -0,0 +1,169 @@
+import collections
+import time
+
+from contention import latency_summary
+
+
+OP_INSERT = 0
+OP_UPDATE = 1  # update of random existing keys
+OP_DELETE = 2  # delete of random existing keys
+OP_RANGE_DELETE = 3  # TTL-style delete of the oldest rows, see Writer.delete_created_before
+
+OPERATIONS = {OP_INSERT: "insert", OP_UPDATE: "update", OP_DELETE: "delete", OP_RANGE_DELETE: "range_delete"}
+
+
+class Workload:
+    """
+    Mixture of operations run one batch at a time, every batch is a single type of operation,
+    so that its I/O and latency can be attributed to that type
+    """
+
+    def __init__(self, batch_size, batch_count, insert=1.0, update=0.0, delete=0.0, range_delete=0.0):
+        """
+        :param insert, update, delete, range_delete: Relative share of the batches of each type of operation.
+        A range delete removes the rows written by the oldest insert batch that wasn't deleted yet.
+        """
+        self.batch_size = batch_size
+        self.batch_count = batch_count
+        self.mix = {OP_INSERT: insert, OP_UPDATE: update, OP_DELETE: delete, OP_RANGE_DELETE: range_delete}
+
+    @property
+    def insert_only(self):
+        return not any(weight for op, weight in self.mix.items() if op != OP_INSERT)
+
+    def schedule(self):
+        """
+        :return: List of operations of all the batches, interleaved as evenly as the mix allows
+        (smooth weighted round-robin), so the run reaches a steady state instead of going through phases
+        """
+        total = sum(self.mix.values())
+        current = {op: 0.0 for op in self.mix}
+        ops = []
+
+        for _ in range(self.batch_count):
+            for op, weight in self.mix.items():
+                current[op] += weight
+            op = max(current, key=current.get)
+            current[op] -= total
+            ops.append(op)
+
+        return ops
+
+    def count(self, op):
+        return self.schedule().count(op)
+
+
+class WorkloadRunner:
+    """
+    Runs the batches of a Workload against a writer and records latency, rows and I/O of every batch
+    """
+
+    def __init__(self, writer, workload, io_probe, reservoir=None, batch_writer=None, store=None, timer=None):
+        """
+        :param reservoir: key_reservoir.KeyReservoir the updated and deleted keys are drawn from,
+        set as the writer's reservoir, needed for updates and deletes
+        :param batch_writer: Writes the insert batches instead of the writer, e.g. pipeline.PipelinedWriter
+        :param store: result_store.ColumnarWriter with OP_COLUMNS, every batch is appended to it
+        :param timer: timing.PhaseTimer timing the whole batch and the I/O probes
+        """
+        self._writer = writer
+        self._workload = workload
+        self._io_probe = io_probe
+        self._reservoir = reservoir
+        self._batch_writer = batch_writer or writer
+        self._store = store
+        self._timer = timer
+        # end time of every insert batch not removed by a range delete yet
+        self._insert_batch_ends = collections.deque()
+
+        if reservoir is not None:
+            writer.reservoir = reservoir
+        elif workload.mix[OP_UPDATE] or workload.mix[OP_DELETE]:
+            raise ValueError("Updates and deletes need a key reservoir to draw the existing keys from")
+
+        self.series = {
+            "op": [],
+            "op_rows": [],
+            "op_latency": [],
+            "op_io_read": [],
+            "op_io_write": [],
+        }
+
+    def run_batch(self, op):
+        """
+        :return: Seconds spent building the batch, seconds spent executing and committing it, number of rows
+        """
+        batch_size = self._workload.batch_size
+        start = time.perf_counter()
+        io_start = self._io_probe.read()
+        probe_time = time.perf_counter() - start
+
+        if op == OP_INSERT:
+            build_time, execute_time = self._batch_writer.write_batch(batch_size)
+            rows = batch_size
+            self._insert_batch_ends.append(time.time_ns() // 10**6 + 1)
+        elif op in (OP_UPDATE, OP_DELETE) and not len(self._reservoir):
+            build_time, execute_time, rows = 0.0, 0.0, 0  # nothing written yet
+        elif op == OP_UPDATE:
+            keys = self._reservoir.uniform(batch_size)
+            build_time, execute_time, rows = self._writer.update_batch(keys)
+        elif op == OP_DELETE:
+            keys = self._reservoir.pop(batch_size)
+            build_time, execute_time, rows = self._writer.delete_batch(keys)
+        elif self._insert_batch_ends:
+            build_time = 0.0
+            cutoff = self._insert_batch_ends.popleft()
+            execute_time, rows = self._writer.delete_created_before(cutoff)
+            if self._reservoir is not None:
+                self._reservoir.remove_before(cutoff)
+        else:
+            build_time, execute_time, rows = 0.0, 0.0, 0
+
+        probe_start = time.perf_counter()
+        io = self._io_probe.read() - io_start
+        end = time.perf_counter()
+
+        if self._timer is not None:
+            self._timer.add("probe", probe_time + end - probe_start)
+            self._timer.add("batch", end - start)
+
+        series = self.series
+        series["op"].append(op)
+        series["op_rows"].append(rows)
+        series["op_latency"].append(execute_time)
+        series["op_io_read"].append(io.read_bytes)
+        series["op_io_write"].append(io.write_bytes)
+
+        if self._store is not None:
+            self._store.append(op, rows, execute_time, io.read_bytes, io.write_bytes)
+
+        return build_time, execute_time, rows
+
+    def summary(self):
+        """
+        :return: Latency percentiles, rows and I/O per row for each type of operation
+        """
+        summary = {}
+        series = self.series
+
+        for op, name in OPERATIONS.items():
+            indexes = [i for i, o in enumerate(series["op"]) if o == op]
+            if not indexes:
+                continue
+
+            rows = sum(series["op_rows"][i] for i in indexes)
+            io_read = sum(series["op_io_read"][i] for i in indexes)
+            io_write = sum(series["op_io_write"][i] for i in indexes)
+            summary[name] = {
+                "batches": len(indexes),
+                "rows": rows,
+                "latency": latency_summary([series["op_latency"][i] for i in indexes]),
+                "io_read_per_row": io_read / rows if rows else None,
+                "io_write_per_row": io_write / rows if rows else None,
+            }
+
+            print(f"{name}: {len(indexes)} batches, {rows} rows ; "
+                  f"p50 {summary[name]['latency']['p50'] * 1000:.1f} ms ; "
+                  f"writes {io_write / rows if rows else 0:.0f} B per row")
+
+        return summary
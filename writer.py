@@ -1,32 +1,169 @@
+import contextlib
 import datetime
+import hashlib
 import os
-import base64
-from sqlalchemy import create_engine, BINARY
+import shutil
+import time
+
+import numpy as np
+from sqlalchemy import BINARY, bindparam
+from sqlalchemy.engine import make_url
 from sqlalchemy.dialects.postgresql import BYTEA
 
-from db import create_db_tables, get_table_def, clear_db, mariadb_table_size, pg_table_size
+from db import create_db_tables, get_table_def, clear_db, get_engine, mariadb_table_size, pg_table_size, \
+    pg_buffer_counters, pg_index_stats, mariadb_index_stats, sqlite_index_stats, SQLiteSizeTracker
+from payload import PayloadPool, TimestampCache, ms_datetime
+from pg_copy import BinaryCopyEncoder, BufferReader, COPY_CHUNK_SIZE, bytea_text
+from btree_stats import sqlite_btree_stats, mariadb_btree_stats, pg_btree_stats
+
+
+INSERT_VALUES = "values"  # one multi-VALUES statement per batch, compiled by SQLAlchemy
+INSERT_EXECUTEMANY = "executemany"  # cached insert statement executed with executemany()
+INSERT_RAW = "raw"  # DB-API fast path, bypassing SQLAlchemy
+INSERT_COPY = "copy"  # binary COPY FROM STDIN, PostgreSQL only
+
+INSERT_MODES = (INSERT_VALUES, INSERT_EXECUTEMANY, INSERT_RAW)
+
+COLUMNS = ("id", "time_created", "data")
+
+TIME_CREATED_SIZE = 26  # isoformat with microseconds
+PAYLOAD_SIZE = 512
+
+MARIADB_SNAPSHOT_DIR = "/var/lib/mysql_snapshots"  # inside the MariaDB container
+PG_MAX_IDENTIFIER_LENGTH = 63  # bytes, longer database names are silently truncated
+
+
+def logical_row_size(key_gen):
+    """
+    :return: Bytes of the key, time_created and data of a row, i.e. the data written by the user
+    """
+    return key_gen.key_size + TIME_CREATED_SIZE + PAYLOAD_SIZE
+
+
+def pg_snapshot_database(name):
+    """
+    :param name: Snapshot name, see snapshot.fast_forward
+    :return: Name of the template database holding the snapshot, the name shortened with a hash of it if too long,
+    so that truncation can't make two snapshots share a database
+    """
+    database = f"snapshot_{name}"
+    if len(database.encode()) > PG_MAX_IDENTIFIER_LENGTH:
+        digest = hashlib.sha1(name.encode()).hexdigest()[:16]
+        prefix = database.encode()[:PG_MAX_IDENTIFIER_LENGTH - len(digest) - 1].decode(errors="ignore")
+        database = f"{prefix}_{digest}"
+    return database
 
 
-def random_string(n):
-    s = base64.b64encode(os.urandom(n))
-    return s[:n]  # some characters are wasted
+class PreparedInsert:
+    """
+    Function executing the statement of a batch built by Writer.prepare_batch, with the keys of the batch
+    """
+
+    def __init__(self, execute, keys):
+        """
+        :param keys: Batch returned by KeyGenerator.get_batch()
+        """
+        self._execute = execute
+        self.keys = keys
+
+    def __call__(self):
+        return self._execute()
 
 
 class Writer:
+    payload_views = False  # whether the DB driver accepts memoryview payloads without copying them to bytes
+    insert_modes = INSERT_MODES
+
+    def __init__(self, key_gen, insert_mode=INSERT_VALUES):
+        if insert_mode not in self.insert_modes:
+            raise ValueError(f"Unknown insert mode {insert_mode}, expected one of {self.insert_modes}")
 
-    def __init__(self, key_gen):
         self._key_gen = key_gen
+        self._insert_mode = insert_mode
+        self._payloads = PayloadPool(row_size=PAYLOAD_SIZE)
+        self._timestamps = TimestampCache()
+        # inserts may be prepared in the producer thread of a pipeline.PipelinedWriter while updates run in the write
+        # loop, and neither the pool nor the cache is thread-safe
+        self._update_payloads = PayloadPool(row_size=PAYLOAD_SIZE)
+        self._update_timestamps = TimestampCache()
+        self._insert_stmt = None
+        self._update_stmt = None
+        self._delete_stmt = None
+        self._connection = None
+        self._size_connection = None
+        # how many prepared batches may exist at the same time, buffers reused between batches are kept this many times
+        self.batches_in_flight = 1
+        self.reservoir = None  # key_reservoir.KeyReservoir recording the keys of the committed batches
+        self.timer = None  # timing.PhaseTimer the phases of every batch are timed into
+
+    def _lap(self, phase, start):
+        """
+        Add the time since start to a phase of the current batch, if the phases are being timed
+        :return: Current time, the start of the next phase
+        """
+        if self.timer is None:
+            return time.perf_counter()
+        return self.timer.lap(phase, start)
+
+    def generate_rows(self, keys):
+        """
+        :param keys: Batch returned by KeyGenerator.get_batch()
+        :return: List of (id, time_created, data) tuples
+        """
+        start = time.perf_counter()
+        batch_size = len(keys)
+        keys = self._key_gen.to_list(keys)
+        start = self._lap("key_gen", start)
+
+        payloads = self._payloads.take(batch_size, views=self.payload_views)
+        now = self._timestamps.now
+        rows = [(key, now(), payload) for key, payload in zip(keys, payloads)]
+        self._lap("payload", start)
+
+        return rows
+
+    def generate_batch(self, keys):
+        rows = self.generate_rows(keys)
+
+        start = time.perf_counter()
+        batch = [dict(zip(COLUMNS, row)) for row in rows]
+        self._lap("payload", start)
+
+        return batch
+
+    def _build_insert(self, keys):
+        """
+        Generate the rows and build the statement for the configured insert mode
+        :param keys: Batch returned by KeyGenerator.get_batch()
+        :return: Function executing the statement
+        """
+        if self._insert_mode == INSERT_RAW:
+            rows = self.generate_rows(keys)
+            return lambda: self._execute_raw(rows)
+
+        batch = self.generate_batch(keys)
+
+        if self._insert_mode == INSERT_EXECUTEMANY:
+            if self._insert_stmt is None:
+                self._insert_stmt = self._sig_tbl.insert()
+            return lambda: self.connection.execute(self._insert_stmt, batch)
 
-    def generate_batch(self, batch_size):
+        start = time.perf_counter()
+        compiled = self._sig_tbl.insert().values(batch).compile(dialect=self.connection.dialect)
+        params = compiled.construct_params()
+        if compiled.positional:
+            params = tuple(params[name] for name in compiled.positiontup)
+        self._lap("statement", start)
 
-        return [
-            {
-                "id": self._key_gen.get_next(),
-                "time_created": datetime.datetime.now().isoformat(),
-                "data": random_string(512)  # 1KB
-            }
-            for _ in range(batch_size)
-        ]
+        return lambda: self.connection.exec_driver_sql(compiled.string, params)
+
+    def _execute_raw(self, rows):
+        with contextlib.closing(self.connection.connection.cursor()) as cursor:
+            self._raw_insert(cursor, rows)
+
+    def _raw_insert(self, cursor, rows):
+        placeholders = ", ".join(["?"] * len(COLUMNS))  # qmark is understood by both sqlite3 and mariadb
+        cursor.executemany(f"INSERT INTO {self._sig_tbl.name} ({', '.join(COLUMNS)}) VALUES ({placeholders})", rows)
 
     def init_db(self):
         """
@@ -34,12 +171,125 @@ class Writer:
         """
         raise NotImplementedError()
 
+    def prepare_batch(self, batch_size):
+        """
+        Generate next batch of data and build its statement, without writing anything to DB.
+        Can run ahead of the writes in another thread, see pipeline.PipelinedWriter
+        :return: PreparedInsert, seconds spent building the rows and the statement
+        """
+        start = time.perf_counter()
+        keys = self._key_gen.get_batch(batch_size)
+        self._lap("key_gen", start)
+        execute = PreparedInsert(self._build_insert(keys), keys)
+
+        return execute, time.perf_counter() - start
+
+    def execute_batch(self, execute):
+        """
+        :param execute: Function returned by prepare_batch, or any function executing statements
+        :return: Seconds spent executing and committing the batch
+        """
+        start = time.perf_counter()
+
+        transaction = self.connection.begin()
+        try:
+            execute()
+            executed = self._lap("execute", start)
+            transaction.commit()
+        except BaseException:
+            if not transaction.is_active:  # a failed commit leaves the DB-API connection in its transaction
+                self.connection.connection.rollback()
+            transaction.rollback()  # e.g. on a lock conflict, so the batch can be retried
+            raise
+        self._lap("commit", executed)
+        elapsed = time.perf_counter() - start
+
+        # only the committed keys, so lookups, updates and deletes never target rows that aren't written yet
+        if self.reservoir is not None and isinstance(execute, PreparedInsert):
+            self.reservoir.add(execute.keys)
+
+        return elapsed
+
     def write_batch(self, batch_size):
         """
         Generate next batch of data and write to DB
         :param batch_size: How many records to insert
+        :return: Seconds spent building the rows and the statement, seconds spent executing and committing it
         """
-        raise NotImplementedError()
+        execute, build_time = self.prepare_batch(batch_size)
+
+        return build_time, self.execute_batch(execute)
+
+    def update_batch(self, keys):
+        """
+        Overwrite time_created and data of existing rows
+        :param keys: Batch returned by KeyGenerator.get_batch()
+        :return: Seconds spent building the parameters, seconds spent executing and committing the update,
+        number of updated rows
+        """
+        start = time.perf_counter()
+
+        if self._update_stmt is None:
+            table = self._sig_tbl
+            self._update_stmt = table.update().where(table.c.id == bindparam("key")).values(
+                time_created=bindparam("new_time_created"), data=bindparam("new_data"))
+
+        payloads = self._update_payloads.take(len(keys), views=self.payload_views)
+        now = self._update_timestamps.now
+        params = [{"key": key, "new_time_created": now(), "new_data": payload}
+                  for key, payload in zip(self._key_gen.to_list(keys), payloads)]
+        build_time = time.perf_counter() - start
+
+        results = []
+        execute_time = self.execute_batch(lambda: results.append(self.connection.execute(self._update_stmt, params)))
+
+        return build_time, execute_time, results[0].rowcount
+
+    def delete_batch(self, keys):
+        """
+        :param keys: Batch returned by KeyGenerator.get_batch()
+        :return: Seconds spent building the parameters, seconds spent executing and committing the delete,
+        number of deleted rows
+        """
+        start = time.perf_counter()
+
+        if self._delete_stmt is None:
+            self._delete_stmt = self._sig_tbl.delete().where(self._sig_tbl.c.id == bindparam("key"))
+
+        params = [{"key": key} for key in self._key_gen.to_list(keys)]
+        build_time = time.perf_counter() - start
+
+        results = []
+        execute_time = self.execute_batch(lambda: results.append(self.connection.execute(self._delete_stmt, params)))
+
+        return build_time, execute_time, results[0].rowcount
+
+    def delete_created_before(self, ms):
+        """
+        TTL-style delete of the oldest rows. Done as a primary key range when the keys are ordered by time
+        of creation (see KeyGenerator.time_boundary), otherwise as a filter on time_created.
+        :param ms: Rows created before this time in milliseconds since the Unix epoch are deleted
+        :return: Seconds spent executing and committing the delete, number of deleted rows
+        """
+        table = self._sig_tbl
+        # mid-millisecond, so the float timestamp in time_boundary can't round down to the previous millisecond
+        upper = self._key_gen.time_boundary(ms_datetime(ms - 1) + datetime.timedelta(microseconds=500), lower=False)
+        if upper is not None:
+            statement = table.delete().where(table.c.id <= upper)
+        else:
+            statement = table.delete().where(table.c.time_created < ms_datetime(ms).isoformat(timespec="microseconds"))
+
+        results = []
+        execute_time = self.execute_batch(lambda: results.append(self.connection.execute(statement)))
+
+        return execute_time, results[0].rowcount
+
+    def is_lock_error(self, error):
+        """
+        :param error: sqlalchemy.exc.DBAPIError raised by write_batch
+        :return: Whether the batch failed on a lock conflict with another writer and can be retried
+        """
+        return False
 
     def db_size(self):
         """
@@ -48,31 +298,122 @@ class Writer:
 
         raise NotImplementedError()
 
+    def buffer_pool_counters(self):
+        """
+        :return: Cumulative (page reads served from the buffer pool, page reads from disk), None if not available
+        """
+        return None
+
+    def index_stats(self):
+        """
+        :return: List of (name, size in bytes, bytes read or None if not available) of the table and each of its
+        indexes, None if not available
+        """
+        return None
+
+    def btree_stats(self):
+        """
+        Read on the writer's connection, so it sees the table as the writes left it
+        :return: List of btree_stats.BTreeStats of the table and each of its indexes, None if not available
+        """
+        return None
+
+    @property
+    def key_gen(self):
+        return self._key_gen
+
+    @property
+    def row_size(self):
+        return logical_row_size(self._key_gen)
+
+    @property
+    def table(self):
+        return self._sig_tbl
+
+    def save_snapshot(self, snapshot_dir, name):
+        """
+        Save the current state of the table, keeping its physical layout, see snapshot.fast_forward
+        :param snapshot_dir: Local directory for snapshot files
+        """
+        raise NotImplementedError()
+
+    def restore_snapshot(self, snapshot_dir, name):
+        """
+        Replace the table with a snapshot saved by save_snapshot(), used instead of init_db()
+        """
+        raise NotImplementedError()
+
+    def snapshot_metadata(self, name):
+        """
+        :return: Where the snapshot is kept outside of snapshot_dir, saved in the snapshot's metadata
+        """
+        return {}
+
+    def _get_connection(self):
+        raise NotImplementedError()
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            self._connection = self._get_connection()
+
+        return self._connection
+
+    @property
+    def size_connection(self):
+        """
+        Separate long-lived connection for size probes, which may be taken from the metrics sampler thread
+        """
+        if self._size_connection is None:
+            # autocommit, so the probes don't keep a transaction open for the whole run
+            self._size_connection = self._get_connection().execution_options(isolation_level="AUTOCOMMIT")
+
+        return self._size_connection
+
+    def disconnect(self):
+        """
+        Close the connections without touching the data
+        """
+        if self._size_connection is not None:
+            self._size_connection.close()
+            self._size_connection = None
+
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
     def close(self):
-        return
+        self.disconnect()
 
 
 class SQLiteWriter(Writer):
+    payload_views = True
 
-    def __init__(self, key_gen, sqlite_file, clustered_index=True):
-        super(SQLiteWriter, self).__init__(key_gen)
+    def __init__(self, key_gen, sqlite_file, clustered_index=True, insert_mode=INSERT_VALUES, dbstat_interval=None,
+                 page_size=16384, cache_size=10485760, indexes=()):
+        """
+        :param indexes: Secondary indexes, see db.get_table_def
+        :param dbstat_interval: Measure the exact table size with a full dbstat scan every n size readings,
+        None to only scan when calibrating the page counters of the database file, see SQLiteSizeTracker
+        :param page_size: Page size in bytes, a power of two between 512 and 65536
+        :param cache_size: Size of the page cache in bytes
+        """
+        super(SQLiteWriter, self).__init__(key_gen, insert_mode)
         self._sqlite_file = sqlite_file
-        self._connection = None
+        self._dbstat_interval = dbstat_interval
+        self._page_size = page_size
+        self._cache_size = cache_size
+        self._size_tracker = None
 
         table_def_kwargs = {}
         if clustered_index:
             table_def_kwargs["info"] = {'without_rowid': True}
 
-        self._metadata, self._sig_tbl = get_table_def(self._key_gen.datatype(), **table_def_kwargs)
-
-    @classmethod
-    def _get_engine(cls, sqlite_file):
-        eng = create_engine("sqlite:///{}".format(sqlite_file))
-        conn = eng.connect()
-        return conn
+        self._metadata, self._sig_tbl = get_table_def(self._key_gen.datatype(), indexes, **table_def_kwargs)
 
     def _get_connection(self):
-        engine = self._get_engine(self._sqlite_file)
+        # size probes may run in the metrics sampler thread
+        engine = get_engine("sqlite:///{}".format(self._sqlite_file), connect_args={"check_same_thread": False})
         return engine.connect()
 
     @property
@@ -81,81 +422,84 @@ class SQLiteWriter(Writer):
             self._connection = self._get_connection()
             # self._connection.execute("PRAGMA journal_mode=WAL;")
 
-            self._connection.execute("PRAGMA cache_size = -10240;")  # 10MB
+            self._connection.execute(f"PRAGMA cache_size = -{self._cache_size // 1024};")  # negative is in KiB
 
         return self._connection
 
     def init_db(self):
 
-        bind = self.connection
+        connection = self.connection
 
-        clear_db(self._metadata, bind)
+        clear_db(self._metadata, connection)
 
-        create_db_tables(self._metadata, bind)
+        create_db_tables(self._metadata, connection)
 
-        self.connection.close()
+        connection.close()
         self._connection = None
+        connection = self.connection
 
-        self.connection.execute("PRAGMA journal_mode=OFF;")  # changing page size doesn't work when WL is enabled
+        connection.execute("PRAGMA journal_mode=OFF;")  # changing page size doesn't work when WL is enabled
 
-        bind.execute("PRAGMA page_size=16384;")  # 1 page = 16KB
-        bind.execute("VACUUM")
+        connection.execute(f"PRAGMA page_size={self._page_size};")
+        connection.execute("VACUUM")
 
-        self.connection.execute("PRAGMA journal_mode=WAL;")
+        connection.execute("PRAGMA journal_mode=WAL;")
 
-    def write_batch(self, batch_size):
+    def db_size(self):
+        if self._size_tracker is None:
+            self._size_tracker = SQLiteSizeTracker(self.size_connection, self._sig_tbl.name, self._dbstat_interval)
 
-        # print(self.connection.execute("SELECT * FROM dbstat WHERE name = 'signals' AND aggregate = TRUE").mappings().all())
-        #
-        # print(self.connection.execute("PRAGMA page_size").mappings().all())
+        return self._size_tracker.size()
 
-        batch = self.generate_batch(batch_size)
-        tx = self.connection.begin()
+        # return sqlite_db_size(self._sqlite_file)
 
-        self.connection.execute(self._sig_tbl.insert().values(batch))
-        tx.commit()
+    def index_stats(self):
+        return sqlite_index_stats(self.size_connection, self._sig_tbl.name)
 
-    def db_size(self):
-        stat = self.connection.execute("SELECT * FROM dbstat WHERE name = 'signals' AND aggregate = TRUE").mappings().all()[0]
+    def btree_stats(self):
+        return sqlite_btree_stats(self.connection, self._sig_tbl.name)
 
-        return stat["pgsize"]  # using aggregate mode, sot the size of table is the size of pages summed
+    def is_lock_error(self, error):
+        return "database is locked" in str(error.orig) or "database is busy" in str(error.orig)  # SQLITE_BUSY
 
-        # return sqlite_db_size(self._sqlite_file)
+    def save_snapshot(self, snapshot_dir, name):
+        self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE);")  # so that the database file is complete
+        self.disconnect()
+        shutil.copyfile(self._sqlite_file, os.path.join(snapshot_dir, f"{name}.sqlite"))
+
+    def restore_snapshot(self, snapshot_dir, name):
+        self.disconnect()
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(self._sqlite_file + suffix):
+                os.unlink(self._sqlite_file + suffix)
+        shutil.copyfile(os.path.join(snapshot_dir, f"{name}.sqlite"), self._sqlite_file)
+
+    def disconnect(self):
+        super(SQLiteWriter, self).disconnect()
+        self._size_tracker = None
 
     def close(self):
-        self.connection.close()
+        self.disconnect()
         os.unlink(self._sqlite_file)
 
 
 class MariaDBWriter(Writer):
 
-    def __init__(self, key_gen, connection_string):
-        super(MariaDBWriter, self).__init__(key_gen)
+    def __init__(self, key_gen, connection_string, insert_mode=INSERT_VALUES, container_name=None,
+                 buffer_pool_size=10485760, indexes=()):
+        """
+        :param indexes: Secondary indexes, see db.get_table_def
+        :param container_name: Container running the DB, needed for snapshots, defaults to the host name
+        :param buffer_pool_size: InnoDB buffer pool size in bytes, set when initializing the table
+        """
+        super(MariaDBWriter, self).__init__(key_gen, insert_mode)
         self._connection_string = connection_string
-        self._connection = None
-        self._metadata, self._sig_tbl = get_table_def(self._key_gen.datatype())
-
-    @classmethod
-    def _get_engine(cls, connection_string):
-        eng = create_engine(connection_string)
-        conn = eng.connect()
-        return conn
+        self._buffer_pool_size = buffer_pool_size
+        self._container_name = container_name or make_url(connection_string).host
+        self._metadata, self._sig_tbl = get_table_def(self._key_gen.datatype(), indexes)
 
     def _get_connection(self):
-        engine = self._get_engine(self._connection_string)
-        return engine.connect()
-
-    @property
-    def connection(self):
-        if self._connection is None:
-            self._connection = self._get_connection()
-            # self._connection.execute("PRAGMA journal_mode=WAL;")
-            #
-            # self._connection.execute("PRAGMA page_size = 16384;")  # 1 page = 16KB
-            #
-            # self._connection.execute("PRAGMA cache_size = -640;")  # 10MB
-
-        return self._connection
+        return get_engine(self._connection_string).connect()
 
     def init_db(self):
 
@@ -165,48 +509,94 @@ class MariaDBWriter(Writer):
 
         create_db_tables(self._metadata, connection)
 
-        connection.execute("SET GLOBAL innodb_buffer_pool_size=10485760;")  # for some reason configuring this in config files doesn't work
+        # for some reason configuring this in config files doesn't work
+        connection.execute(f"SET GLOBAL innodb_buffer_pool_size={self._buffer_pool_size};")
 
-    def write_batch(self, batch_size):
+        print(connection.execute("SHOW VARIABLES LIKE '%innodb_buffer_pool_size%';").mappings().all())
+
+    def is_lock_error(self, error):
+        return getattr(error.orig, "errno", None) in (1205, 1213)  # lock wait timeout, deadlock
+
+    def _table_files(self):
+        """
+        :return: Path of the table's files in the container without the .ibd/.cfg extension
+        """
+        datadir = self.connection.execute("SELECT @@datadir").scalar()
+        return os.path.join(datadir, make_url(self._connection_string).database, self._sig_tbl.name)
+
+    def save_snapshot(self, snapshot_dir, name):
+        # InnoDB transportable tablespace, the .ibd file is copied as it is, so the B-tree keeps its shape
+        from docker_utils import exec_in_container
+
+        table_files = self._table_files()
+        snapshot_files = os.path.join(MARIADB_SNAPSHOT_DIR, name)
+
+        self.connection.execute(f"FLUSH TABLES {self._sig_tbl.name} FOR EXPORT;")
+        try:
+            exec_in_container(self._container_name, [
+                "sh", "-c", f"mkdir -p {MARIADB_SNAPSHOT_DIR} && "
+                            f"cp {table_files}.ibd {snapshot_files}.ibd && cp {table_files}.cfg {snapshot_files}.cfg"
+            ])
+        finally:
+            self.connection.execute("UNLOCK TABLES;")
+
+    def restore_snapshot(self, snapshot_dir, name):
+        from docker_utils import exec_in_container
 
-        print(self.connection.execute("SHOW VARIABLES LIKE '%innodb_buffer_pool_size%';").mappings().all())
+        self.init_db()  # empty table with the same definition, its tablespace is then replaced by the snapshot
 
-        batch = self.generate_batch(batch_size)
-        tx = self.connection.begin()
+        table_files = self._table_files()
+        snapshot_files = os.path.join(MARIADB_SNAPSHOT_DIR, name)
 
-        self.connection.execute(self._sig_tbl.insert().values(batch))
-        tx.commit()
+        self.connection.execute(f"ALTER TABLE {self._sig_tbl.name} DISCARD TABLESPACE;")
+        exec_in_container(self._container_name, [
+            "sh", "-c", f"cp {snapshot_files}.ibd {table_files}.ibd && cp {snapshot_files}.cfg {table_files}.cfg && "
+                        f"chown mysql:mysql {table_files}.ibd {table_files}.cfg"
+        ])
+        self.connection.execute(f"ALTER TABLE {self._sig_tbl.name} IMPORT TABLESPACE;")
+
+    def snapshot_metadata(self, name):
+        return {"files": os.path.join(MARIADB_SNAPSHOT_DIR, name)}
 
     def db_size(self):
-        return mariadb_table_size(self._connection_string, "signals", "signals")
+        return mariadb_table_size(self.size_connection, "signals", "signals")
 
-    def close(self):
-        self.connection.close()
+    def buffer_pool_counters(self):
+        status = dict(self.size_connection.execute(
+            "SHOW GLOBAL STATUS WHERE Variable_name IN "
+            "('Innodb_buffer_pool_read_requests', 'Innodb_buffer_pool_reads');"
+        ).fetchall())
+        reads = int(status["Innodb_buffer_pool_reads"])
+        return int(status["Innodb_buffer_pool_read_requests"]) - reads, reads
+
+    def index_stats(self):
+        return mariadb_index_stats(self.size_connection, "signals", "signals")
+
+    def btree_stats(self):
+        return mariadb_btree_stats(self.connection, "signals", "signals")
 
 
 class PostgresWriter(Writer):
+    payload_views = True
+    insert_modes = INSERT_MODES + (INSERT_COPY,)
 
-    def __init__(self, key_gen, connection_string):
-        super(PostgresWriter, self).__init__(key_gen)
+    def __init__(self, key_gen, connection_string, insert_mode=INSERT_VALUES, indexes=()):
+        """
+        :param indexes: Secondary indexes, see db.get_table_def
+        """
+        super(PostgresWriter, self).__init__(key_gen, insert_mode)
         self._connection_string = connection_string
-        self._connection = None
 
         datatype = self._key_gen.datatype()
 
         if isinstance(datatype, BINARY):  # postgres doesnt support binary
             datatype = BYTEA(datatype.length)
 
-        self._metadata, self._sig_tbl = get_table_def(datatype)
-
-    @classmethod
-    def _get_engine(cls, connection_string):
-        eng = create_engine(connection_string)
-        conn = eng.connect()
-        return conn
+        self._metadata, self._sig_tbl = get_table_def(datatype, indexes)
+        self._copy_encoder = None
 
     def _get_connection(self):
-        engine = self._get_engine(self._connection_string)
-        return engine.connect()
+        return get_engine(self._connection_string).connect()
 
     @property
     def connection(self):
@@ -226,16 +616,74 @@ class PostgresWriter(Writer):
 
         create_db_tables(self._metadata, connection)
 
-    def write_batch(self, batch_size):
+    def _build_insert(self, keys):
+        if self._insert_mode != INSERT_COPY:
+            return super(PostgresWriter, self)._build_insert(keys)
+
+        start = time.perf_counter()
+        batch_size = len(keys)
+        if keys.ndim == 1:  # int64 keys are sent as big-endian BIGINT
+            keys = keys.astype(">i8").view(np.uint8).reshape(batch_size, 8)
+        start = self._lap("key_gen", start)
+
+        now = self._timestamps.now
+        # stamped per row like the other insert modes, the strings are fixed width
+        time_created = np.frombuffer("".join([now() for _ in range(batch_size)]).encode(),
+                                     dtype=np.uint8).reshape(batch_size, -1)
+        data = bytea_text(self._payloads.take_array(batch_size))
+        start = self._lap("payload", start)
+
+        if self._copy_encoder is None or self._copy_encoder.buffer_count != self.batches_in_flight:
+            self._copy_encoder = BinaryCopyEncoder(self.batches_in_flight)
+        buffer = self._copy_encoder.encode(batch_size, [keys, time_created, data])
+        sql = f"COPY {self._sig_tbl.name} ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT binary)"
+        self._lap("statement", start)
+
+        return lambda: self._execute_copy(sql, buffer)
+
+    def _execute_copy(self, sql, buffer):
+        with contextlib.closing(self.connection.connection.cursor()) as cursor:
+            cursor.copy_expert(sql, BufferReader(buffer), COPY_CHUNK_SIZE)
+
+    def _raw_insert(self, cursor, rows):
+        from psycopg2.extras import execute_values
 
-        batch = self.generate_batch(batch_size)
-        tx = self.connection.begin()
+        execute_values(cursor, f"INSERT INTO {self._sig_tbl.name} ({', '.join(COLUMNS)}) VALUES %s", rows,
+                       page_size=len(rows))
 
-        self.connection.execute(self._sig_tbl.insert().values(batch))
-        tx.commit()
+    def is_lock_error(self, error):
+        return getattr(error.orig, "pgcode", None) in ("40P01", "40001", "55P03")  # deadlock, serialization, lock
+
+    def _recreate_database(self, database, template):
+        """
+        CREATE DATABASE ... TEMPLATE copies the data files, so the B-trees keep their shape.
+        No connections to either database may be open while doing this.
+        """
+        self.disconnect()
+        get_engine(self._connection_string).dispose()
+
+        maintenance_uri = make_url(self._connection_string).set(database="postgres")
+        with get_engine(str(maintenance_uri), isolation_level="AUTOCOMMIT").connect() as connection:
+            connection.execute(f'DROP DATABASE IF EXISTS "{database}" WITH (FORCE);')
+            connection.execute(f'CREATE DATABASE "{database}" TEMPLATE "{template}";')
+
+    def save_snapshot(self, snapshot_dir, name):
+        self._recreate_database(pg_snapshot_database(name), make_url(self._connection_string).database)
+
+    def restore_snapshot(self, snapshot_dir, name):
+        self._recreate_database(make_url(self._connection_string).database, pg_snapshot_database(name))
+
+    def snapshot_metadata(self, name):
+        return {"database": pg_snapshot_database(name)}
 
     def db_size(self):
-        return pg_table_size(self._connection_string, "signals")
+        return pg_table_size(self.size_connection, "signals")
 
-    def close(self):
-        self.connection.close()
+    def buffer_pool_counters(self):
+        return pg_buffer_counters(self.size_connection, "signals")
+
+    def index_stats(self):
+        return pg_index_stats(self.size_connection, "signals")
+
+    def btree_stats(self):
+        return pg_btree_stats(self.connection, "signals")